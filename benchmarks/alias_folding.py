@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Compare the original ASCII alias folding against `aliases.ascii_aliases` on every name in consolidated output: each
+place's name, abbreviation and aliases, plus the city names in any Geonames files given.
+
+    python benchmarks/alias_folding.py us-places.ndjson --geonames /tmp/places_workdir/geonames
+
+Each pass folds the names the way the build does, in pairs of name and abbreviation, so the cached engine sees
+names repeat as often as they do in a build. The passes are repeated over just the names that are not ASCII, which
+are the ones that cost anything to fold.
+"""
+
+import argparse
+import json
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+import aliases  # noqa: E402
+
+
+def original_ascii_alias(s):
+    if not s:
+        return None
+    try:
+        s.encode("ascii")
+        return None
+    except Exception:
+        pass
+    alias = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+    if alias == s:
+        return None
+    return alias
+
+
+def load_names(paths, geonames_dir):
+    names = []
+    for path in paths:
+        with open(path, "rb") as stream:
+            for i, line in enumerate(stream):
+                if i % 2:
+                    continue
+                place = json.loads(line)
+                names.append(place["name"])
+                names.append(place.get("abbreviated_name"))
+                names.extend(alias["name"] for alias in place.get("aliases", ()))
+    if geonames_dir:
+        for path in sorted(geonames_dir.glob("*.txt")):
+            with open(path, encoding="utf-8") as stream:
+                for line in stream:
+                    fields = line.split("\t")
+                    if len(fields) > 2:
+                        names.append(fields[2])
+    return names
+
+
+def fold_original(names):
+    return [original_ascii_alias(name) for name in names]
+
+
+def fold_cached(names):
+    folded = []
+    for name, abbreviated_name in zip(names[::2], names[1::2]):
+        folded.extend(aliases.ascii_aliases((name, abbreviated_name)))
+    if len(names) % 2:
+        folded.append(aliases.ascii_alias(names[-1]))
+    return folded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", type=Path, help="consolidated output files to take names from")
+    parser.add_argument("--geonames", type=Path, metavar="DIR", help="also take the city names from Geonames files")
+    parser.add_argument("--repeat", type=int, default=5, help="take the best of this many passes (default: 5)")
+    args = parser.parse_args()
+
+    names = load_names(args.paths, args.geonames)
+    expected = fold_original(names)
+    non_ascii = sum(1 for name in names if name and not name.isascii())
+    print(f"{len(names)} names, {len(set(names))} distinct, {non_ascii} not ASCII, "
+          f"{sum(1 for alias in expected if alias)} aliased")
+
+    print(f"{'names':10} {'engine':10} {'seconds':>8} {'names/s':>12}")
+    for subset, batch in (("all", names), ("not ASCII", [name for name in names if name and not name.isascii()])):
+        for name, fold in (("original", fold_original), ("cached", fold_cached)):
+            if fold(names) != expected:
+                raise SystemExit(f"{name} folding disagrees with the original")
+            best = min(_timed(fold, batch) for _ in range(args.repeat))
+            print(f"{subset:10} {name:10} {best:8.4f} {len(batch) / best:12.0f}")
+
+
+def _timed(fold, names):
+    aliases._fold.cache_clear()
+    start = time.perf_counter()
+    fold(names)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    sys.exit(main())
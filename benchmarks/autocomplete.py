@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measure how long the search index takes to build and to load, and the latency and throughput of autocomplete
+queries: prefixes of random places' names, one to eight characters long, half of them kept to the place's state.
+With --http, the same queries are also sent to the server, one connection at a time.
+
+    python benchmarks/autocomplete.py docker-output/us-places.ndjson --queries 100000 --http 2000
+"""
+
+import argparse
+import http.client
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+from place_search import PlaceSearch, SearchHandler, build  # noqa: E402
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6
+
+    print(f"{label}: {len(latencies)} queries, {len(latencies) / total:.0f} queries/s, latency p50 "
+          f"{percentile(0.5):.0f}us, p95 {percentile(0.95):.0f}us, p99 {percentile(0.99):.0f}us, "
+          f"max {latencies[-1] * 1e6:.0f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path, help="uncompressed consolidated output file")
+    parser.add_argument("--queries", type=int, default=100000, help="number of queries to run against the library")
+    parser.add_argument("--http", type=int, default=0, metavar="N", help="number of queries to send to the server")
+    parser.add_argument("--limit", type=int, default=10, help="places returned per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "places.search"
+        _, build_seconds = timed(build, args.output, path)
+        places, load_seconds = timed(PlaceSearch, args.output, path)
+        _, first_seconds = timed(places.complete, "a", limit=args.limit)
+        print(f"build {build_seconds:.2f}s ({path.stat().st_size / 2 ** 20:.1f} MiB), load {load_seconds * 1e3:.1f}ms, "
+              f"first query {first_seconds * 1e3:.1f}ms")
+
+        rng = random.Random(args.seed)
+        queries = []
+        for place in (rng.randrange(len(places)) for _ in range(max(args.queries, args.http))):
+            metadata = places.metadata(place)
+            name = metadata["name"]
+            state = metadata["parent_id"] if rng.random() < 0.5 else None
+            queries.append((name[:rng.randint(1, min(8, len(name)))], state))
+
+        latencies = []
+        for text, state in queries[:args.queries]:
+            start = time.perf_counter()
+            places.complete(text, state, args.limit)
+            latencies.append(time.perf_counter() - start)
+        report("library", latencies)
+
+        if args.http:
+            handler = type("Handler", (SearchHandler,), {"places": places, "log_message": lambda *args: None})
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            latencies = []
+            for text, state in queries[:args.http]:
+                parameters = {"q": text, "limit": args.limit, **({"state": state} if state else {})}
+                start = time.perf_counter()
+                connection = http.client.HTTPConnection(*server.server_address)
+                connection.request("GET", f"/complete?{urlencode(parameters)}")
+                connection.getresponse().read()
+                connection.close()
+                latencies.append(time.perf_counter() - start)
+            server.shutdown()
+            server.server_close()
+            report("http", latencies)
+        places.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
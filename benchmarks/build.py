@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Time each consolidation stage and the whole build, against synthetic data or the real Census Bureau and Geonames
+archives, and compare the timings with a stored baseline.
+
+    python benchmarks/build.py generate /tmp/synthetic --states 52 --places 400
+    python benchmarks/build.py run --save-baseline benchmarks/baseline.json
+    python benchmarks/build.py run --baseline benchmarks/baseline.json
+    python benchmarks/build.py run --zips . --baseline benchmarks/baseline-real.json
+    python benchmarks/build.py run -- --json-backend orjson --precision 5
+
+`run` builds a synthetic working directory unless given `--workdir` (one already generated or extracted) or
+`--zips` (a directory of archives to extract and convert first, which needs `ogr2ogr`). Arguments after `--` are
+passed to consolidate_generated_geojson.py. Comparing with a baseline exits non-zero if the build or any stage got
+slower by more than the threshold.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DOCKER_DIR = Path(__file__).resolve().parent.parent / "docker"
+sys.path.insert(0, str(DOCKER_DIR))
+
+from consolidate_generated_geojson import EXTRA_ZIP_CODE_INFO  # noqa: E402
+import extract_and_convert_zipfiles  # noqa: E402
+
+# (FIPS code, name, postal abbreviation) of every state the Census Bureau covers, plus Puerto Rico.
+STATES = [
+    ("01", "Alabama", "AL"), ("02", "Alaska", "AK"), ("04", "Arizona", "AZ"), ("05", "Arkansas", "AR"),
+    ("06", "California", "CA"), ("08", "Colorado", "CO"), ("09", "Connecticut", "CT"), ("10", "Delaware", "DE"),
+    ("11", "District of Columbia", "DC"), ("12", "Florida", "FL"), ("13", "Georgia", "GA"), ("15", "Hawaii", "HI"),
+    ("16", "Idaho", "ID"), ("17", "Illinois", "IL"), ("18", "Indiana", "IN"), ("19", "Iowa", "IA"),
+    ("20", "Kansas", "KS"), ("21", "Kentucky", "KY"), ("22", "Louisiana", "LA"), ("23", "Maine", "ME"),
+    ("24", "Maryland", "MD"), ("25", "Massachusetts", "MA"), ("26", "Michigan", "MI"), ("27", "Minnesota", "MN"),
+    ("28", "Mississippi", "MS"), ("29", "Missouri", "MO"), ("30", "Montana", "MT"), ("31", "Nebraska", "NE"),
+    ("32", "Nevada", "NV"), ("33", "New Hampshire", "NH"), ("34", "New Jersey", "NJ"), ("35", "New Mexico", "NM"),
+    ("36", "New York", "NY"), ("37", "North Carolina", "NC"), ("38", "North Dakota", "ND"), ("39", "Ohio", "OH"),
+    ("40", "Oklahoma", "OK"), ("41", "Oregon", "OR"), ("42", "Pennsylvania", "PA"), ("44", "Rhode Island", "RI"),
+    ("45", "South Carolina", "SC"), ("46", "South Dakota", "SD"), ("47", "Tennessee", "TN"), ("48", "Texas", "TX"),
+    ("49", "Utah", "UT"), ("50", "Vermont", "VT"), ("51", "Virginia", "VA"), ("53", "Washington", "WA"),
+    ("54", "West Virginia", "WV"), ("55", "Wisconsin", "WI"), ("56", "Wyoming", "WY"), ("72", "Puerto Rico", "PR"),
+]
+
+# Place names are drawn from a small pool so that, as in the real data, names repeat within a state and the ZIP
+# code stage has city names both to alias and to skip.
+NAME_PARTS = [
+    "Spring", "Green", "Oak", "Maple", "River", "Lake", "Fair", "Mount", "Cedar", "Pine", "Añasco", "Cañon",
+]
+NAME_SUFFIXES = ["field", "ville", "wood", "dale", " Hills", " City", " Park", "ton", " Springs", "burg"]
+
+
+def polygon(rng, x, y, radius, vertices):
+    """A closed, roughly circular ring of `vertices` points around (x, y), as Census coordinates would be."""
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * rng.uniform(0.7, 1.0)
+        ring.append([round(x + r * math.cos(angle), 6), round(y + r * math.sin(angle), 6)])
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def write_collection(path, name, features):
+    """Write a FeatureCollection laid out as ogr2ogr writes one, with each feature on a line of its own."""
+    with open(path, "w", encoding="utf-8") as stream:
+        stream.write('{\n"type": "FeatureCollection",\n')
+        stream.write(f'"name": "{name}",\n')
+        stream.write('"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" } },\n')
+        stream.write('"features": [\n')
+        lines = (
+            json.dumps({"type": "Feature", "properties": properties, "geometry": geometry}, ensure_ascii=False)
+            for properties, geometry in features
+        )
+        stream.write(",\n".join(lines))
+        stream.write("\n]\n}\n")
+
+
+def generate(workdir, states=len(STATES), counties=60, places=200, zip_codes=600, vertices=64, seed=0):
+    """
+    Write a working directory shaped like the one extract_and_convert_zipfiles.py produces: Census Bureau
+    FeatureCollections with the 2015 cartographic boundary schemas, and Geonames postal code TSVs.
+
+    Every state is a cell in a grid of one-degree squares, and its counties, places and ZIP code tabulation areas
+    are polygons of `vertices` points scattered inside it. Puerto Rico is always included, so that both Geonames
+    files are exercised, as are the states `EXTRA_ZIP_CODE_INFO` refers to.
+    """
+    rng = random.Random(seed)
+    required = {"PR"} | {abbreviation for _, abbreviation in EXTRA_ZIP_CODE_INFO.values()}
+    chosen = [state for state in STATES if state[2] in required]
+    chosen += [state for state in STATES if state[2] not in required][:max(0, states - len(chosen))]
+    chosen.sort()
+
+    geojson_dir = Path(workdir) / "geojson"
+    geonames_dir = Path(workdir) / "geonames"
+    geojson_dir.mkdir(parents=True, exist_ok=True)
+    geonames_dir.mkdir(parents=True, exist_ok=True)
+
+    columns = math.ceil(math.sqrt(len(chosen)))
+    origins = {fips: (-125 + i % columns, 25 + i // columns) for i, (fips, _, _) in enumerate(chosen)}
+
+    def inside(fips, radius):
+        x, y = origins[fips]
+        return rng.uniform(x + radius, x + 1 - radius), rng.uniform(y + radius, y + 1 - radius)
+
+    nation_ring = [[-125, 25], [-125 + columns, 25], [-125 + columns, 25 + columns], [-125, 25 + columns]]
+    write_collection(geojson_dir / "cb_2015_us_nation_5m.json", "cb_2015_us_nation_5m", [(
+        {"AFFGEOID": "0100000US", "GEOID": "US", "NAME": "United States"},
+        {"type": "Polygon", "coordinates": [nation_ring + [nation_ring[0]]]},
+    )])
+
+    write_collection(geojson_dir / "cb_2015_us_state_500k.json", "cb_2015_us_state_500k", [
+        ({"STATEFP": fips, "STATENS": f"{rng.randrange(10 ** 8):08d}", "AFFGEOID": f"0400000US{fips}",
+          "GEOID": fips, "STUSPS": abbreviation, "NAME": name, "LSAD": "00",
+          "ALAND": rng.randrange(10 ** 11), "AWATER": rng.randrange(10 ** 10)},
+         polygon(rng, origins[fips][0] + 0.5, origins[fips][1] + 0.5, 0.5, vertices * 4))
+        for fips, name, abbreviation in chosen
+    ])
+
+    write_collection(geojson_dir / "cb_2015_us_county_500k.json", "cb_2015_us_county_500k", [
+        ({"STATEFP": fips, "COUNTYFP": f"{i * 2 + 1:03d}", "COUNTYNS": f"{rng.randrange(10 ** 8):08d}",
+          "AFFGEOID": f"0500000US{fips}{i * 2 + 1:03d}", "GEOID": f"{fips}{i * 2 + 1:03d}",
+          "NAME": rng.choice(NAME_PARTS) + rng.choice(NAME_SUFFIXES), "LSAD": "06",
+          "ALAND": rng.randrange(10 ** 10), "AWATER": rng.randrange(10 ** 8)},
+         polygon(rng, *inside(fips, 0.05), 0.05, vertices))
+        for fips, _, _ in chosen
+        for i in range(counties)
+    ])
+
+    city_names = {}
+    for fips, _, _ in chosen:
+        names = city_names[fips] = [rng.choice(NAME_PARTS) + rng.choice(NAME_SUFFIXES) for _ in range(places)]
+        write_collection(geojson_dir / f"cb_2015_{fips}_place_500k.json", f"cb_2015_{fips}_place_500k", [
+            ({"STATEFP": fips, "PLACEFP": f"{i:05d}", "PLACENS": f"{rng.randrange(10 ** 8):08d}",
+              "AFFGEOID": f"1600000US{fips}{i:05d}", "GEOID": f"{fips}{i:05d}", "NAME": name, "LSAD": "25",
+              "ALAND": rng.randrange(10 ** 8), "AWATER": rng.randrange(10 ** 6)},
+             polygon(rng, *inside(fips, 0.01), 0.01, vertices))
+            for i, name in enumerate(names)
+        ])
+
+    zctas = []
+    geonames = {"US": [], "PR": []}
+    for zipcode, (city, abbreviation) in sorted(EXTRA_ZIP_CODE_INFO.items()):
+        fips = next(fips for fips, _, state in chosen if state == abbreviation)
+        zctas.append((zipcode, fips))
+    next_zipcode = 1000
+    for fips, name, abbreviation in chosen:
+        for _ in range(zip_codes):
+            next_zipcode += 1
+            while f"{next_zipcode:05d}" in EXTRA_ZIP_CODE_INFO:
+                next_zipcode += 1
+            zipcode = f"{next_zipcode:05d}"
+            zctas.append((zipcode, fips))
+            # Most ZIP codes share a name with one of the state's places; the rest name somewhere new.
+            if rng.random() < 0.7:
+                city = rng.choice(city_names[fips])
+            else:
+                city = rng.choice(NAME_PARTS) + rng.choice(NAME_SUFFIXES) + " Station"
+            country = "PR" if abbreviation == "PR" else "US"
+            lon, lat = inside(fips, 0)
+            geonames[country].append("\t".join([
+                country, zipcode, city, name, abbreviation, "", "", "", "", f"{lat:.4f}", f"{lon:.4f}", "4"
+            ]))
+
+    write_collection(geojson_dir / "cb_2015_us_zcta510_500k.json", "cb_2015_us_zcta510_500k", [
+        ({"ZCTA5CE10": zipcode, "AFFGEOID10": f"8600000US{zipcode}", "GEOID10": zipcode,
+          "ALAND10": rng.randrange(10 ** 8), "AWATER10": rng.randrange(10 ** 6)},
+         polygon(rng, *inside(fips, 0.02), 0.02, vertices))
+        for zipcode, fips in zctas
+    ])
+
+    for country, lines in geonames.items():
+        (geonames_dir / f"{country}.txt").write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    (geonames_dir / "readme.txt").write_text("Synthetic Geonames postal codes for benchmarking.\n")
+
+
+def build_once(workdir, consolidate_args):
+    """Run one build, returning its wall time and the report consolidate_generated_geojson.py writes."""
+    with tempfile.TemporaryDirectory() as directory:
+        report_path = Path(directory) / "report.json"
+        command = [
+            sys.executable, str(DOCKER_DIR / "consolidate_generated_geojson.py"),
+            "--report", str(report_path), *consolidate_args,
+        ]
+        env = {**os.environ, "PLACES_WORKDIR": str(workdir)}
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        seconds = time.perf_counter() - start
+        return seconds, json.loads(report_path.read_text())
+
+
+def benchmark(workdir, consolidate_args, repeat):
+    """Build `repeat` times, returning the median of each timing."""
+    runs = [build_once(workdir, consolidate_args) for _ in range(repeat)]
+    stages = {}
+    for _, report in runs:
+        for stage in report["stages"]:
+            stages.setdefault(stage["stage"], []).append(stage)
+
+    def median(values):
+        return round(statistics.median(values), 6)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "arguments": consolidate_args,
+        "repeat": repeat,
+        "build": {
+            "seconds": median([seconds for seconds, _ in runs]),
+            "places": runs[0][1]["total"]["places"],
+            "bytes_out": runs[0][1]["total"]["bytes_out"],
+            "peak_rss_bytes": max(report["total"]["peak_rss_bytes"] for _, report in runs),
+        },
+        "stages": {
+            name: {
+                "seconds": median([stage["seconds"] for stage in measured]),
+                "places": measured[0]["places"],
+                "places_per_second": median([stage["places_per_second"] or 0 for stage in measured]),
+                "bytes_in": measured[0]["bytes_in"],
+                "bytes_out": measured[0]["bytes_out"],
+            }
+            for name, measured in stages.items()
+        },
+    }
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """Print each timing next to its baseline, returning the names of those more than `threshold` slower."""
+    timings = [("build", results["build"], baseline.get("build"))]
+    timings += [(name, stage, baseline.get("stages", {}).get(name)) for name, stage in results["stages"].items()]
+
+    slower = []
+    print(f"{'':10} {'baseline s':>10} {'current s':>10} {'change':>8}")
+    for name, current, previous in timings:
+        if previous is None:
+            print(f"{name:10} {'-':>10} {current['seconds']:10.3f}")
+            continue
+        change = current["seconds"] / previous["seconds"] - 1 if previous["seconds"] else 0.0
+        # Stages too short to time reliably are shown but never count as slower.
+        regressed = change > threshold and max(current["seconds"], previous["seconds"]) >= min_seconds
+        flag = "  SLOWER" if regressed else ""
+        print(f"{name:10} {previous['seconds']:10.3f} {current['seconds']:10.3f} {change:+8.1%}{flag}")
+        if regressed:
+            slower.append(name)
+        if current.get("places") != previous.get("places"):
+            print(f"{'':10} place count changed from {previous.get('places')} to {current.get('places')}")
+    return slower
+
+
+def add_scale_arguments(parser):
+    parser.add_argument("--states", type=int, default=len(STATES), help="number of states; Puerto Rico and the states EXTRA_ZIP_CODE_INFO names are always included")
+    parser.add_argument("--counties", type=int, default=60, help="counties per state")
+    parser.add_argument("--places", type=int, default=200, help="incorporated places per state")
+    parser.add_argument("--zip-codes", type=int, default=600, help="ZIP code tabulation areas per state")
+    parser.add_argument("--vertices", type=int, default=64, help="vertices per polygon")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def scale(args):
+    return {
+        "states": args.states, "counties": args.counties, "places": args.places, "zip_codes": args.zip_codes,
+        "vertices": args.vertices, "seed": args.seed,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="write a synthetic working directory")
+    generate_parser.add_argument("workdir", type=Path)
+    add_scale_arguments(generate_parser)
+
+    run = commands.add_parser("run", help="time the build and compare it with a baseline")
+    source = run.add_mutually_exclusive_group()
+    source.add_argument("--workdir", type=Path, help="existing working directory to build from")
+    source.add_argument("--zips", type=Path, help="directory of Census Bureau and Geonames archives to build from")
+    add_scale_arguments(run)
+    run.add_argument("--repeat", type=int, default=3, help="builds to take the median of")
+    run.add_argument("--baseline", type=Path, help="baseline results to compare with")
+    run.add_argument("--save-baseline", type=Path, metavar="PATH", help="write the results to PATH as a baseline")
+    run.add_argument("--threshold", type=float, default=0.1,
+                     help="fraction by which a timing may exceed its baseline before it counts as slower")
+    run.add_argument("--min-seconds", type=float, default=0.05,
+                     help="ignore slowdowns in timings shorter than this")
+    run.add_argument("consolidate_args", nargs="*", help="arguments for consolidate_generated_geojson.py")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "generate":
+        generate(args.workdir, **scale(args))
+        return 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        workdir = args.workdir
+        source = {"workdir": str(workdir)} if workdir else None
+        if workdir is None:
+            workdir = Path(directory)
+            if args.zips:
+                source = {"zips": str(args.zips)}
+                start = time.perf_counter()
+                if extract_and_convert_zipfiles.run(args.zips, workdir, os.cpu_count() or 1):
+                    return 1
+                print(f"Extracted and converted the archives in {time.perf_counter() - start:.2f}s")
+            else:
+                source = {"synthetic": scale(args)}
+                generate(workdir, **scale(args))
+        results = benchmark(workdir, args.consolidate_args, args.repeat)
+    results["source"] = source
+
+    for name, stage in results["stages"].items():
+        print(f"{name:10} {stage['seconds']:8.3f}s {stage['places']:9d} places {stage['places_per_second']:12.1f}/s")
+    print(f"{'build':10} {results['build']['seconds']:8.3f}s {results['build']['places']:9d} places")
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=1) + "\n")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("source") != results["source"] or baseline.get("arguments") != results["arguments"]:
+            print("The baseline was measured on different data or with different arguments.", file=sys.stderr)
+        slower = compare(results, baseline, args.threshold, args.min_seconds)
+        if slower:
+            print(f"Slower than the baseline by more than {args.threshold:.0%}: {', '.join(slower)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
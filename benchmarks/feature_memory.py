@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Compare peak memory of loading a GeoJSON file whole with `geojson.load` against streaming it with `features()`.
+
+    python benchmarks/feature_memory.py /tmp/places_workdir/geojson/cb_2015_us_zcta510_500k.json
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import geojson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+import consolidate_generated_geojson as consolidate  # noqa: E402
+
+
+def whole_file(path):
+    with open(path, encoding="utf-8") as stream:
+        collection = geojson.load(stream)
+    for feature in collection.features:
+        yield feature
+
+
+def streaming(path):
+    with open(path, encoding="utf-8") as stream:
+        yield from consolidate.FeatureStream(stream)
+
+
+def measure(loader, path):
+    """Consume every feature from `loader`, returning (feature count, seconds, peak traced bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for feature in loader(path):
+        feature.properties
+        count += 1
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", type=Path, help="GeoJSON FeatureCollection files to load")
+    args = parser.parse_args()
+
+    print(f"{'file':40} {'loader':10} {'features':>9} {'seconds':>8} {'peak MiB':>9}")
+    for path in args.paths:
+        for name, loader in (("geojson", whole_file), ("streaming", streaming)):
+            count, elapsed, peak = measure(loader, path)
+            print(f"{path.name:40} {name:10} {count:9d} {elapsed:8.2f} {peak / 2 ** 20:9.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Report output size and serialization time for a GeoJSON file at a range of precision and simplification settings.
+
+    python benchmarks/geometry_size.py /tmp/places_workdir/geojson/cb_2015_us_county_500k.json \
+        --precision 6 5 4 --tolerance 0.0001 0.001 0.01
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+import consolidate_generated_geojson as consolidate  # noqa: E402
+from geometry import GeometryTransform, rings  # noqa: E402
+
+
+def load_geometries(path):
+    with open(path, encoding="utf-8") as stream:
+        return [feature.geometry for feature in consolidate.FeatureStream(stream)]
+
+
+def measure(geometries, transform, backend):
+    """Return (vertices, output bytes, seconds to shape, seconds to serialize) for one setting."""
+    start = time.perf_counter()
+    shape = transform.shaper("county", lambda: geometries)
+    shaped = [shape(geometry) for geometry in geometries]
+    shaping = time.perf_counter() - start
+
+    start = time.perf_counter()
+    size = sum(len(backend.dumps(geometry)) + 1 for geometry in shaped)
+    serializing = time.perf_counter() - start
+
+    vertices = sum(len(ring) for geometry in shaped for ring in rings(geometry))
+    return vertices, size, shaping, serializing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", type=Path, help="GeoJSON FeatureCollection file to measure")
+    parser.add_argument("--precision", type=int, nargs="*", default=[6, 5, 4], help="decimal places to try")
+    parser.add_argument("--tolerance", type=float, nargs="*", default=[0.0001, 0.001, 0.01], help="tolerances to try")
+    parser.add_argument("--json-backend", choices=["auto", *consolidate.JSON_BACKENDS], default="stdlib")
+    args = parser.parse_args()
+
+    backend = consolidate.json_backend(args.json_backend)
+    geometries = load_geometries(args.path)
+    settings = [(None, None)]
+    settings += [(precision, None) for precision in args.precision]
+    settings += [(precision, tolerance) for precision in [None, *args.precision] for tolerance in args.tolerance]
+
+    print(f"{'precision':>9} {'tolerance':>9} {'vertices':>10} {'MiB':>8} {'shape s':>8} {'dumps s':>8}")
+    for precision, tolerance in settings:
+        transform = GeometryTransform(precision, {"county": tolerance} if tolerance else None)
+        vertices, size, shaping, serializing = measure(geometries, transform, backend)
+        print(f"{precision if precision is not None else '-':>9} {tolerance or '-':>9} {vertices:10d} "
+              f"{size / 2 ** 20:8.2f} {shaping:8.2f} {serializing:8.2f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Compare the memory needed to hold every place in consolidated output as `Place` objects against holding them in a
+columnar `PlaceCatalog`.
+
+    python benchmarks/place_memory.py us-places.ndjson
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+from consolidate_generated_geojson import Place  # noqa: E402
+from place_catalog import PlaceCatalog  # noqa: E402
+
+
+def place_objects(path):
+    places = []
+    parents = {}
+    with open(path, "rb") as stream:
+        for metadata in stream:
+            metadata = json.loads(metadata)
+            geometry = json.loads(next(stream))
+            place = Place(metadata["type"], geometry, metadata["id"], metadata["name"],
+                          metadata.get("abbreviated_name"), parents.get(metadata["parent_id"]))
+            for alias in metadata.get("aliases", ()):
+                place.add_alias(alias["name"])
+            if place.type in ("nation", "state"):
+                parents[place.id] = place
+            places.append(place)
+    return places
+
+
+def measure(loader, path):
+    """Load every place with `loader`, returning (place count, seconds, bytes still held, peak traced bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    places = loader(path)
+    elapsed = time.perf_counter() - start
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(places), elapsed, held, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", type=Path, help="consolidated output with GeoJSON geometries")
+    args = parser.parse_args()
+
+    print(f"{'representation':15} {'places':>8} {'seconds':>8} {'held MiB':>9} {'peak MiB':>9}")
+    for name, loader in (("Place objects", place_objects), ("PlaceCatalog", PlaceCatalog.from_output)):
+        count, elapsed, held, peak = measure(loader, args.path)
+        print(f"{name:15} {count:8d} {elapsed:8.2f} {held / 2 ** 20:9.1f} {peak / 2 ** 20:9.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Measure how many places per second each serialization path writes.
+
+    python benchmarks/serialization.py /tmp/places_workdir/geojson/cb_2015_us_county_500k.json
+
+"print" is the original path: `Place.output` printed to a text stream. The others write `Place.serialize()` bytes,
+with each available JSON backend, to a buffered binary stream.
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+import consolidate_generated_geojson as consolidate  # noqa: E402
+
+
+def load_places(path):
+    with open(path, encoding="utf-8") as stream:
+        return [
+            consolidate.Place("place", feature.geometry, feature.properties.get("GEOID"), feature.properties.get("NAME"))
+            for feature in consolidate.FeatureStream(stream)
+        ]
+
+
+def time_print(places):
+    with open(os.devnull, "w") as out:
+        start = time.perf_counter()
+        for place in places:
+            print(place.output, file=out)
+        return time.perf_counter() - start
+
+
+def time_serialize(places, backend):
+    with open(os.devnull, "wb", buffering=consolidate.OUTPUT_BUFFER_SIZE) as out:
+        start = time.perf_counter()
+        for place in places:
+            out.write(place.serialize(backend))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", type=Path, help="GeoJSON FeatureCollection files to serialize")
+    args = parser.parse_args()
+
+    backends = [consolidate.json_backend("stdlib")]
+    if consolidate.orjson is not None:
+        backends.append(consolidate.json_backend("orjson"))
+
+    print(f"{'file':40} {'path':8} {'places':>7} {'seconds':>8} {'places/s':>10}")
+    for path in args.paths:
+        places = load_places(path)
+        timings = [("print", time_print(places))]
+        timings += [(backend.name, time_serialize(places, backend)) for backend in backends]
+        for name, elapsed in timings:
+            print(f"{path.name:40} {name:8} {len(places):7d} {elapsed:8.2f} {len(places) / elapsed:10.0f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
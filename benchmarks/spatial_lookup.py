@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Measure how long a spatial index takes to build, save and load, and how many random points per second it locates.
+
+    python benchmarks/spatial_lookup.py docker-output/us-places.ndjson --points 1000000 --jobs 8
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+from spatial import SpatialIndex  # noqa: E402
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path, help="uncompressed consolidated output file")
+    parser.add_argument("--points", type=int, default=1000000, help="number of random points to locate")
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes to locate points with")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    index, build_seconds = timed(SpatialIndex.from_output, args.output)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "places.spatial"
+        _, save_seconds = timed(index.save, path)
+        index, load_seconds = timed(SpatialIndex.load, path)
+        print(f"build {build_seconds:.2f}s, save {save_seconds:.2f}s, load {load_seconds:.3f}s "
+              f"({path.stat().st_size / 2 ** 20:.1f} MiB)")
+
+        # Draw points from the extent of the outermost layer: the nation, in a full build.
+        top = index.layers[0].levels[-1]
+        rng = random.Random(args.seed)
+        points = [(rng.uniform(top[0], top[2]), rng.uniform(top[1], top[3])) for _ in range(args.points)]
+
+        results, seconds = timed(index.locate_many, points, jobs=args.jobs)
+        matched = sum(1 for matches in results if matches)
+        print(f"located {len(points)} points in {seconds:.2f}s with {args.jobs} jobs: "
+              f"{len(points) / seconds:.0f} points/s, {matched} inside at least one place")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Compare the geometries of a consolidated output file as GeoJSON and as references to shared arcs: their size, raw
+and gzipped, and how long it takes to parse every GeoJSON geometry or to decode every shared-arc geometry.
+
+    python benchmarks/topology_size.py us-places.ndjson
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "docker"))
+
+from topology import DEFAULT_PRECISION, TopologyDecoder, encode  # noqa: E402
+
+
+def geometry_lines(path):
+    with open(path, "rb") as stream:
+        return stream.read().split(b"\n")[1::2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path, help="consolidated output file with GeoJSON geometries")
+    parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION, help="decimal places to quantize to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        encoded_path = Path(directory) / "places.ndjson"
+        topology_path = Path(directory) / "places.topojson"
+        start = time.perf_counter()
+        with open(encoded_path, "wb") as stream:
+            encode(args.output, topology_path, stream, args.precision)
+        encoding = time.perf_counter() - start
+
+        geojson = b"\n".join(geometry_lines(args.output))
+        encoded = b"\n".join(geometry_lines(encoded_path))
+        arcs = topology_path.read_bytes()
+
+        start = time.perf_counter()
+        for line in geojson.split(b"\n"):
+            if line:
+                json.loads(line)
+        parsing = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoder = TopologyDecoder(json.loads(arcs))
+        for line in encoded.split(b"\n"):
+            if line:
+                decoder.geometry(json.loads(line))
+        decoding = time.perf_counter() - start
+
+    print(f"{'geometries':>10} {'MiB':>8} {'gzip MiB':>8} {'read s':>8}")
+    print(f"{'geojson':>10} {len(geojson) / 2 ** 20:8.2f} {len(gzip.compress(geojson)) / 2 ** 20:8.2f} {parsing:8.2f}")
+    size = len(encoded) + len(arcs)
+    compressed = len(gzip.compress(encoded)) + len(gzip.compress(arcs))
+    print(f"{'arcs':>10} {size / 2 ** 20:8.2f} {compressed / 2 ** 20:8.2f} {decoding:8.2f}")
+    print(f"encoded in {encoding:.2f}s")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
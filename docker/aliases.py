@@ -0,0 +1,48 @@
+"""
+ASCII aliases for place names with diacritics, such as "Mayaguez" for "Mayagüez".
+
+Most names are plain ASCII and need no alias, which `str.isascii()` settles without looking at the name's
+characters one by one. The rest nearly all draw their accented letters from the Latin-1 Supplement and Latin
+Extended-A blocks, which a translation table folds in one pass. Only names with characters outside those blocks go
+through Unicode normalization. The same names come up again and again, as place, state and ZIP code city names, so
+each alias is remembered in a bounded LRU cache.
+"""
+
+import functools
+import unicodedata
+
+# How many distinct non-ASCII names to remember the aliases of.
+ALIAS_CACHE_SIZE = 1 << 14
+
+
+def _strip_marks(s):
+    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+
+
+# Folds each letter of the Latin-1 Supplement and Latin Extended-A blocks the way normalizing it would.
+_LATIN = {code: _strip_marks(chr(code)) for code in range(0x00C0, 0x0180)}
+LATIN_FOLDING = {code: folded for code, folded in _LATIN.items() if folded != chr(code)}
+_LATIN_CHARACTERS = frozenset(map(chr, _LATIN))
+
+
+@functools.lru_cache(maxsize=ALIAS_CACHE_SIZE)
+def _fold(s):
+    if all(c.isascii() or c in _LATIN_CHARACTERS for c in s):
+        alias = s.translate(LATIN_FOLDING)
+    else:
+        alias = _strip_marks(s)
+    return alias if alias != s else None
+
+
+def ascii_alias(s):
+    """
+    If this name contains combining characters, return the version without combining characters for use as an alias.
+    """
+    if not s or s.isascii():
+        return None
+    return _fold(s)
+
+
+def ascii_aliases(names):
+    """The ASCII alias of each of a batch of names, or None for each name that needs none."""
+    return [None if not name or name.isascii() else _fold(name) for name in names]
@@ -0,0 +1,71 @@
+"""Content-hash bookkeeping that lets the build skip steps whose inputs have not changed."""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class BuildManifest:
+    """
+    Records a content hash for every file the build reads, and the inputs each build step last ran against.
+
+    A step whose inputs are unchanged, and whose outputs still exist, can be skipped. File hashes are cached against
+    size and modification time so that unchanged files are not read again.
+    """
+
+    VERSION = 1
+    READ_SIZE = 1 << 20
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        data = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+            except ValueError:
+                data = {}
+        if data.get("version") != self.VERSION:
+            data = {}
+        self.files = data.get("files", {})
+        self.steps = data.get("steps", {})
+
+    def digest(self, path):
+        """Return the SHA-256 of a file's contents, reusing the recorded hash if its size and mtime are unchanged."""
+        path = Path(path)
+        stat = path.stat()
+        recorded = self.files.get(str(path))
+        if recorded and recorded["size"] == stat.st_size and recorded["mtime_ns"] == stat.st_mtime_ns:
+            return recorded["sha256"]
+
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as stream:
+            for block in iter(lambda: stream.read(self.READ_SIZE), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+        with self.lock:
+            self.files[str(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def is_current(self, step, inputs):
+        recorded = self.steps.get(step)
+        if recorded is None or recorded["inputs"] != inputs:
+            return False
+        return all(Path(output).exists() for output in recorded["outputs"])
+
+    def outputs(self, step):
+        return [Path(output) for output in self.steps[step]["outputs"]]
+
+    def record(self, step, inputs, outputs):
+        with self.lock:
+            self.steps[step] = {"inputs": inputs, "outputs": [str(output) for output in outputs]}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with self.lock:
+            data = {"version": self.VERSION, "files": self.files, "steps": self.steps}
+            temporary.write_text(json.dumps(data, indent=1, sort_keys=True))
+        os.replace(temporary, self.path)
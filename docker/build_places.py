@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Build the places file in one go, consolidating the places while the Census Bureau shapefiles are still being
+converted to GeoJSON.
+
+Running extract_and_convert_zipfiles.py and then consolidate_generated_geojson.py leaves `ogr2ogr` and
+consolidation waiting on each other: nothing is consolidated until the last shapefile is converted. Here an asyncio
+event loop extracts the archives in threads and runs `ogr2ogr` as subprocesses, at most --extract-jobs and
+--convert-jobs at a time, while consolidation runs in a process of its own, with --jobs worker processes of its
+own. Each converted file is renamed into place once complete, and consolidation waits for it to appear. The
+sections of the output are still written one after another in the usual order, so the output is the same; each
+section only waits for the files it reads. The nation, states and counties are converted first, so that
+consolidation can start on them straight away, and the other archives from the largest on.
+
+The Geonames archives are extracted before consolidation starts. The same manifest as extract_and_convert_zipfiles.py
+keeps archives that have not changed from being extracted or converted again.
+
+Arguments after `--` are passed on to consolidate_generated_geojson.py, which writes the places to stdout:
+
+    python3 build_places.py --convert-jobs 4 -- --jobs 4 --cache-dir /cache > us-places.ndjson
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import consolidate_generated_geojson as consolidate
+from build_manifest import BuildManifest
+from extract_and_convert_zipfiles import SOURCE_DIR, WORKDIR, extract, geonames_members, shapefile_members
+
+# The files consolidation reads first, so their archives are converted first.
+FIRST_FILES = (consolidate.NATION_FILE, consolidate.STATES_FILE, consolidate.COUNTIES_FILE)
+
+
+def log(message):
+    # stdout is the output; progress goes to stderr.
+    print(message, file=sys.stderr, flush=True)
+
+
+class AwaitedFiles:
+    """
+    The files still being converted when consolidation started, which it waits to appear. Each converted file is
+    renamed into place once it is complete, so a file that exists is ready; a file not awaited is ready already.
+    """
+
+    # How often to look for a file that has not appeared yet, in seconds.
+    POLL_SECONDS = 0.2
+
+    def __init__(self, directory, filenames, parent_pid):
+        self.directory = Path(directory)
+        self.filenames = set(filenames)
+        self.parent_pid = parent_pid
+
+    def wait(self, filename):
+        if filename not in self.filenames:
+            return
+        while not (self.directory / filename).exists():
+            # The process converting the files kills this one if a conversion fails, but may have died itself.
+            if os.getppid() != self.parent_pid:
+                raise RuntimeError(f"{filename} was not converted: build_places.py has exited")
+            time.sleep(self.POLL_SECONDS)
+
+
+class ReadyInputs:
+    """Reads another input format's files, each only once it is ready."""
+
+    def __init__(self, inputs, awaited):
+        self.inputs = inputs
+        self.awaited = awaited
+        self.name = inputs.name
+
+    def __getstate__(self):
+        # Worker processes are only handed files that are ready, so they need not wait.
+        return {"inputs": self.inputs, "awaited": None, "name": self.name}
+
+    def path(self, filename):
+        if self.awaited is not None:
+            self.awaited.wait(filename)
+        return self.inputs.path(filename)
+
+    def filenames(self):
+        """Every file there will be, including those still being converted, without waiting for any."""
+        awaited = self.awaited.filenames if self.awaited is not None else ()
+        return sorted({*self.inputs.filenames(), *awaited})
+
+    def features(self, filename):
+        self.path(filename)
+        return self.inputs.features(filename)
+
+    def batches(self, filename, count):
+        self.path(filename)
+        return self.inputs.batches(filename, count)
+
+    def batch_features(self, filename, batch):
+        self.path(filename)
+        return self.inputs.batch_features(filename, batch)
+
+
+async def run_process(command):
+    process = await asyncio.create_subprocess_exec(*command)
+    try:
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+async def convert(shapefile, destination):
+    # Consolidation takes the file to be ready once it exists, so it is written under another name and renamed.
+    temporary = destination.with_name(f"{destination.name}.tmp")
+    # ogr2ogr refuses to overwrite an existing GeoJSON file.
+    if temporary.exists():
+        temporary.unlink()
+    await run_process(["ogr2ogr", "-f", "GeoJSON", str(temporary), str(shapefile)])
+    os.replace(temporary, destination)
+
+
+class Builder:
+    """Extracts and converts the archives in `source_dir` into `workdir`, and consolidates them as they are ready."""
+
+    def __init__(self, source_dir, workdir, extract_jobs, convert_jobs, convert_shapefiles=True):
+        self.source_dir = source_dir
+        self.shapefile_dir = workdir / "shapefiles"
+        self.geonames_dir = workdir / "geonames"
+        self.geojson_dir = workdir / "geojson"
+        for directory in (self.shapefile_dir, self.geonames_dir, self.geojson_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.manifest = BuildManifest(workdir / "manifest.json")
+        self.extract_jobs = extract_jobs
+        self.convert_jobs = convert_jobs
+        self.convert_shapefiles = convert_shapefiles
+
+    def archives(self):
+        """The Census Bureau archives to convert, in the order consolidation needs them."""
+        first = [f"{os.path.splitext(filename)[0]}.zip" for filename in FIRST_FILES]
+        archives = sorted(self.source_dir.glob("cb_*.zip")) if self.convert_shapefiles else []
+        return sorted(archives, key=lambda archive: (
+            first.index(archive.name) if archive.name in first else len(first), -archive.stat().st_size, archive.name
+        ))
+
+    async def extract_geonames(self, limit):
+        async def extract_archive(archive, members):
+            step = f"extract:{archive.name}"
+            inputs = {"archive": self.manifest.digest(archive), "members": sorted(members)}
+            if self.manifest.is_current(step, inputs):
+                log(f"  {archive.name} (unchanged)")
+                return
+            async with limit:
+                await asyncio.to_thread(extract, archive, self.geonames_dir, members)
+            self.manifest.record(step, inputs, [self.geonames_dir / member for member in members])
+            log(f"  {archive.name}")
+
+        archives = sorted(self.source_dir.glob("??.zip"))
+        log(f"Unzipping {len(archives)} geoname archives...")
+        await asyncio.gather(*(
+            extract_archive(archive, members) for archive, members in geonames_members(archives).items()
+        ))
+
+    async def convert_archive(self, archive, members, extract_limit, convert_limit):
+        step = f"convert:{archive.name}"
+        inputs = {"archive": self.manifest.digest(archive)}
+        async with extract_limit:
+            await asyncio.to_thread(extract, archive, self.shapefile_dir)
+        outputs = []
+        for member in members:
+            shapefile = self.shapefile_dir / member
+            destination = self.geojson_dir / f"{shapefile.stem}.json"
+            async with convert_limit:
+                start = time.perf_counter()
+                await convert(shapefile, destination)
+                seconds = time.perf_counter() - start
+            outputs.append(destination)
+            log(f"{shapefile.name:>30} --> {destination.name:<35} {seconds:7.2f}s, "
+                f"{destination.stat().st_size:>12,} bytes")
+        self.manifest.record(step, inputs, outputs)
+
+    async def run(self, consolidate_argv):
+        extract_limit = asyncio.Semaphore(self.extract_jobs)
+        convert_limit = asyncio.Semaphore(self.convert_jobs)
+        await self.extract_geonames(extract_limit)
+
+        conversions = []
+        awaited = []
+        for archive in self.archives():
+            members = shapefile_members(archive)
+            if self.manifest.is_current(f"convert:{archive.name}", {"archive": self.manifest.digest(archive)}):
+                log(f"  {archive.name} (unchanged)")
+                continue
+            for member in members:
+                filename = f"{os.path.splitext(os.path.basename(member))[0]}.json"
+                # Consolidation must not mistake the file from an earlier run for the converted one.
+                (self.geojson_dir / filename).unlink(missing_ok=True)
+                awaited.append(filename)
+            conversions.append((archive, members))
+        if conversions:
+            log(f"Converting {len(conversions)} archives to GeoJSON with {self.convert_jobs} workers...")
+        # Tasks start in the order they were created, as the semaphores let them.
+        tasks = [
+            asyncio.ensure_future(self.convert_archive(archive, members, extract_limit, convert_limit))
+            for archive, members in conversions
+        ]
+
+        # Consolidation forks worker processes of its own, which is only safe from a process without other
+        # threads, so it runs in a process of its own: this script again, waiting for the files being converted.
+        if self.convert_shapefiles:
+            awaiting = [option for filename in awaited for option in ("--await-file", filename)]
+            command = [sys.executable, __file__, "--parent-pid", str(os.getpid()), *awaiting, "--"]
+        else:
+            command = [sys.executable, consolidate.__file__]
+        consolidation = asyncio.ensure_future(run_process(command + consolidate_argv))
+
+        pending = {consolidation, *tasks}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    continue
+                if task is consolidation:
+                    log(f"Failed to consolidate the places: {error}")
+                else:
+                    log(f"Failed to convert {conversions[tasks.index(task)][0].name}: {error}")
+                # Cancelling consolidation kills its process, rather than leave it waiting for files forever.
+                for waiting in pending:
+                    waiting.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                return 1
+        return 0
+
+
+def consolidate_awaited(args, consolidate_argv):
+    """Consolidate the places, as the process build_places.py starts, waiting for the files still being converted."""
+    directory = WORKDIR / "geojson"
+    awaited = AwaitedFiles(directory, args.await_file, args.parent_pid)
+    inputs = ReadyInputs(consolidate.GeoJSONInputs(directory), awaited)
+    return consolidate.main(consolidate_argv, inputs)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract and convert the bundled archives, and consolidate the places as they are converted.",
+        epilog="Arguments after -- are passed on to consolidate_generated_geojson.py."
+    )
+    jobs = os.cpu_count() or 1
+    parser.add_argument(
+        "--extract-jobs", type=int, default=jobs, metavar="N",
+        help="maximum number of archives extracted at once (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--convert-jobs", type=int, default=jobs, metavar="N",
+        help="maximum number of ogr2ogr processes run at once (default: number of CPUs)"
+    )
+    parser.add_argument("--source-dir", type=Path, default=SOURCE_DIR, help="directory containing the zip archives")
+    # How build_places.py runs itself to consolidate the places.
+    parser.add_argument("--parent-pid", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--await-file", action="append", default=[], help=argparse.SUPPRESS)
+    args, consolidate_argv = parser.parse_known_args(argv)
+    if consolidate_argv[:1] == ["--"]:
+        consolidate_argv = consolidate_argv[1:]
+    # Fail on a mistyped option before any archive is extracted.
+    args.consolidate = consolidate.parse_args(consolidate_argv)
+    return args, consolidate_argv
+
+
+def main(argv=None):
+    args, consolidate_argv = parse_args(argv)
+    if args.parent_pid is not None:
+        return consolidate_awaited(args, consolidate_argv)
+    # consolidate_generated_geojson.py reads the Geonames files from PLACES_WORKDIR too.
+    builder = Builder(args.source_dir, WORKDIR, max(args.extract_jobs, 1), max(args.convert_jobs, 1),
+                      convert_shapefiles=args.consolidate.input_format == "geojson")
+    try:
+        return asyncio.run(builder.run(consolidate_argv))
+    finally:
+        builder.manifest.save()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,54 @@
 #!/usr/bin/env python3
 
+import argparse
+import functools
+import itertools
 import json
+import multiprocessing
 import os
 import re
+import shutil
+import struct
 import sys
-import unicodedata
+import time
+import types
 from pathlib import Path
 
 import geojson
 
-WORKDIR = Path("/tmp/places_workdir")
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from aliases import ascii_aliases
+from build_manifest import BuildManifest
+from crosswalk import CrosswalkWriter
+from feature_cache import DEFAULT_MAX_BYTES, CachedFeatures, FeatureCache
+from geometry import PLACE_TYPES, GeometryTransform
+from geometry_container import ContainerWriter, wkb_record
+from geonames import GeonamesTable, MappedGeonamesTable
+from instrumentation import Instrumentation
+from pipeline import PIPELINE_DEPTH, threaded
+from place_search import SearchIndexWriter
+from shapefile_reader import read_shapefile, record_count
+from topology import DEFAULT_PRECISION, TopologyWriter
+from writers import COMPRESSIONS, SHARD_KEYS, IndexedStreamWriter, ShardedWriter
+
+WORKDIR = Path(os.environ.get("PLACES_WORKDIR", "/tmp/places_workdir"))
 GEONAMES_DIR = WORKDIR / "geonames"
 GEOJSON_DIR = WORKDIR / "geojson"
+SHAPEFILE_DIR = Path("/places")
 
 NATION_FILE = "cb_2015_us_nation_5m.json"
 STATES_FILE = "cb_2015_us_state_500k.json"
 COUNTIES_FILE = "cb_2015_us_county_500k.json"
 ZIPCODES_FILE = "cb_2015_us_zcta510_500k.json"
 
+OUTPUT_BUFFER_SIZE = 1 << 20
+# With more than one job, the ZIP code file is split into this many batches per worker process.
+ZIPCODE_BATCHES_PER_JOB = 8
+
 # This data structure fills in blanks observed in Geonames data.
 EXTRA_ZIP_CODE_INFO = {
     "17270": ("Williamson", "PA"),
@@ -40,35 +71,358 @@ EXTRA_ZIP_CODE_INFO = {
 }
 
 
-def ascii_alias(s):
+class FeatureStream:
     """
-    If this name contains combining characters, return the version without combining characters for use as an alias.
+    Incrementally parses a GeoJSON FeatureCollection, one feature at a time.
+
+    Only the feature currently being decoded is held in memory, so peak memory is bounded by the largest single
+    feature rather than by the size of the whole collection.
     """
-    if not s:
-        return None
 
-    try:
-        ascii = s.encode("ascii")
-        return None
-    except Exception:
-        pass
+    READ_SIZE = 1 << 20
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, stream, read_size=READ_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder(
+            object_hook=geojson.GeoJSON.to_instance, parse_constant=self._reject_constant
+        )
+
+    @staticmethod
+    def _reject_constant(value):
+        raise ValueError(f"Number {value!r} is not JSON compliant")
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._decode()
+            self._expect(":")
+            if key == "features":
+                yield from self._features()
+            else:
+                self._decode()
+            if self._expect(",}") == "}":
+                return
+
+    def _features(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self._decode()
+            if self._expect(",]") == "]":
+                return
+
+    def _fill(self, size):
+        """Discard the consumed part of the buffer and append up to `size` more characters from the stream."""
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.stream.read(size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
 
-    alias = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+    def _peek(self):
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError("Unexpected end of GeoJSON input")
+            self._fill(self.read_size)
 
-    if alias == s:
+    def _expect(self, characters):
+        char = self._peek()
+        if char not in characters:
+            raise ValueError(f"Expected one of {characters!r} at GeoJSON offset {self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A value running right up to the end of the buffer may be a truncated number; read on to be sure.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            # Grow reads with the pending value so that re-decoding a large feature stays linear overall.
+            self._fill(max(self.read_size, len(self.buffer) - self.pos))
+
+
+class GeoJSONInputs:
+    """Reads the GeoJSON files that extract_and_convert_zipfiles.py converts the Census Bureau shapefiles to."""
+
+    name = "geojson"
+
+    def __init__(self, directory=GEOJSON_DIR):
+        self.directory = Path(directory)
+
+    def path(self, filename):
+        return self.directory / filename
+
+    def filenames(self):
+        return sorted(os.listdir(self.directory))
+
+    def features(self, filename):
+        with open(self.path(filename), encoding="utf-8") as stream:
+            yield from FeatureStream(stream)
+
+    # How each line holding a feature starts in files written one feature per line, as ogr2ogr writes them.
+    FEATURE_LINE = re.compile(rb'{\s*"type"\s*:\s*"Feature"')
+    FEATURE_SEARCH_LINES = 100
+
+    def _first_feature_line(self, stream):
+        """The offset of the first feature, if the file holds one complete feature per line, as ogr2ogr writes."""
+        for _ in range(self.FEATURE_SEARCH_LINES):
+            offset = stream.tell()
+            line = stream.readline()
+            if not line:
+                return None
+            if self.FEATURE_LINE.match(line):
+                try:
+                    json.loads(line.rstrip(b"\r\n,"))
+                except ValueError:
+                    return None
+                return offset
         return None
-    return alias
+
+    def batches(self, filename, count):
+        """
+        Split a file into about `count` byte ranges of whole lines that `batch_features` can read independently. A
+        file not written one feature per line cannot be split, and is read as a single batch.
+        """
+        path = self.path(filename)
+        size = path.stat().st_size
+        with open(path, "rb") as stream:
+            first = self._first_feature_line(stream)
+            if first is None:
+                return [None]
+            bounds = [first]
+            for i in range(1, count):
+                stream.seek(max(first + (size - first) * i // count, bounds[-1]))
+                stream.readline()
+                bounds.append(stream.tell())
+        bounds.append(size)
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def batch_features(self, filename, batch):
+        if batch is None:
+            yield from self.features(filename)
+            return
+        start, end = batch
+        decode = json.JSONDecoder(
+            object_hook=geojson.GeoJSON.to_instance, parse_constant=FeatureStream._reject_constant
+        ).decode
+        with open(self.path(filename), "rb") as stream:
+            stream.seek(start)
+            while stream.tell() < end:
+                line = stream.readline()
+                if self.FEATURE_LINE.match(line):
+                    yield decode(line.rstrip(b"\r\n,").decode("utf-8"))
+                elif line.strip() not in (b"]", b"}", b"]}", b""):
+                    raise ValueError(f"{filename} is not written one feature per line")
+
+
+class ShapefileInputs:
+    """
+    Reads the Census Bureau shapefiles directly, from the zip archives they are distributed in or from a directory
+    they have been extracted to, so that neither ogr2ogr nor the intermediate GeoJSON files are needed. Each
+    shapefile goes by the name of the GeoJSON file it would have been converted to.
+    """
+
+    name = "shapefile"
+
+    def __init__(self, directory=SHAPEFILE_DIR):
+        self.directory = Path(directory)
+
+    def path(self, filename):
+        stem = Path(filename).stem
+        archive = self.directory / f"{stem}.zip"
+        return archive if archive.exists() else self.directory / f"{stem}.shp"
+
+    def filenames(self):
+        return sorted({
+            f"{path.stem}.json" for pattern in ("cb_*.zip", "cb_*.shp") for path in self.directory.glob(pattern)
+        })
+
+    def features(self, filename):
+        return self.batch_features(filename, None)
+
+    def batches(self, filename, count):
+        """
+        Split a shapefile into about `count` ranges of records that `batch_features` can read independently. A
+        shapefile still in its zip archive is read in one batch: a member of an archive can only be sought by
+        decompressing everything before the offset sought, so each batch would cost more than the one before it.
+        """
+        path = self.path(filename)
+        if path.suffix == ".zip":
+            return [None]
+        records = record_count(path)
+        size = max(1, -(-records // count))
+        return [(start, min(start + size, records)) for start in range(0, records, size)] or [None]
+
+    def batch_features(self, filename, batch):
+        start, stop = batch or (0, None)
+        # The geojson package rounds the coordinates of the GeoJSON inputs to 6 decimal places; so do the same here.
+        return read_shapefile(self.path(filename), precision=6, start=start, stop=stop)
+
+
+class CachedInputs:
+    """
+    Reads another input format's files through a FeatureCache: each file is parsed, and cached, the first time it is
+    read, and served from the cache without parsing after that.
+    """
+
+    def __init__(self, inputs, cache):
+        self.inputs = inputs
+        self.cache = cache
+        # The features are the same either way, so the output is too.
+        self.name = inputs.name
+
+    def path(self, filename):
+        return self.inputs.path(filename)
+
+    def filenames(self):
+        return self.inputs.filenames()
+
+    def features(self, filename):
+        return self.cache.features(self.path(filename), lambda: self.inputs.features(filename))
+
+    def batches(self, filename, count):
+        """
+        Split a cached file into ranges of features, or an uncached one however its input format splits it, to be
+        cached a batch at a time. Each batch names the cache file, so that worker processes need not hash the file.
+        """
+        entry = self.cache.entry(self.path(filename))
+        cached = self.cache.get(self.path(filename))
+        if cached is None:
+            batches = self.inputs.batches(filename, count)
+            if batches == [None]:
+                return batches
+            return [("parse", entry, batch, index, len(batches)) for index, batch in enumerate(batches)]
+        records = len(cached)
+        cached.close()
+        size = max(1, -(-records // count))
+        return [("cache", entry, (start, min(start + size, records))) for start in range(0, records, size)] or [None]
+
+    def batch_features(self, filename, batch):
+        if batch is None:
+            return self.features(filename)
+        if batch[0] == "parse":
+            _, entry, batch, index, count = batch
+            return self.cache.segment_features(
+                entry, index, count, lambda: self.inputs.batch_features(filename, batch)
+            )
+        _, entry, (start, stop) = batch
+        try:
+            return CachedFeatures(entry).features(start, stop)
+        except (FileNotFoundError, ValueError, struct.error):
+            # Another build evicted the file since it was split; parse the features again instead.
+            return itertools.islice(self.inputs.features(filename), start, stop)
+
+
+INPUT_FORMATS = {"geojson": GeoJSONInputs, "shapefile": ShapefileInputs}
+
+# Where features() reads the Census Bureau data from.
+INPUTS = GeoJSONInputs()
+
+
+def use_inputs(inputs):
+    global INPUTS
+    INPUTS = inputs
 
 
 def features(filename):
-    path = os.path.join(GEOJSON_DIR, filename)
-    collection = geojson.load(open(path))
-    for feature in collection.features:
-        yield feature
+    """Yield each feature, with its `properties` and `geometry`, of one Census Bureau file."""
+    return INPUTS.features(filename)
+
+
+class JSONBackend:
+    """Serializes each place as two lines: its metadata and its geometry as GeoJSON."""
+
+    geometry_format = "geojson"
+
+    def record(self, metadata, geometry):
+        return b"".join((self.dumps(metadata), b"\n", self.dumps(geometry), b"\n"))
+
+
+class StdlibJSON(JSONBackend):
+    """Serializes with the standard library, byte for byte as `json.dumps` does."""
+
+    name = "stdlib"
+
+    def __init__(self):
+        self.encode = json.JSONEncoder().encode
+
+    def dumps(self, obj):
+        # The encoder escapes all non-ASCII characters, so its output is always ASCII.
+        return self.encode(obj).encode("ascii")
+
+
+class OrjsonJSON(JSONBackend):
+    """Serializes with orjson, which is several times faster but writes compact UTF-8 rather than escaped ASCII."""
+
+    name = "orjson"
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+
+class WKBBackend:
+    """
+    Serializes each place's metadata with a JSON backend and its geometry as WKB, framed for
+    `geometry_container.ContainerWriter` to take apart.
+    """
+
+    geometry_format = "wkb"
+
+    def __init__(self, json):
+        self.name = json.name
+        self.dumps = json.dumps
+
+    def record(self, metadata, geometry):
+        return b"".join((self.dumps(metadata), b"\n", wkb_record(geometry)))
+
+
+JSON_BACKENDS = {"stdlib": StdlibJSON, "orjson": OrjsonJSON}
+GEOMETRY_FORMATS = ("geojson", "wkb")
+
+
+def json_backend(name="stdlib", geometry_format="geojson"):
+    """
+    Return the named JSON backend; "auto" picks orjson when it is installed and the standard library otherwise.
+    With the "wkb" geometry format, the backend only serializes metadata as JSON.
+    """
+    if name == "auto":
+        name = "orjson" if orjson is not None else "stdlib"
+    if name == "orjson" and orjson is None:
+        raise ValueError("The orjson JSON backend was requested, but orjson is not installed")
+    backend = JSON_BACKENDS[name]()
+    if geometry_format == "wkb":
+        return WKBBackend(backend)
+    return backend
 
 
 class Place:
 
+    # Places are created by the hundred thousand, so they do without a __dict__, and share one empty set of aliases
+    # until they get an alias of their own.
+    __slots__ = ("type", "geography", "id", "name", "abbreviated_name", "parent", "aliases", "extent")
+    NO_ALIASES = frozenset()
+
     def __init__(self, place_type, geography, place_id, name, abbreviated_name=None, parent=None):
         """Rationalizes geographic data from multiple scales into a single format."""
         self.type = place_type
@@ -77,19 +431,30 @@ class Place:
         self.name = name
         self.abbreviated_name = abbreviated_name
         self.parent = parent
-        self.aliases = set()
+        self.aliases = self.NO_ALIASES
+        # The bounding box, centroid and label point of the output geometry, when they are wanted.
+        self.extent = None
 
         # If the name or its abbreviation contains diacritics, create an ASCII version to serve as an alias.
-        aliases = map(ascii_alias, [self.name, self.abbreviated_name])
+        aliases = ascii_aliases((self.name, self.abbreviated_name))
         for x in aliases:
             if x:
-                self.aliases.add(x)
+                self.add_alias(x)
+
+    def add_alias(self, alias):
+        if self.aliases is self.NO_ALIASES:
+            self.aliases = set()
+        self.aliases.add(alias)
 
     @property
     def output(self):
         """A Place is output as two lines: one containing metadata and one containing a GeoJSON object."""
         return "\n".join([json.dumps(self.jsonable), json.dumps(self.geography)])
 
+    def serialize(self, backend):
+        """Serialize the Place's metadata and geometry to bytes with a backend: as two lines, unless they are WKB."""
+        return backend.record(self.jsonable, self.geography)
+
     @property
     def jsonable(self):
         data = {"type": self.type, "id": self.id, "name": self.name}
@@ -107,6 +472,9 @@ class Place:
         else:
             data['parent_id'] = None
 
+        if self.extent:
+            data.update(self.extent)
+
         return data
 
     def __str__(self):
@@ -116,6 +484,8 @@ class Place:
 
 class Nation(Place):
 
+    __slots__ = ("seen_names",)
+
     @classmethod
     def from_filename(cls, filename):
         [nation] = list(features(filename))
@@ -130,6 +500,8 @@ class Nation(Place):
 
 class State(Place):
 
+    __slots__ = ("seen_names",)
+
     def __init__(self, *args, **kwargs):
         super(State, self).__init__(*args, **kwargs)
         self.seen_names = set()
@@ -146,12 +518,21 @@ class State(Place):
 class States(object):
 
     @classmethod
-    def from_filename(cls, filename, nation):
-        states = cls()
+    def places(cls, filename, nation):
         for state in features(filename):
             props = state.properties
-            place = State('state', state.geometry, place_id=props['STATEFP'], name=props['NAME'],
-                          abbreviated_name=props['STUSPS'], parent=nation)
+            yield State('state', state.geometry, place_id=props['STATEFP'], name=props['NAME'],
+                        abbreviated_name=props['STUSPS'], parent=nation)
+
+    @classmethod
+    def from_filename(cls, filename, nation):
+        """
+        Load the states to look them up by ID or abbreviation. They are kept for the whole run, so their geometries
+        are dropped as they are read; `places()` streams the states with their geometries.
+        """
+        states = cls()
+        for place in cls.places(filename, nation):
+            place.geography = None
             states.add(place)
         return states
 
@@ -168,29 +549,48 @@ class Counties:
 
     @classmethod
     def from_filename(cls, filename, states):
-        counties = []
         for county in features(filename):
             state = states.by_id[county.properties['STATEFP']]
             props = county.properties
-            name = props['NAME']
-            place = Place(
+            yield Place(
                 'county', county.geometry, place_id=props['GEOID'],
                 name=props['NAME'], parent=state
             )
-            counties.append(place)
-        return counties
 
 class Cities(object):
     """Census-designated places--basically cities and towns."""
 
+    @classmethod
+    def filenames(cls, inputs):
+        return [filename for filename in inputs.filenames() if filename.endswith("_place_500k.json")]
+
     @classmethod
     def from_directory(cls, input_dir, states):
-        for filename in sorted(os.listdir(input_dir)):
-            if not filename.endswith("_place_500k.json"):
-                continue
+        for filename in cls.filenames(GeoJSONInputs(input_dir)):
             for place in Cities.from_file(filename, states):
                 yield place
 
+    @classmethod
+    def serialized_files(cls, filenames, states, backend, transform, jobs=1):
+        """
+        Yield (filename, output, seen_names, seconds) for each file in order, where `output` is the serialized output
+        of every city in the file, `seen_names` maps each state ID to the place names seen in that state, and
+        `seconds` is how long the file took to process.
+
+        With more than one job, each state's file is parsed and serialized in a worker process; `states` is then left
+        untouched, and it is up to the caller to merge `seen_names` back into it before ZIP codes are aliased.
+        """
+        if jobs <= 1:
+            for filename in filenames:
+                yield (filename, *_serialize_city_file(filename, states, backend, transform))
+            return
+
+        state_records = [(state.id, state.name, state.abbreviated_name) for state in states.by_id.values()]
+        initargs = (state_records, backend.name, backend.geometry_format, transform, INPUTS)
+        with multiprocessing.Pool(jobs, initializer=_init_city_worker, initargs=initargs) as pool:
+            for filename, result in zip(filenames, pool.imap(_serialize_city_file_in_worker, filenames)):
+                yield (filename, *result)
+
     @classmethod
     def from_file(cls, filename, states):
         default_parent = None
@@ -212,101 +612,625 @@ class Cities(object):
             yield Place('city', place.geometry, props['GEOID'], name, parent=parent)
 
 
+# The geometry-free States each city worker process resolves parents against, and how it serializes places.
+_worker_states = None
+_worker_backend = None
+_worker_transform = None
+
+
+def _init_city_worker(state_records, backend_name, geometry_format, transform, inputs):
+    global _worker_states, _worker_backend, _worker_transform
+    use_inputs(inputs)
+    _worker_backend = json_backend(backend_name, geometry_format)
+    _worker_transform = transform
+    _worker_states = States()
+    for place_id, name, abbreviated_name in state_records:
+        _worker_states.add(State('state', None, place_id=place_id, name=name, abbreviated_name=abbreviated_name))
+
+
+def _serialize_city_file(filename, states, backend, transform):
+    """
+    Serialize every city in one state's file, returning the output, the place names seen in each state, and how many
+    seconds it took.
+    """
+    start = time.perf_counter()
+    seen_names = {}
+    places = shaped_cities(filename, states, transform, seen_names)
+    output = b"".join(place.serialize(backend) for place in places)
+    return output, seen_names, time.perf_counter() - start
+
+
+def shaped_cities(filename, states, transform, seen_names):
+    """Generate the shaped cities in one state's file, adding the place names seen in each state to `seen_names`."""
+    shape = transform.shaper('city', file_geometries(filename))
+    for place in shaped(Cities.from_file(filename, states), transform, shape):
+        seen_names.setdefault(place.parent.id, set()).add(place.name)
+        yield place
+
+
+def _serialize_city_file_in_worker(filename):
+    return _serialize_city_file(filename, _worker_states, _worker_backend, _worker_transform)
+
+
+class ZipCodeLookup:
+    """
+    What `ZipCodes.lookup()` reduces the Geonames information to. Each ZIP code is reduced when it is looked up, so a
+    memory-mapped Geonames table is only read for the ZIP codes that have polygons.
+    """
+
+    def __init__(self, extra_info, nation):
+        self.extra_info = extra_info
+        self.nation = nation
+
+    def get(self, zip_code, default=None):
+        info = self.extra_info.get(zip_code)
+        if info is None:
+            return default
+        city, state = info
+        # If there is no feature in this state with the name of this city, add it as an alias for a ZIP code.
+        # This will help some (but not all) people who search for their neighborhood, a la "Forest Hills".
+        alias = city if city and state != self.nation and city not in state.seen_names else None
+        return state.id, alias
+
+
 class ZipCodes:
 
     @classmethod
-    def process_geonames_file(cls, path, extra_info, nation, states):
-        for i in open(path):
-            country, zip_code, city, state, state_abbr = i.strip().split("\t")[:5]
-            if country != 'US':
-                # Geonames treats Puerto Rico et al. as different
-                # countries; the Census Bureau treats them as states
-                # in the United States.
-                state_abbr = country
-            if state_abbr in states.by_abbreviation:
-                state = states.by_abbreviation[state_abbr]
-            else:
-                # A few ZIP codes in the Geonames data are associated
-                # with the US armed forces, or with territories that
-                # are not covered by the Census Bureau. For the sake
-                # of completeness we will associate these ZIP codes
-                # with the United States itself, but they shouldn't
-                # come up, since we are only making Places out of ZIP
-                # codes that have polygons in the Census Bureau data.
-                #
-                # 34034 (APO, Dillon, Armed Forces Americas)
-                # 96373 (FPO, Adams, Armed Forces Pacific)
-                # 96337 (APO, Harford, Armed Forces Pacific)
-                # 96507 (DPO, Brazoria, Armed Forces Pacific)
-                # 96208 (APO, Fulton, Armed Forces Pacific)
-                # 96941 (Pohnpei, Federated States of Micronesia)
-                # 96942 (Chuuk, Federated States of Micronesia)
-                # 96943 (Yap, Federated States of Micronesia)
-                # 96944 (Kosrae, Federated States of Micronesia)
-                # 96960 (Majuro, Marshall Islands)
-                # 96970 (Ebeye, Marshall Islands)
-                # 96940 (Koror, Palau)
-                state = nation
-            extra_info[zip_code] = (city, state)
+    def geonames_filenames(cls, geonames_directory):
+        geonames_re = re.compile("[A-Z]{2}.txt")
+        # Skip the readme.
+        return [filename for filename in sorted(os.listdir(geonames_directory)) if geonames_re.match(filename)]
 
     @classmethod
     def from_filenames(cls, geonames_directory, cb_filename, nation, states):
+        extra_info = cls.load_extra_info(geonames_directory, nation, states)
+        yield from cls.from_features(cb_filename, extra_info, nation, states)
+
+    @classmethod
+    def geonames_table(cls, geonames_directory):
+        """Parse the Geonames files, filling in their blanks from EXTRA_ZIP_CODE_INFO."""
+        paths = [Path(geonames_directory) / filename for filename in cls.geonames_filenames(geonames_directory)]
+        return GeonamesTable.from_files(paths, EXTRA_ZIP_CODE_INFO)
+
+    @classmethod
+    def load_extra_info(cls, geonames_directory, nation, states, table=None):
         """
         Use Geonames information to associate a city name and a state with each ZIP code in the US (plus Puerto Rico).
+        A table already parsed from `geonames_directory` may be passed in to save parsing it again.
         """
-        extra_info = {} 
-        for zipcode, (city, state_abbr) in EXTRA_ZIP_CODE_INFO.items():
-            extra_info[zipcode] = (city, states.by_abbreviation[state_abbr])
-        geonames_re = re.compile("[A-Z]{2}.txt")
-        for geonames_file in os.listdir(geonames_directory):
-            if not geonames_re.match(geonames_file):
-                continue   # This is the readme
+        if table is None:
+            table = cls.geonames_table(geonames_directory)
+        return table.resolve(nation, states)
 
-            geonames_file_path = GEONAMES_DIR / geonames_file
-            cls.process_geonames_file(geonames_file_path, extra_info, nation, states)
+    @classmethod
+    def from_features(cls, cb_filename, extra_info, nation, states):
+        """Now process Census Bureau information to create an appropriate Place for each ZIP code."""
+        lookup = cls.lookup(extra_info, nation)
+        parents = {nation.id: nation, **states.by_id}
+        yield from cls.from_lookup(features(cb_filename), lookup, parents, nation)
 
-        # Now process Census Bureau information to create an appropriate Place for each ZIP code.
-        for data in features(cb_filename):
-            props = data.properties
-            zip_code = props['GEOID10']
+    @classmethod
+    def lookup(cls, extra_info, nation):
+        """
+        Reduce the Geonames information to what each ZIP code needs: the ID of the state it is in, and the city name
+        to alias it to, if any. The states' seen_names must be complete by now.
+        """
+        return ZipCodeLookup(extra_info, nation)
+
+    @classmethod
+    def from_lookup(cls, zcta_features, lookup, parents, nation):
+        for data in zcta_features:
+            zip_code = data.properties['GEOID10']
+            state_id, alias = lookup.get(zip_code, (nation.id, None))
+            place = Place('postal_code', data.geometry, zip_code, name=zip_code, parent=parents[state_id])
+            if alias:
+                place.add_alias(alias)
+            yield place
+
+    @classmethod
+    def serialized_batches(cls, cb_filename, lookup, parents, nation, backend, transform, shape, jobs):
+        """
+        Yield (output, seconds) for each batch of ZIP codes, serialized by worker processes and yielded in input
+        order. The workers are forked, so they share the lookup, the parents and the shape function with this
+        process rather than each receiving a copy.
+        """
+        batches = INPUTS.batches(cb_filename, jobs * ZIPCODE_BATCHES_PER_JOB)
+        initargs = (cb_filename, lookup, parents, nation, backend, transform, shape)
+        pool = multiprocessing.get_context("fork").Pool(jobs, initializer=_init_zipcode_worker, initargs=initargs)
+        with pool:
+            yield from pool.imap(_serialize_zipcode_batch, batches)
+
+
+# Everything a ZIP code worker process needs, inherited from the process that forked it.
+_zipcode_worker = None
 
-            if zip_code in extra_info:
-                city, state = extra_info[zip_code]
-            else:
-                city = None
-                state = nation
 
-            place = Place('postal_code', data.geometry, zip_code, name=zip_code, parent=state)
+def _init_zipcode_worker(*shared):
+    global _zipcode_worker
+    _zipcode_worker = shared
 
-            # If there is no feature in this state with the name of this city, add it as an alias for a ZIP code.
-            # This will help some (but not all) people who search for their neighborhood, a la "Forest Hills".
-            if city and state != nation and city not in state.seen_names:
-                place.aliases.add(city)
 
+def _serialize_zipcode_batch(batch):
+    start = time.perf_counter()
+    cb_filename, lookup, parents, nation, backend, transform, shape = _zipcode_worker
+    zipcodes = ZipCodes.from_lookup(INPUTS.batch_features(cb_filename, batch), lookup, parents, nation)
+    output = b"".join(place.serialize(backend) for place in shaped(zipcodes, transform, shape))
+    return output, time.perf_counter() - start
+
+
+def own_modules():
+    """
+    The paths of this script and of every module beside it that it imports, directly or through another such
+    module: the code that shapes the output.
+    """
+    here = Path(__file__).resolve().parent
+    pending = [sys.modules[__name__]]
+    found = set()
+    while pending:
+        module = pending.pop()
+        path = Path(module.__file__).resolve()
+        if path in found:
+            continue
+        found.add(path)
+        for value in vars(module).values():
+            name = value.__name__ if isinstance(value, types.ModuleType) else getattr(value, "__module__", None)
+            imported = sys.modules.get(name) if isinstance(name, str) else None
+            if getattr(imported, "__file__", None) and Path(imported.__file__).resolve().parent == here:
+                pending.append(imported)
+    return sorted(found)
+
+
+class SectionCache:
+    """
+    Keeps each section of the consolidated output on disk, keyed on the content hashes of the inputs it was built
+    from, so that a rebuild only regenerates the sections whose inputs changed.
+
+    Without a directory nothing is cached, and every section is generated and written straight through.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory else None
+        self.manifest = BuildManifest(self.directory / "manifest.json") if self.directory else None
+
+    def digest(self, path):
+        return self.manifest.digest(path) if self.manifest else None
+
+    def code_digests(self):
+        """The digest of each module that shapes the output, by name, so that changing any of them misses the cache."""
+        return {path.name: self.digest(path) for path in own_modules()}
+
+    def is_current(self, key, inputs):
+        return self.manifest is not None and self.manifest.is_current(key, inputs)
+
+    def path(self, key):
+        return self.directory / "sections" / f"{key}.ndjson"
+
+    def names_path(self, key):
+        return self.directory / "sections" / f"{key}.names.json"
+
+    def seen_names(self, key):
+        with open(self.names_path(key), encoding="utf-8") as stream:
+            return {state_id: set(names) for state_id, names in json.load(stream).items()}
+
+    def write(self, out, key, inputs, produce, seen_names=None):
+        """
+        Write a section to `out`, copying it from the cache if its inputs are unchanged. Otherwise write the chunks
+        returned by `produce()`, keeping a copy of them (and of `seen_names`, if given) for the next run. Returns
+        whether the section came from the cache.
+        """
+        if self.manifest is None:
+            for chunk in produce():
+                out.write(chunk)
+            return False
+
+        path = self.path(key)
+        if self.is_current(key, inputs):
+            with open(path, "rb") as cached:
+                shutil.copyfileobj(cached, out)
+            return True
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        outputs = [path]
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as section:
+            for chunk in produce():
+                section.write(chunk)
+                out.write(chunk)
+        os.replace(temporary, path)
+        if seen_names is not None:
+            names = {state_id: sorted(state_names) for state_id, state_names in seen_names.items()}
+            self.names_path(key).write_text(json.dumps(names), encoding="utf-8")
+            outputs.append(self.names_path(key))
+        self.manifest.record(key, inputs, outputs)
+        return False
+
+    def geonames_table(self, inputs, parse):
+        """
+        Return the Geonames table returned by `parse()`, keeping it for the next run, or memory-map the table kept by
+        an earlier run if its inputs are unchanged.
+        """
+        if self.manifest is None:
+            return parse()
+        path = self.directory / "geonames.table"
+        if self.is_current("geonames", inputs):
+            return MappedGeonamesTable(path)
+        table = parse()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        table.write(temporary)
+        os.replace(temporary, path)
+        self.manifest.record("geonames", inputs, [path])
+        return table
+
+    def save(self):
+        if self.manifest is not None:
+            self.manifest.save()
+
+
+def shaped(places, transform, shape):
+    """Replace each place's geometry with its output shape, and describe its extent, as it is generated."""
+    for place in places:
+        place.geography = shape(place.geography)
+        place.extent = transform.extent(place.geography)
+        yield place
+
+
+def file_geometries(filename):
+    return lambda: (feature.geometry for feature in features(filename))
+
+
+def serialized(places, backend, stage, depth=PIPELINE_DEPTH):
+    """
+    Serialize places as they are generated, charging the time spent generating each place (reading, parsing and
+    shaping it) to the stage's "parse" timer and the time spent encoding it to its "serialize" timer.
+
+    Places are generated in one thread and serialized in another, each running at most `depth` places ahead of the
+    next stage, so that reading, parsing, serializing and writing overlap. With a depth of 0, everything runs in
+    the calling thread.
+    """
+
+    def generate():
+        places_left = iter(places)
+        while True:
+            start = time.perf_counter()
+            place = next(places_left, None)
+            stage.add("parse", time.perf_counter() - start)
+            if place is None:
+                return
             yield place
 
+    def serialize(places):
+        for place in places:
+            start = time.perf_counter()
+            data = place.serialize(backend)
+            stage.add("serialize", time.perf_counter() - start)
+            yield data
 
-def main():
-    nation = Nation.from_filename(NATION_FILE)
-    states = States.from_filename(STATES_FILE, nation)
-    counties = Counties.from_filename(COUNTIES_FILE, states)
-    cities = Cities.from_directory(GEOJSON_DIR, states)
-    zipcodes = ZipCodes.from_filenames(GEONAMES_DIR, ZIPCODES_FILE, nation, states)
+    if not depth:
+        return serialize(generate())
+    return threaded(serialize(threaded(generate(), depth, "parse")), depth, "serialize")
 
-    print(nation.output)
 
-    for state in states.by_id.values():
-        print(state.output)
+def consolidate(out, cache, backend, transform, instrumentation, jobs=1, depth=PIPELINE_DEPTH):
+    """
+    Write every place to the binary stream `out`, regenerating only the sections whose inputs `cache` has not seen
+    before, and measuring each section as a stage of `instrumentation`. Sections generated in this process stream
+    through a pipeline `depth` places deep.
+
+    Each input file is first looked at when the section that reads it begins, so that the inputs may still be
+    arriving while the first sections are written, as they do when build_places.py converts them.
+    """
+
+    def input_digest(filename):
+        return cache.digest(INPUTS.path(filename))
+
+    @functools.lru_cache(maxsize=None)
+    def load_nation():
+        # Kept for the whole run as the parent of other places, so without its geometry.
+        nation = Nation.from_filename(NATION_FILE)
+        nation.geography = None
+        return nation
+
+    @functools.lru_cache(maxsize=None)
+    def load_states():
+        return States.from_filename(STATES_FILE, load_nation())
+
+    code = cache.code_digests()
+
+    @functools.lru_cache(maxsize=None)
+    def nation_inputs():
+        return {
+            "code": code,
+            "json": backend.name,
+            "format": backend.geometry_format,
+            "input": INPUTS.name,
+            "geometry": transform.settings,
+            NATION_FILE: input_digest(NATION_FILE),
+        }
+
+    @functools.lru_cache(maxsize=None)
+    def state_inputs():
+        return {**nation_inputs(), STATES_FILE: input_digest(STATES_FILE)}
+
+    def nation():
+        shape = transform.shaper('nation', file_geometries(NATION_FILE))
+        yield from shaped([Nation.from_filename(NATION_FILE)], transform, shape)
+
+    def states():
+        shape = transform.shaper('state', file_geometries(STATES_FILE))
+        yield from shaped(States.places(STATES_FILE, load_nation()), transform, shape)
+
+    def counties():
+        shape = transform.shaper('county', file_geometries(COUNTIES_FILE))
+        yield from shaped(Counties.from_filename(COUNTIES_FILE, load_states()), transform, shape)
 
-    for county in counties:
-        print(county.output)
+    for key, filename, inputs, places in (
+        ("nation", NATION_FILE, nation_inputs, nation),
+        ("states", STATES_FILE, state_inputs, states),
+        ("counties", COUNTIES_FILE, lambda: {**state_inputs(), COUNTIES_FILE: input_digest(COUNTIES_FILE)}, counties),
+    ):
+        with instrumentation.stage(key, [INPUTS.path(filename)]) as stage:
+            stage.cached = cache.write(
+                stage.counting(out), key, inputs(), lambda: serialized(places(), backend, stage, depth)
+            )
+
+    city_files = Cities.filenames(INPUTS)
+    city_keys = {filename: f"cities.{Path(filename).stem}" for filename in city_files}
+
+    @functools.lru_cache(maxsize=None)
+    def city_inputs(filename):
+        return {**state_inputs(), filename: input_digest(filename)}
+
+    def is_stale(filename):
+        return not cache.is_current(city_keys[filename], city_inputs(filename))
+
+    city_names = []
+    with instrumentation.stage("cities", (INPUTS.path(filename) for filename in city_files)) as stage:
+        counted = stage.counting(out)
+        # Worker processes need to know up front which files to serialize; in this process, each file is looked at
+        # only when its turn comes.
+        stale = [filename for filename in city_files if is_stale(filename)] if jobs > 1 else None
+        results = Cities.serialized_files(stale, load_states(), backend, transform, jobs=jobs) if stale else None
+        cached = []
+        for filename in city_files:
+            key = city_keys[filename]
+            start, bytes_before, places_before = time.perf_counter(), counted.bytes, counted.places
+            fresh = filename not in stale if stale is not None else not is_stale(filename)
+            if not fresh and results is not None:
+                _, output, seen_names, seconds = next(results)
+                cache.write(counted, key, city_inputs(filename), lambda: [output], seen_names=seen_names)
+            elif not fresh:
+                seen_names = {}
+                cities = shaped_cities(filename, load_states(), transform, seen_names)
+                cache.write(counted, key, city_inputs(filename), lambda: serialized(cities, backend, stage, depth),
+                            seen_names=seen_names)
+                seconds = time.perf_counter() - start
+            else:
+                seen_names = cache.seen_names(key)
+                cache.write(counted, key, city_inputs(filename), None)
+                seconds = time.perf_counter() - start
+            stage.file(INPUTS.path(filename), seconds, counted.bytes - bytes_before, counted.places - places_before,
+                       cached=fresh)
+            city_names.append(seen_names)
+            cached.append(fresh)
+        # The stage came from the cache only if every file did.
+        stage.cached = all(cached)
+
+    def zipcodes(stage):
+        states = load_states()
+        for seen_names in city_names:
+            for state_id, names in seen_names.items():
+                states.by_id[state_id].seen_names.update(names)
+        nation = load_nation()
+        with stage.timer("geonames"):
+            table = cache.geonames_table(geonames_inputs, lambda: ZipCodes.geonames_table(GEONAMES_DIR))
+            extra_info = ZipCodes.load_extra_info(GEONAMES_DIR, nation, states, table)
+            lookup = ZipCodes.lookup(extra_info, nation)
+        parents = {nation.id: nation, **states.by_id}
+        shape = transform.shaper('postal_code', file_geometries(ZIPCODES_FILE))
+        if jobs <= 1:
+            zipcodes = ZipCodes.from_lookup(features(ZIPCODES_FILE), lookup, parents, nation)
+            yield from serialized(shaped(zipcodes, transform, shape), backend, stage, depth)
+            return
+        batches = ZipCodes.serialized_batches(ZIPCODES_FILE, lookup, parents, nation, backend, transform, shape, jobs)
+        for output, seconds in batches:
+            stage.add("workers", seconds)
+            yield output
 
-    for city in cities:
-        print(city.output)
+    geonames_files = ZipCodes.geonames_filenames(GEONAMES_DIR)
+    geonames_inputs = {
+        "code": code,
+        "files": {filename: cache.digest(GEONAMES_DIR / filename) for filename in geonames_files},
+    }
+    zipcode_inputs = {
+        **state_inputs(),
+        ZIPCODES_FILE: input_digest(ZIPCODES_FILE),
+        "geonames": geonames_inputs["files"],
+        # ZIP codes are only aliased to city names that no census-designated place in the state already has.
+        "cities": {filename: city_inputs(filename)[filename] for filename in city_files},
+    }
+    zipcode_sources = [INPUTS.path(ZIPCODES_FILE)] + [GEONAMES_DIR / filename for filename in geonames_files]
+    with instrumentation.stage("zipcodes", zipcode_sources) as stage:
+        stage.cached = cache.write(stage.counting(out), "zipcodes", zipcode_inputs, lambda: zipcodes(stage))
 
-    for zipcode in zipcodes:
-        print(zipcode.output)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Consolidate the generated GeoJSON into a flat list of places.")
+    parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="number of worker processes used to consolidate the per-state city files and the ZIP codes (default: 1)"
+    )
+    parser.add_argument(
+        "--pipeline-depth", type=int, default=PIPELINE_DEPTH, metavar="N",
+        help="how many places each stage of parsing, serializing and writing may run ahead of the next; 0 runs "
+             f"every stage in the main thread, as --profile-dir needs to see them (default: {PIPELINE_DEPTH})"
+    )
+    parser.add_argument(
+        "--input-format", choices=list(INPUT_FORMATS), default="geojson",
+        help="read the Census Bureau data from the GeoJSON files converted by extract_and_convert_zipfiles.py, or "
+             "from the shapefiles themselves, without ogr2ogr (default: geojson)"
+    )
+    parser.add_argument(
+        "--shapefile-dir", type=Path, default=SHAPEFILE_DIR, metavar="DIR",
+        help="with --input-format shapefile, the directory holding the Census Bureau zip archives, or the shapefiles "
+             f"extracted from them (default: {SHAPEFILE_DIR})"
+    )
+    parser.add_argument(
+        "--feature-cache", type=Path, metavar="DIR",
+        help="keep the features parsed from each input file here, so that later runs over unchanged inputs, with "
+             "any output options, need not parse them again"
+    )
+    parser.add_argument(
+        "--feature-cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20, metavar="MB",
+        help="evict the least recently used files from --feature-cache when it grows past this many megabytes "
+             f"(default: {DEFAULT_MAX_BYTES >> 20})"
+    )
+    parser.add_argument(
+        "--cache-dir", type=Path, metavar="DIR",
+        help="keep each section of the output here, and only regenerate sections whose inputs have changed"
+    )
+    parser.add_argument(
+        "--json-backend", choices=["auto", *JSON_BACKENDS], default="stdlib",
+        help="JSON encoder to serialize places with; orjson writes compact UTF-8 rather than escaped ASCII, and auto "
+             "uses it if it is installed (default: stdlib)"
+    )
+    parser.add_argument(
+        "--precision", type=int, metavar="DECIMALS",
+        help="round output coordinates to this many decimal places"
+    )
+    parser.add_argument(
+        "--simplify", type=simplify_tolerance, action="append", default=[], metavar="TYPE=TOLERANCE",
+        help=f"simplify the polygons of one place type ({', '.join(PLACE_TYPES)}) so that no vertex moves further "
+             "than TOLERANCE degrees, keeping shared boundaries consistent; may be given once per type"
+    )
+    parser.add_argument(
+        "--extents", action="store_true",
+        help="add each place's bbox, centroid and label_point to its metadata, so viewers need not read geometries"
+    )
+    parser.add_argument(
+        "--output-dir", type=Path, metavar="DIR",
+        help="write the output to shards in this directory, with an index.json describing them, instead of stdout"
+    )
+    parser.add_argument(
+        "--shard-by", choices=SHARD_KEYS, default="none",
+        help="with --output-dir, write one shard per place type or per state rather than a single file (default: none)"
+    )
+    parser.add_argument(
+        "--compression", choices=list(COMPRESSIONS), default="none",
+        help="with --output-dir, compress each shard in independently decompressible blocks (default: none)"
+    )
+    parser.add_argument(
+        "--index", type=Path, metavar="PATH",
+        help="when writing to stdout, also write an index of where each place is in the output to PATH, for use "
+             "with place_index.PlaceReader (uncompressed shards in --output-dir are always indexed)"
+    )
+    parser.add_argument(
+        "--geometry-format", choices=GEOMETRY_FORMATS, default="geojson",
+        help="with wkb, write only the metadata lines to stdout and the geometries as WKB to the container at "
+             "--geometry-file, for use with geometry_container.GeometryReader (default: geojson)"
+    )
+    parser.add_argument(
+        "--geometry-file", type=Path, metavar="PATH",
+        help="where to write the geometry container when --geometry-format is wkb"
+    )
+    parser.add_argument(
+        "--topology", type=Path, metavar="PATH",
+        help="when writing to stdout, write each geometry as references to the arcs it shares with other places, "
+             "and the arcs to PATH as TopoJSON, for use with topology.TopologyDecoder; coordinates are quantized to "
+             f"--precision decimal places (default: {DEFAULT_PRECISION})"
+    )
+    parser.add_argument(
+        "--search-index", type=Path, metavar="PATH",
+        help="when writing to stdout, write an index of the places' names, aliases and IDs to PATH, for use with "
+             "place_search.PlaceSearch"
+    )
+    parser.add_argument(
+        "--crosswalk", type=Path, metavar="PATH",
+        help="also write crosswalk tables of how the counties, cities and ZIP codes overlap to PATH, for use with "
+             "crosswalk.Crosswalk; worked out with --jobs processes once the places are written"
+    )
+    parser.add_argument(
+        "--report", metavar="PATH",
+        help="write a JSON report of each stage's time, throughput, bytes in and out and peak memory to PATH, "
+             "or to stderr if PATH is -"
+    )
+    parser.add_argument(
+        "--profile-dir", type=Path, metavar="DIR",
+        help="profile each stage with cProfile, writing STAGE.prof files to DIR"
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="trace each stage's peak Python memory allocation with tracemalloc, for the report (slow)"
+    )
+    args = parser.parse_args(argv)
+    if args.index and args.output_dir:
+        parser.error("--index cannot be combined with --output-dir")
+    if args.output_dir is None and (args.shard_by != "none" or args.compression != "none"):
+        parser.error("--shard-by and --compression require --output-dir")
+    if (args.geometry_format == "wkb") != (args.geometry_file is not None):
+        parser.error("--geometry-format wkb and --geometry-file must be given together")
+    if args.geometry_file and (args.output_dir or args.index):
+        parser.error("--geometry-format wkb cannot be combined with --output-dir or --index")
+    if args.topology and (args.output_dir or args.index or args.geometry_file):
+        parser.error("--topology cannot be combined with --output-dir, --index or --geometry-format wkb")
+    if args.search_index and (args.output_dir or args.geometry_file or args.topology):
+        parser.error("--search-index cannot be combined with --output-dir, --geometry-format wkb or --topology")
+    if args.crosswalk and args.geometry_file:
+        parser.error("--crosswalk cannot be combined with --geometry-format wkb")
+    return args
+
+
+def simplify_tolerance(value):
+    place_type, _, tolerance = value.partition("=")
+    if place_type not in PLACE_TYPES:
+        raise argparse.ArgumentTypeError(f"unknown place type {place_type!r}")
+    try:
+        return place_type, float(tolerance)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid tolerance {tolerance!r}")
+
+
+def main(argv=None, inputs=None):
+    """Consolidate the places as `argv` asks, reading the Census Bureau data through `inputs`, if given."""
+    args = parse_args(argv)
+    transform = GeometryTransform(args.precision, dict(args.simplify), args.extents)
+    if inputs is not None:
+        use_inputs(inputs)
+    elif args.input_format == "shapefile":
+        use_inputs(ShapefileInputs(args.shapefile_dir))
+    feature_cache = None
+    if args.feature_cache:
+        feature_cache = FeatureCache(args.feature_cache, args.feature_cache_size << 20)
+        use_inputs(CachedInputs(INPUTS, feature_cache))
+    cache = SectionCache(args.cache_dir)
+    instrumentation = Instrumentation(args.profile_dir, args.trace_memory)
+    if args.output_dir:
+        out = ShardedWriter(args.output_dir, args.shard_by, args.compression)
+    else:
+        # Write through one large buffer rather than a text-mode print() per place.
+        out = open(sys.stdout.fileno(), "wb", buffering=OUTPUT_BUFFER_SIZE, closefd=False)
+        if args.search_index:
+            out = SearchIndexWriter(out, args.search_index)
+        if args.index:
+            out = IndexedStreamWriter(out, args.index)
+        elif args.geometry_file:
+            out = ContainerWriter(out, args.geometry_file)
+        elif args.topology:
+            precision = DEFAULT_PRECISION if args.precision is None else args.precision
+            out = TopologyWriter(out, args.topology, precision)
+    if args.crosswalk:
+        # The crosswalk is built from the GeoJSON geometries, so it sees them before any other writer does.
+        out = CrosswalkWriter(out, args.crosswalk, args.jobs)
+    backend = json_backend(args.json_backend, args.geometry_format)
+    try:
+        consolidate(out, cache, backend, transform, instrumentation, jobs=args.jobs, depth=args.pipeline_depth)
+        out.close()
+    finally:
+        cache.save()
+        if feature_cache is not None:
+            feature_cache.save()
+    if args.report:
+        instrumentation.write_report(args.report)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Crosswalk tables of how counties, cities and ZIP codes overlap: for every county and city, every ZIP code and city,
+and every ZIP code and county whose areas overlap, the fraction of each one's area that lies within the other.
+
+The places of each type are gathered into a `spatial.Layer`, as for point lookups, and the R-tree of one type
+finds the places whose bounding boxes meet each place of the other. The area two places share is then found with
+Green's theorem rather than by clipping one polygon against the other: the boundary of the shared area is made up
+of the parts of each place's boundary that lie inside the other, and the area is half the sum of x dy - y dx along
+it. A boundary the two places share counts once if both lie on the same side of it, and not at all otherwise.
+Areas are measured in degrees of longitude and latitude. Both places in a pair lie at much the same latitude, so
+that distortion mostly cancels out of the fractions.
+
+Pairs that overlap by less than `min_fraction` of both places' areas are left out, since places whose boundaries
+are drawn from different sources can overlap by a sliver. The tables are saved to a single file, which loads by
+memory-mapping it:
+
+    header      MAGIC, then the length of a JSON description
+    description the IDs of the places of each type, and where each table's arrays are
+    arrays      for each table, the index of each row's first and second place (uint32), the fraction of each
+                one's area within the other (float32), and the rows in order of their second place (uint32)
+
+Each table's rows are in order of their first place, so both columns can be searched.
+
+    python3 crosswalk.py build us-places.ndjson us-places.crosswalk --jobs 4
+    python3 crosswalk.py overlaps us-places.crosswalk postal_code 10001 city
+"""
+
+import argparse
+import functools
+import json
+import math
+import mmap
+import multiprocessing
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+from spatial import BAND_EDGES, LayerBuilder, json_loads
+from writers import RecordWriter
+
+MAGIC = b"PLACEXWK"
+HEADER = struct.Struct("<8sQ")
+
+# The pairs of place types there are tables for, as (first, second).
+TABLES = (("county", "city"), ("postal_code", "city"), ("postal_code", "county"))
+CROSSWALK_TYPES = ("county", "city", "postal_code")
+ARRAYS = (("first", "I"), ("second", "I"), ("first_fraction", "f"), ("second_fraction", "f"), ("second_order", "I"))
+
+DEFAULT_MIN_FRACTION = 0.001
+# Edges nearer each other than this, in degrees, lie along the same boundary. The inputs are rounded to 1e-6.
+TOLERANCE = 1e-9
+# How many places' outlines each process keeps, so that a county need not be outlined again for every ZIP code.
+OUTLINE_CACHE_SIZE = 1024
+
+Overlap = namedtuple("Overlap", ["type", "id", "fraction", "other_fraction"])
+
+
+def ring_directions(geometry):
+    """
+    Yield, for each ring of a Polygon or MultiPolygon in the order `geometry.rings()` yields them, 1 if the place's
+    interior lies to the left of the ring and -1 if it lies to the right.
+    """
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return
+    for polygon in polygons:
+        for i, ring in enumerate(polygon):
+            area = sum(x0 * y1 - x1 * y0 for (x0, y0, *_), (x1, y1, *_) in zip(ring, ring[1:]))
+            # The outer ring runs anticlockwise around the interior, and holes clockwise.
+            yield 1 if (area > 0) == (i == 0) else -1
+
+
+class Outline:
+    """One place's edges, each running with the place's interior on its left, in horizontal bands."""
+
+    def __init__(self, layer, directions, place):
+        c = layer.coordinates
+        edges = []
+        for ring in range(layer.place_rings[place], layer.place_rings[place + 1]):
+            points = [(c[2 * v], c[2 * v + 1]) for v in range(layer.ring_offsets[ring], layer.ring_offsets[ring + 1])]
+            if directions[ring] < 0:
+                points.reverse()
+            edges.extend((x1, y1, x2, y2) for (x1, y1), (x2, y2) in zip(points, points[1:]) if (x1, y1) != (x2, y2))
+        self.edges = edges
+        self.boxes = [(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)) for x1, y1, x2, y2 in edges]
+        if not edges:
+            self.bounds = (math.inf, math.inf, -math.inf, -math.inf)
+            self.area = 0.0
+            self.bottom, self.height, self.bands = 0.0, 1.0, []
+            return
+
+        xs = [edge[0] for edge in edges]
+        ys = [edge[1] for edge in edges]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        origin_x, origin_y = self.bounds[:2]
+        # Measured from a corner of the bounding box, to keep the sum's rounding error small.
+        self.area = sum(
+            (x1 - origin_x) * (y2 - origin_y) - (x2 - origin_x) * (y1 - origin_y) for x1, y1, x2, y2 in edges
+        ) / 2
+
+        count = max(1, min(len(edges) // BAND_EDGES, 4096))
+        self.bottom = self.bounds[1]
+        self.height = (self.bounds[3] - self.bottom) / count or 1.0
+        self.bands = [[] for _ in range(count)]
+        for i, (_, bottom, _, top) in enumerate(self.boxes):
+            for band in range(self.band(bottom), self.band(top) + 1):
+                self.bands[band].append(i)
+
+    def band(self, y):
+        return max(0, min(int((y - self.bottom) / self.height), len(self.bands) - 1))
+
+    def near(self, min_x, min_y, max_x, max_y):
+        """Yield the edges whose bounding boxes meet a box; an edge in several bands may be yielded more than once."""
+        boxes = self.boxes
+        for band in range(self.band(min_y), self.band(max_y) + 1):
+            for i in self.bands[band]:
+                left, bottom, right, top = boxes[i]
+                if left <= max_x and min_x <= right and bottom <= max_y and min_y <= top:
+                    yield i
+
+    def contains(self, x, y):
+        """Whether a point lies inside the place, by the even-odd rule."""
+        if not self.bands or not self.bounds[1] <= y <= self.bounds[3]:
+            return False
+        inside = False
+        for i in self.bands[self.band(y)]:
+            x1, y1, x2, y2 = self.edges[i]
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+
+def _sweep_inside(outline, other, origin, count_shared):
+    """
+    Sum x dy - y dx, measured from `origin`, along the parts of `outline`'s edges that lie inside `other`. Parts that
+    lie along `other`'s boundary count if both places lie on the same side of them and `count_shared` is true.
+    """
+    origin_x, origin_y = origin
+    edges = other.edges
+    total = 0.0
+    previous, carried = None, None
+    for i in sorted(set(outline.near(*other.bounds))):
+        x1, y1, x2, y2 = outline.edges[i]
+        dx, dy = x2 - x1, y2 - y1
+        nearby = set(other.near(*outline.boxes[i]))
+        if not nearby and previous == i - 1 and carried is not None and outline.edges[previous][2:] == (x1, y1):
+            # Nothing of the other place's boundary comes near this edge, nor the vertex it shares with the edge
+            # before it, so it lies on the same side of that boundary as the end of that edge.
+            inside = carried
+            if inside:
+                total += (x1 - origin_x) * (y2 - origin_y) - (x2 - origin_x) * (y1 - origin_y)
+            previous = i
+            continue
+
+        length = math.hypot(dx, dy)
+        cuts = [0.0, 1.0]
+        shared = []
+        for j in nearby:
+            u1, v1, u2, v2 = edges[j]
+            ex, ey = u2 - u1, v2 - v1
+            wx, wy = u1 - x1, v1 - y1
+            denominator = dx * ey - dy * ex
+            if abs(denominator) <= 1e-12 * length * math.hypot(ex, ey):
+                # Parallel edges: if they lie along the same line, find where they overlap.
+                if abs(wx * dy - wy * dx) > TOLERANCE * length:
+                    continue
+                start = (wx * dx + wy * dy) / (length * length)
+                end = ((u2 - x1) * dx + (v2 - y1) * dy) / (length * length)
+                low, high = max(0.0, min(start, end)), min(1.0, max(start, end))
+                if low < high:
+                    cuts += (low, high)
+                    shared.append((low, high, dx * ex + dy * ey > 0))
+                continue
+            t = (wx * ey - wy * ex) / denominator
+            u = (wx * dy - wy * dx) / denominator
+            if 0.0 < t < 1.0 and -1e-12 <= u <= 1 + 1e-12:
+                cuts.append(t)
+
+        cuts.sort()
+        carried = None
+        for start, end in zip(cuts, cuts[1:]):
+            if end - start <= 1e-12:
+                continue
+            middle = (start + end) / 2
+            for low, high, same_side in shared:
+                if low <= middle <= high:
+                    inside = same_side and count_shared
+                    carried = None
+                    break
+            else:
+                inside = carried = other.contains(x1 + middle * dx, y1 + middle * dy)
+            if inside:
+                ax, ay = x1 + start * dx - origin_x, y1 + start * dy - origin_y
+                bx, by = x1 + end * dx - origin_x, y1 + end * dy - origin_y
+                total += ax * by - bx * ay
+        previous = i
+    return total
+
+
+def shared_area(first, second):
+    """The area two outlined places have in common."""
+    origin = first.bounds[:2]
+    area = (_sweep_inside(first, second, origin, True) + _sweep_inside(second, first, origin, False)) / 2
+    return max(0.0, min(area, first.area, second.area))
+
+
+# The layers and ring directions each worker process outlines places from, by place type.
+_worker_layers = None
+
+
+def _init_crosswalk_worker(layers):
+    global _worker_layers
+    _worker_layers = layers
+
+
+@functools.lru_cache(maxsize=OUTLINE_CACHE_SIZE)
+def _outline(place_type, place):
+    layer, directions = _worker_layers[place_type]
+    return Outline(layer, directions, place)
+
+
+def _overlap_rows(task):
+    """The rows of one table for a range of its first type's places."""
+    first_type, second_type, start, stop, min_fraction = task
+    second_layer = _worker_layers[second_type][0]
+    rows = []
+    for place in range(start, stop):
+        outline = _outline(first_type, place)
+        if not outline.area:
+            continue
+        for other in sorted(second_layer.search(*outline.bounds)):
+            other_outline = _outline(second_type, other)
+            if not other_outline.area:
+                continue
+            area = shared_area(outline, other_outline)
+            fractions = (area / outline.area, area / other_outline.area)
+            if max(fractions) >= min_fraction:
+                rows.append((place, other, *fractions))
+    return rows
+
+
+class CrosswalkBuilder:
+    """Gathers the counties, cities and ZIP codes one at a time, then works out how they overlap."""
+
+    def __init__(self):
+        self.layers = {place_type: LayerBuilder(place_type) for place_type in CROSSWALK_TYPES}
+        self.directions = {place_type: array("b") for place_type in CROSSWALK_TYPES}
+
+    def add(self, metadata, geometry):
+        layer = self.layers.get(metadata["type"])
+        if layer is not None:
+            layer.add(metadata["id"], metadata["name"], geometry)
+            self.directions[metadata["type"]].extend(ring_directions(geometry))
+
+    def build(self, jobs=1, min_fraction=DEFAULT_MIN_FRACTION, chunk_size=256):
+        """
+        Return the Crosswalk of the places gathered so far. With more than one job, ranges of places are handed to
+        worker processes, which share the gathered places by forking.
+        """
+        layers = {
+            place_type: (layer.build(), self.directions[place_type])
+            for place_type, layer in self.layers.items() if len(layer)
+        }
+        tables = [(first, second) for first, second in TABLES if first in layers and second in layers]
+        tasks = [
+            (first, second, start, min(start + chunk_size, len(layers[first][0].places)), min_fraction)
+            for first, second in tables for start in range(0, len(layers[first][0].places), chunk_size)
+        ]
+        if jobs <= 1:
+            _init_crosswalk_worker(layers)
+            try:
+                results = list(map(_overlap_rows, tasks))
+            finally:
+                _init_crosswalk_worker(None)
+                _outline.cache_clear()
+        else:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(jobs, initializer=_init_crosswalk_worker, initargs=(layers,)) as pool:
+                results = pool.map(_overlap_rows, tasks)
+
+        rows = {table: [] for table in tables}
+        for (first, second, *_), task_rows in zip(tasks, results):
+            rows[first, second].extend(task_rows)
+        ids = {place_type: [place_id for place_id, _ in layer.places] for place_type, (layer, _) in layers.items()}
+        return Crosswalk(ids, {table: _table_arrays(table_rows) for table, table_rows in rows.items()})
+
+
+def _table_arrays(rows):
+    arrays = {
+        "first": array("I", (row[0] for row in rows)),
+        "second": array("I", (row[1] for row in rows)),
+        "first_fraction": array("f", (row[2] for row in rows)),
+        "second_fraction": array("f", (row[3] for row in rows)),
+    }
+    arrays["second_order"] = array("I", sorted(range(len(rows)), key=lambda row: (rows[row][1], rows[row][0])))
+    return arrays
+
+
+def _first_at_least(values, value, order=None):
+    """The first position in sorted `values`, or in `values` taken in `order`, holding `value` or more."""
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[order[middle] if order is not None else middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class Crosswalk:
+    """Answers which places of one type overlap a place of another, and by what fraction of their areas."""
+
+    def __init__(self, ids, tables, path=None):
+        self.ids = ids
+        self.tables = tables
+        self.path = path
+        self._indexes = {}
+
+    def index(self, place_type, place_id):
+        indexes = self._indexes.get(place_type)
+        if indexes is None:
+            indexes = self._indexes[place_type] = {place_id: i for i, place_id in enumerate(self.ids[place_type])}
+        return indexes[place_id]
+
+    def overlaps(self, place_type, place_id, other_type):
+        """
+        Return the places of `other_type` that overlap a place, with the fraction of the place's area within each,
+        and the fraction of each one's area within the place. Raises KeyError if there is no such place.
+        """
+        place = self.index(place_type, place_id)
+        table = self.tables.get((place_type, other_type))
+        if table is not None:
+            first = table["first"]
+            rows = range(_first_at_least(first, place), _first_at_least(first, place + 1))
+            return [
+                Overlap(other_type, self.ids[other_type][table["second"][row]],
+                        table["first_fraction"][row], table["second_fraction"][row])
+                for row in rows
+            ]
+        table = self.tables.get((other_type, place_type))
+        if table is None:
+            raise ValueError(f"There is no crosswalk between {place_type} and {other_type}")
+        second, order = table["second"], table["second_order"]
+        positions = range(_first_at_least(second, place, order), _first_at_least(second, place + 1, order))
+        return [
+            Overlap(other_type, self.ids[other_type][table["first"][order[i]]],
+                    table["second_fraction"][order[i]], table["first_fraction"][order[i]])
+            for i in positions
+        ]
+
+    def save(self, path):
+        """Write the crosswalk to a file: a JSON description, then every table's arrays, 8-byte aligned."""
+        blobs = []
+        offset = 0
+        tables = []
+        for (first, second), arrays in self.tables.items():
+            described = {}
+            for name, typecode in ARRAYS:
+                values = arrays[name]
+                if sys.byteorder != "little":
+                    values = array(typecode, values)
+                    values.byteswap()
+                data = bytes(values)
+                described[name] = [offset, len(data)]
+                blobs.append(data + b"\0" * (-len(data) % 8))
+                offset += len(blobs[-1])
+            tables.append({"first": first, "second": second, "rows": len(arrays["first"]), "arrays": described})
+
+        header = json.dumps({"ids": self.ids, "tables": tables}).encode("utf-8")
+        header += b" " * (-(HEADER.size + len(header)) % 8)
+        with open(path, "wb") as stream:
+            stream.write(HEADER.pack(MAGIC, len(header)))
+            stream.write(header)
+            for blob in blobs:
+                stream.write(blob)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as stream:
+            data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a crosswalk")
+        if sys.byteorder != "little":
+            raise ValueError("Crosswalks can only be memory-mapped on little-endian machines")
+        header = json.loads(data[HEADER.size:HEADER.size + header_length])
+        base = HEADER.size + header_length
+        view = memoryview(data)
+        tables = {}
+        for described in header["tables"]:
+            arrays = {}
+            for name, typecode in ARRAYS:
+                offset, length = described["arrays"][name]
+                arrays[name] = view[base + offset:base + offset + length].cast(typecode)
+            tables[described["first"], described["second"]] = arrays
+        return cls(header["ids"], tables, path)
+
+
+class CrosswalkWriter(RecordWriter):
+    """
+    Passes the output through to another writer, gathering the counties, cities and ZIP codes on the way, and writes
+    their crosswalk to `path` when closed.
+    """
+
+    def __init__(self, stream, path, jobs=1, min_fraction=DEFAULT_MIN_FRACTION):
+        super().__init__()
+        self.stream = stream
+        self.path = path
+        self.jobs = jobs
+        self.min_fraction = min_fraction
+        self.builder = CrosswalkBuilder()
+
+    def write_record(self, metadata, geometry, place=None):
+        place = self.parsed(metadata, place)
+        self.pass_record(self.stream, metadata, geometry, place)
+        if place["type"] in CROSSWALK_TYPES:
+            self.builder.add(place, json_loads(geometry))
+
+    def close(self):
+        super().close()
+        self.stream.close()
+        self.builder.build(self.jobs, self.min_fraction).save(self.path)
+
+
+def from_output(path, jobs=1, min_fraction=DEFAULT_MIN_FRACTION):
+    """Work out the crosswalk of an uncompressed consolidated output file."""
+    builder = CrosswalkBuilder()
+    with open(path, "rb") as stream:
+        for metadata in stream:
+            geometry = next(stream)
+            place = json_loads(metadata)
+            if place["type"] in CROSSWALK_TYPES:
+                builder.add(place, json_loads(geometry))
+    return builder.build(jobs, min_fraction)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the crosswalk of counties, cities and ZIP codes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a crosswalk from an uncompressed output file")
+    build.add_argument("output", help="consolidated output file with GeoJSON geometries")
+    build.add_argument("crosswalk", help="path to write the crosswalk to")
+    build.add_argument("--jobs", type=int, default=1, metavar="N", help="number of worker processes (default: 1)")
+    build.add_argument(
+        "--min-fraction", type=float, default=DEFAULT_MIN_FRACTION, metavar="FRACTION",
+        help=f"leave out pairs that overlap by less than this fraction of both places' areas "
+             f"(default: {DEFAULT_MIN_FRACTION})"
+    )
+    overlaps = commands.add_parser("overlaps", help="list the places of one type that overlap a place")
+    overlaps.add_argument("crosswalk", help="crosswalk built by the build command")
+    overlaps.add_argument("type", choices=CROSSWALK_TYPES)
+    overlaps.add_argument("id")
+    overlaps.add_argument("other_type", choices=CROSSWALK_TYPES)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "build":
+        from_output(args.output, args.jobs, args.min_fraction).save(args.crosswalk)
+    else:
+        for overlap in Crosswalk.load(args.crosswalk).overlaps(args.type, args.id, args.other_type):
+            print(json.dumps(overlap._asdict()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,9 +2,26 @@
 
 set -e
 
-/bin/sh /extract_and_convert_zipfiles.sh
-
 OUTPUT_FILE="/places/docker-output/us-places.ndjson"
+JOBS="${PLACES_JOBS:-$(nproc)}"
+
+# Intermediate files and cached output sections are kept in the mounted volume between runs, so that only the
+# inputs which changed since the last run are extracted, converted and consolidated again.
+ARTIFACTS_DIR="/places/docker-artifacts"
+export PLACES_WORKDIR="${ARTIFACTS_DIR}/workdir"
+
+# With PLACES_INPUT=shapefile, the shapefiles are read straight from their archives instead of being converted to
+# GeoJSON with ogr2ogr first.
+INPUT_FORMAT="${PLACES_INPUT:-geojson}"
+
+# With PLACES_JSON_BACKEND=orjson, places are serialized several times faster, as compact UTF-8 JSON rather than the
+# standard library's escaped ASCII.
+JSON_BACKEND="${PLACES_JSON_BACKEND:-stdlib}"
+
+# The archives are converted and the places consolidated at the same time, each section of the output as soon as
+# the files it reads are ready.
 echo "Writing the output to $(basename $OUTPUT_FILE) in the docker-output directory"
-python3 /consolidate_generated_geojson.py > $OUTPUT_FILE
+python3 /build_places.py --extract-jobs "$JOBS" --convert-jobs "$JOBS" -- --jobs "$JOBS" \
+    --cache-dir "${ARTIFACTS_DIR}/cache" --input-format "$INPUT_FORMAT" --shapefile-dir /places \
+    --json-backend "$JSON_BACKEND" > $OUTPUT_FILE
 echo "Write complete! Exiting."
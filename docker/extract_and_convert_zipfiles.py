@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Unzip the Census Bureau and Geonames archives and convert every shapefile to GeoJSON with `ogr2ogr`.
+
+Each Census Bureau archive is extracted and its shapefiles converted as one task, and tasks run concurrently on a
+bounded pool of workers. The first failure cancels any work that has not started yet and exits non-zero.
+
+A manifest in the working directory records the content hash of every archive, so archives that have not changed
+since the previous run are neither extracted nor converted again.
+
+With --geonames-only, only the Geonames archives are extracted, for a build that reads the Census Bureau shapefiles
+straight from their archives (consolidate_generated_geojson.py --input-format shapefile) and so needs no ogr2ogr.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from build_manifest import BuildManifest
+
+SOURCE_DIR = Path("/places")
+WORKDIR = Path(os.environ.get("PLACES_WORKDIR", "/tmp/places_workdir"))
+
+
+def extract(archive, destination, members=None):
+    with zipfile.ZipFile(archive) as zf:
+        zf.extractall(destination, members=members)
+
+
+def convert(shapefile, destination):
+    # ogr2ogr refuses to overwrite an existing GeoJSON file.
+    if destination.exists():
+        destination.unlink()
+    subprocess.run(["ogr2ogr", "-f", "GeoJSON", str(destination), str(shapefile)], check=True)
+
+
+def shapefile_members(archive):
+    with zipfile.ZipFile(archive) as zf:
+        return [name for name in zf.namelist() if name.endswith(".shp")]
+
+
+def extract_and_convert(archive, shapefile_dir, geojson_dir):
+    """
+    Extract one Census Bureau archive and convert its shapefiles, returning the shapefile and GeoJSON names of each
+    along with the seconds its conversion took.
+    """
+    extract(archive, shapefile_dir)
+    converted = []
+    for member in shapefile_members(archive):
+        shapefile = shapefile_dir / member
+        destination = geojson_dir / f"{shapefile.stem}.json"
+        start = time.perf_counter()
+        convert(shapefile, destination)
+        converted.append((shapefile.name, destination.name, time.perf_counter() - start))
+    return converted
+
+
+def geonames_members(archives):
+    """
+    Assign each extracted Geonames path to a single archive, as `unzip -o` run in order would leave it.
+
+    Every Geonames archive ships its own readme.txt; extracting it from several archives at once would race.
+    """
+    owners = {}
+    for archive in archives:
+        with zipfile.ZipFile(archive) as zf:
+            for name in zf.namelist():
+                owners[name] = archive
+    members = {archive: [] for archive in archives}
+    for name, archive in owners.items():
+        members[archive].append(name)
+    return members
+
+
+def run(source_dir, workdir, jobs, convert_shapefiles=True):
+    shapefile_dir = workdir / "shapefiles"
+    geonames_dir = workdir / "geonames"
+    geojson_dir = workdir / "geojson"
+    for directory in (shapefile_dir, geonames_dir, geojson_dir):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    manifest = BuildManifest(workdir / "manifest.json")
+    try:
+        return _run(manifest, source_dir, shapefile_dir, geonames_dir, geojson_dir, jobs, convert_shapefiles)
+    finally:
+        manifest.save()
+
+
+def _run(manifest, source_dir, shapefile_dir, geonames_dir, geojson_dir, jobs, convert_shapefiles):
+    cb_archives = sorted(source_dir.glob("cb_*.zip")) if convert_shapefiles else []
+    geonames_archives = sorted(source_dir.glob("??.zip"))
+    shapefile_count = sum(len(shapefile_members(archive)) for archive in cb_archives)
+
+    print(f"Unzipping {len(geonames_archives)} geoname archives and converting {shapefile_count} shapefiles "
+          f"from {len(cb_archives)} archives to GeoJSON with {jobs} workers...", flush=True)
+
+    converted = 0
+
+    def report(converted_files, note=""):
+        nonlocal converted
+        for shapefile, geojson_file, seconds in converted_files:
+            converted += 1
+            timing = note or f" {seconds:7.2f}s, {(geojson_dir / geojson_file).stat().st_size:>12,} bytes"
+            print(f"({converted:2}/{shapefile_count:2}) {shapefile:>30} --> {geojson_file:<35}{timing}", flush=True)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        tasks = {}
+        for archive, members in geonames_members(geonames_archives).items():
+            step = f"extract:{archive.name}"
+            inputs = {"archive": manifest.digest(archive), "members": sorted(members)}
+            if manifest.is_current(step, inputs):
+                print(f"  {archive.name} (unchanged)", flush=True)
+                continue
+            outputs = [geonames_dir / member for member in members]
+            tasks[executor.submit(extract, archive, geonames_dir, members)] = (archive, step, inputs, outputs)
+        for archive in cb_archives:
+            step = f"convert:{archive.name}"
+            inputs = {"archive": manifest.digest(archive)}
+            if manifest.is_current(step, inputs):
+                report([(f"{path.stem}.shp", path.name, None) for path in manifest.outputs(step)], " (unchanged)")
+                continue
+            task = executor.submit(extract_and_convert, archive, shapefile_dir, geojson_dir)
+            tasks[task] = (archive, step, inputs, None)
+
+        pending = set(tasks)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+            for task in done:
+                archive, step, inputs, outputs = tasks[task]
+                error = task.exception()
+                if error is not None:
+                    for waiting in pending:
+                        waiting.cancel()
+                    print(f"Failed to process {archive.name}: {error}", file=sys.stderr, flush=True)
+                    return 1
+                if outputs is not None:
+                    manifest.record(step, inputs, outputs)
+                    print(f"  {archive.name}", flush=True)
+                    continue
+                converted_files = task.result()
+                manifest.record(step, inputs, [geojson_dir / geojson_file for _, geojson_file, _ in converted_files])
+                report(converted_files)
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Unzip the bundled archives and convert their shapefiles to GeoJSON.")
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count() or 1, metavar="N",
+        help="maximum number of archives processed at once (default: number of CPUs)"
+    )
+    parser.add_argument("--source-dir", type=Path, default=SOURCE_DIR, help="directory containing the zip archives")
+    parser.add_argument("--workdir", type=Path, default=WORKDIR, help="directory to extract and convert into")
+    parser.add_argument(
+        "--geonames-only", action="store_true",
+        help="only extract the Geonames archives, leaving the Census Bureau shapefiles in theirs"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return run(args.source_dir, args.workdir, max(args.jobs, 1), convert_shapefiles=not args.geonames_only)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+An on-disk cache of parsed Census Bureau features, so that rebuilding with different output options over the same
+inputs need not parse the same GeoJSON (or shapefiles) again.
+
+Each source file is cached as a whole, in a file named for the SHA-256 of its contents. The hash of each source is
+remembered against its size and modification time, as the build manifest does, so an unchanged source is not even
+read. Each feature's properties and geometry are stored with `marshal`, which loads them many times faster than a
+JSON parser can. Its format can change between Python versions, so a cache file only serves the Python that wrote
+it. Layout:
+
+    header      MAGIC, then the Python implementation's cache tag, NUL-padded to 16 bytes
+    data        each feature, marshalled as (properties, geometry type, coordinates)
+    offsets     where each feature starts in the file, plus where the last one ends, 8-byte aligned
+    footer      the feature count, and where the offsets start
+
+The cache is memory-mapped to read it, and features can be read from any range of it, so a cached file can be
+split into batches for worker processes. When the cache grows past its size limit, the files used least recently
+are evicted. Segments and temporary files count toward the limit too, and those left by an interrupted run are
+deleted by the next one.
+
+A file split into batches for worker processes is cached the same way, each worker caching its batch as a segment
+beside the cache file; whichever worker finishes the last segment joins them all into the cache file.
+"""
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from pathlib import Path
+
+from build_manifest import BuildManifest
+from shapefile_reader import Feature
+
+MAGIC = b"PLACEFTR"
+HEADER = struct.Struct("<8s16s")
+FOOTER = struct.Struct("<QQ")
+FORMAT_TAG = (sys.implementation.cache_tag or sys.implementation.name).encode("ascii")[:16]
+SUFFIX = ".features"
+SEGMENT_SUFFIX = ".segment"
+# What a run leaves behind if it is interrupted: segments not yet joined, and files not yet fully written.
+PARTIAL_PATTERNS = (f"*{SEGMENT_SUFFIX}", "*.tmp")
+# File modification times come from a coarser clock than time.time_ns(), so a file written as a run starts can seem
+# a little older than the run.
+CLOCK_SLACK_NS = 1_000_000_000
+
+DEFAULT_MAX_BYTES = 2 << 30
+
+
+class CachedFeatures:
+    """
+    A memory-mapped cache file, giving random access to the features of one source file. The file is unmapped once
+    `features()` has been read, or when `close()` is called.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            self.data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, tag = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or tag.rstrip(b"\0") != FORMAT_TAG:
+            self.data.close()
+            raise ValueError(f"{path} is not a feature cache written by this Python")
+        self.count, position = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        self.offsets = array("Q")
+        self.offsets.frombytes(self.data[position:position + 8 * (self.count + 1)])
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def records(self):
+        """Yield every feature still marshalled, as bytes."""
+        try:
+            for i in range(self.count):
+                yield self.data[self.offsets[i]:self.offsets[i + 1]]
+        finally:
+            self.close()
+
+    def features(self, start=0, stop=None):
+        """Yield the features from `start` up to `stop`, unmarshalling each straight from the mapping."""
+        view = memoryview(self.data)
+        try:
+            for i in range(start, self.count if stop is None else stop):
+                properties, geometry_type, coordinates = marshal.loads(view[self.offsets[i]:self.offsets[i + 1]])
+                geometry = None if geometry_type is None else {"type": geometry_type, "coordinates": coordinates}
+                yield Feature(properties, geometry)
+        finally:
+            view.release()
+            self.close()
+
+
+class FeatureCacheWriter:
+    """Writes features to a cache file as they are parsed. The file only takes its place once `close()` is called."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        self.stream = open(self.temporary, "wb")
+        self.stream.write(HEADER.pack(MAGIC, FORMAT_TAG))
+        self.offsets = array("Q", [HEADER.size])
+
+    def add(self, feature):
+        geometry = feature.geometry
+        record = (
+            dict(feature.properties),
+            None if geometry is None else geometry["type"],
+            None if geometry is None else geometry["coordinates"],
+        )
+        self.add_record(marshal.dumps(record))
+
+    def add_record(self, data):
+        """Add a feature already marshalled, as read by `CachedFeatures.records()`."""
+        self.stream.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        position = self.offsets[-1]
+        padding = -position % 8
+        offsets = self.offsets
+        if sys.byteorder != "little":
+            offsets = array("Q", offsets)
+            offsets.byteswap()
+        self.stream.write(b"\0" * padding + offsets.tobytes())
+        self.stream.write(FOOTER.pack(len(self.offsets) - 1, position + padding))
+        self.stream.close()
+        os.replace(self.temporary, self.path)
+
+    def discard(self):
+        self.stream.close()
+        os.unlink(self.temporary)
+
+
+class FeatureCache:
+    """A directory of cached features, holding at most about `max_bytes` of them."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # Partial files older than this were left by an earlier run, so nothing will finish them.
+        self.started_ns = time.time_ns() - CLOCK_SLACK_NS
+        self._manifest = None
+
+    def __getstate__(self):
+        # Worker processes hash their sources for themselves, rather than share the manifest and its lock.
+        return {"directory": self.directory, "max_bytes": self.max_bytes, "started_ns": self.started_ns,
+                "_manifest": None}
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = BuildManifest(self.directory / "manifest.json")
+        return self._manifest
+
+    def entry(self, source):
+        return self.directory / f"{self.manifest.digest(source)}{SUFFIX}"
+
+    def get(self, source):
+        """The cached features of a source file, or None if it has not been cached."""
+        path = self.entry(source)
+        try:
+            cached = CachedFeatures(path)
+        except (FileNotFoundError, ValueError, struct.error):
+            return None
+        # Eviction goes by modification time, so mark the file as used.
+        os.utime(path)
+        return cached
+
+    def features(self, source, parse):
+        """
+        Yield the features of a source file from the cache, or else from `parse()`, caching them as they are
+        parsed. The features are only cached if all of them are read.
+        """
+        cached = self.get(source)
+        if cached is not None:
+            yield from cached.features()
+            return
+        path = self.entry(source)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        writer = FeatureCacheWriter(path)
+        try:
+            for feature in parse():
+                writer.add(feature)
+                yield feature
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        self.evict(keep=path)
+
+    def segment(self, entry, index, count):
+        return entry.with_name(f"{entry.name}.{index}of{count}{SEGMENT_SUFFIX}")
+
+    def segment_features(self, entry, index, count, parse):
+        """
+        Yield the features of batch `index` of `count` of the source cached at `entry`, from `parse()`, caching them
+        as a segment of it. The features are only cached if all of them are read.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        writer = FeatureCacheWriter(self.segment(entry, index, count))
+        try:
+            for feature in parse():
+                writer.add(feature)
+                yield feature
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        self.join_segments(entry, count)
+
+    def join_segments(self, entry, count):
+        """Join the `count` segments of a source into its cache file, once every one of them has been written."""
+        segments = [self.segment(entry, index, count) for index in range(count)]
+        if not all(segment.exists() for segment in segments):
+            return
+        writer = FeatureCacheWriter(entry)
+        try:
+            for segment in segments:
+                for record in CachedFeatures(segment).records():
+                    writer.add_record(record)
+        except FileNotFoundError:
+            # Another worker finished at the same time, and has joined them already.
+            writer.discard()
+            return
+        writer.close()
+        for segment in segments:
+            segment.unlink(missing_ok=True)
+        self.evict(keep=entry)
+
+    def evict(self, keep=None):
+        """
+        Delete the partial files left by earlier runs, then the least recently used cache files until the rest, and
+        the partial files of this run, fit within the size limit.
+        """
+        entries = []
+        total = 0
+        partial = [path for pattern in PARTIAL_PATTERNS for path in self.directory.glob(pattern)]
+        for path in [*self.directory.glob(f"*{SUFFIX}"), *partial]:
+            try:
+                stat = path.stat()
+                if path.name.endswith(SUFFIX):
+                    entries.append((path == keep, stat.st_mtime_ns, stat.st_size, path))
+                elif stat.st_mtime_ns < self.started_ns:
+                    path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+        # Evict the others from the least recently used on, and the file just written only if it is too big alone.
+        for _, _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def save(self):
+        """Save the hashes of the sources, and bring the cache within its size limit in case the limit was lowered."""
+        if self._manifest is not None:
+            self.manifest.save()
+        if self.directory.exists():
+            self.evict()
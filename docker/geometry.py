@@ -0,0 +1,303 @@
+"""
+Coordinate rounding and topology-preserving simplification of Polygon and MultiPolygon geometries.
+
+Neighbouring places in the Census Bureau boundary files share their boundaries vertex for vertex. Simplifying each
+ring on its own would remove different vertices from the two sides of a shared boundary and open gaps or overlaps
+between neighbours. Instead, `TopologySimplifier` first finds the junctions: vertices where the rings passing
+through them part ways. Each ring is cut at its junctions into arcs. The run of vertices along a shared boundary
+then forms the same arc in every ring that shares it, and each arc is simplified the same way wherever it appears.
+"""
+
+import math
+from itertools import compress, repeat
+from operator import add, itemgetter, mul, ne, sub
+
+PLACE_TYPES = ("nation", "state", "county", "city", "postal_code")
+
+# Marks a vertex whose rings do not all pass through it between the same two neighbours.
+_JUNCTION = object()
+
+
+def rings(geometry):
+    """Yield every ring of a Polygon or MultiPolygon."""
+    if geometry["type"] == "Polygon":
+        yield from geometry["coordinates"]
+    elif geometry["type"] == "MultiPolygon":
+        for polygon in geometry["coordinates"]:
+            yield from polygon
+
+
+def map_rings(geometry, function):
+    """Return a copy of a Polygon or MultiPolygon with `function` applied to each ring; other geometries pass as is."""
+    if geometry["type"] == "Polygon":
+        coordinates = [function(ring) for ring in geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        coordinates = [[function(ring) for ring in polygon] for polygon in geometry["coordinates"]]
+    else:
+        return geometry
+    return {"type": geometry["type"], "coordinates": coordinates}
+
+
+def round_ring(ring, precision):
+    """Round a ring's coordinates, dropping vertices that become duplicates of the vertex before them."""
+    xs = map(round, map(itemgetter(0), ring), repeat(precision))
+    ys = map(round, map(itemgetter(1), ring), repeat(precision))
+    rounded = list(map(list, zip(xs, ys)))
+    deduplicated = rounded[:1] + list(compress(rounded[1:], map(ne, rounded[1:], rounded)))
+    # A ring needs at least three distinct vertices plus its closing vertex.
+    return deduplicated if len(deduplicated) >= 4 else rounded
+
+
+def _segment_distance(point, start, end):
+    """The distance from `point` to the line segment from `start` to `end`."""
+    x, y = point
+    x1, y1 = start
+    dx, dy = end[0] - x1, end[1] - y1
+    length = dx * dx + dy * dy
+    if length:
+        t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length))
+        x1, y1 = x1 + t * dx, y1 + t * dy
+    return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+
+
+def douglas_peucker(points, tolerance):
+    """Simplify a line, keeping its end points, so that no removed vertex lies further than `tolerance` from it."""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            d = _segment_distance(points[i], points[first], points[last])
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _simplify_arc(arc, tolerance):
+    """Simplify an arc the same way whichever direction a ring traverses it in."""
+    backward = arc[::-1]
+    if backward < arc:
+        return douglas_peucker(backward, tolerance)[::-1]
+    return douglas_peucker(arc, tolerance)
+
+
+def _contains(polygon, x, y):
+    """Whether a point lies inside a polygon's rings, by the even-odd rule."""
+    inside = False
+    for ring in polygon:
+        for (x1, y1, *_), (x2, y2, *_) in zip(ring, ring[1:]):
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+def _widest_crossing(polygon, y):
+    """The midpoint of the widest stretch of a horizontal line through `y` that lies inside a polygon, or None."""
+    crossings = sorted(
+        x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        for ring in polygon
+        for (x1, y1, *_), (x2, y2, *_) in zip(ring, ring[1:])
+        if (y1 > y) != (y2 > y)
+    )
+    intervals = list(zip(crossings[::2], crossings[1::2]))
+    if not intervals:
+        return None
+    left, right = max(intervals, key=lambda interval: interval[1] - interval[0])
+    return (left + right) / 2
+
+
+def extent(geometry):
+    """
+    Return the bounding box, the area-weighted centroid, and a label point inside the largest polygon of a Polygon or
+    MultiPolygon, or None if it has no rings.
+
+    Each ring is reduced with a handful of whole-ring sums over its coordinates. `map()` over operator functions
+    drives each one, which saves the per-vertex tuple unpacking of a comprehension, but still makes a call per vertex.
+    """
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return None
+
+    bounds = [math.inf, math.inf, -math.inf, -math.inf]
+    area = moment_x = moment_y = 0.0
+    largest, largest_area, largest_centroid = None, -math.inf, None
+    for polygon in polygons:
+        polygon_area = polygon_x = polygon_y = 0.0
+        for i, ring in enumerate(polygon):
+            xs = list(map(itemgetter(0), ring))
+            ys = list(map(itemgetter(1), ring))
+            if not xs:
+                continue
+            bounds = [min(bounds[0], min(xs)), min(bounds[1], min(ys)),
+                      max(bounds[2], max(xs)), max(bounds[3], max(ys))]
+            cross = list(map(sub, map(mul, xs, ys[1:]), map(mul, xs[1:], ys)))
+            ring_area = sum(cross) / 2
+            # Count the outer ring positively and holes negatively, whichever way each ring is wound.
+            sign = (1 if i == 0 else -1) * (1 if ring_area >= 0 else -1)
+            polygon_area += sign * ring_area
+            polygon_x += sign * sum(map(mul, map(add, xs, xs[1:]), cross)) / 6
+            polygon_y += sign * sum(map(mul, map(add, ys, ys[1:]), cross)) / 6
+        area += polygon_area
+        moment_x += polygon_x
+        moment_y += polygon_y
+        if polygon_area > largest_area:
+            largest, largest_area = polygon, polygon_area
+            largest_centroid = (polygon_x / polygon_area, polygon_y / polygon_area) if polygon_area else None
+
+    if largest is None or bounds[0] == math.inf:
+        return None
+    if area:
+        centroid = (moment_x / area, moment_y / area)
+    else:
+        centroid = ((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2)
+
+    # The centroid of a concave polygon can fall outside it; if so, label the middle of its widest horizontal span.
+    label = largest_centroid
+    if label is None or not _contains(largest, *label):
+        label = None
+        ys = [point[1] for point in largest[0]]
+        for y in ([largest_centroid[1]] if largest_centroid else []) + [(min(ys) + max(ys)) / 2]:
+            x = _widest_crossing(largest, y)
+            if x is not None:
+                label = (x, y)
+                break
+        if label is None:
+            label = tuple(largest[0][0][:2])
+
+    return {"bbox": bounds, "centroid": list(centroid), "label_point": list(label)}
+
+
+def add_neighbours(neighbours, points):
+    """
+    Record the two neighbours of each vertex of a ring, given without its closing vertex, in `neighbours`; a vertex
+    already recorded with other neighbours is marked as a junction.
+    """
+    for i, point in enumerate(points):
+        pair = (points[i - 1], points[(i + 1) % len(points)])
+        seen = neighbours.get(point)
+        if seen is None:
+            neighbours[point] = pair
+        elif seen is not _JUNCTION and seen != pair and seen != pair[::-1]:
+            neighbours[point] = _JUNCTION
+
+
+def find_junctions(neighbours):
+    """The vertices marked as junctions by `add_neighbours`."""
+    return {point for point, pair in neighbours.items() if pair is _JUNCTION}
+
+
+def cut_ring(points, junctions):
+    """
+    Cut a ring, given without its closing vertex, into arcs at its junctions, starting at the first. Each arc ends
+    where the next begins, and the last where the first begins.
+    """
+    cuts = [i for i, point in enumerate(points) if point in junctions]
+    if not cuts:
+        # Start a ring with no junctions at its lowest vertex, so the ring is cut the same way in every geometry
+        # that contains all of it.
+        cuts = [points.index(min(points))]
+
+    start = cuts[0]
+    points = points[start:] + points[:start]
+    cuts = [cut - start for cut in cuts] + [len(points)]
+    points.append(points[0])
+    return [points[first:last + 1] for first, last in zip(cuts, cuts[1:])]
+
+
+class TopologySimplifier:
+    """
+    Simplifies a set of geometries with one tolerance, keeping the boundaries they share identical.
+
+    Every geometry must be passed to `add()` before any is passed to `simplify()`, since a junction can only be
+    recognised once all the rings through it have been seen.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.neighbours = {}
+        self.junctions = None
+
+    def add(self, geometry):
+        for ring in rings(geometry):
+            add_neighbours(self.neighbours, [tuple(point[:2]) for point in ring[:-1]])
+
+    def simplify(self, geometry):
+        if self.junctions is None:
+            self.junctions = find_junctions(self.neighbours)
+            self.neighbours = None
+        return map_rings(geometry, self.simplify_ring)
+
+    def simplify_ring(self, ring):
+        points = [tuple(point[:2]) for point in ring[:-1]]
+        if len(points) < 3:
+            return ring
+        arcs = cut_ring(points, self.junctions)
+        simplified = [arcs[0][0]]
+        for arc in arcs:
+            simplified.extend(_simplify_arc(arc, self.tolerance)[1:])
+        if len(simplified) < 4:
+            # The ring collapsed; keep it as it was rather than output a degenerate polygon.
+            return ring
+        return [list(point) for point in simplified]
+
+
+class GeometryTransform:
+    """
+    Prepares geometries for output by optionally simplifying them with a per-place-type tolerance, then rounding
+    their coordinates to a number of decimal places. Optionally describes each output geometry's extent as well.
+    """
+
+    def __init__(self, precision=None, tolerances=None, extents=False):
+        self.precision = precision
+        self.tolerances = dict(tolerances or {})
+        self.extents = extents
+
+    @property
+    def settings(self):
+        return {"precision": self.precision, "tolerances": self.tolerances, "extents": self.extents}
+
+    def __bool__(self):
+        return self.precision is not None or bool(self.tolerances) or self.extents
+
+    def extent(self, geometry):
+        """The extent of an output geometry, if extents were requested, rounded like its coordinates."""
+        if not self.extents:
+            return None
+        described = extent(geometry)
+        if described is not None and self.precision is not None:
+            described = {key: [round(value, self.precision) for value in values] for key, values in described.items()}
+        return described
+
+    def shaper(self, place_type, geometries):
+        """
+        Return a function that transforms the geometries of places of `place_type`.
+
+        `geometries` is a callable returning an iterable over every geometry that will be transformed; it is only
+        consumed, ahead of time, when places of this type are simplified.
+        """
+        tolerance = self.tolerances.get(place_type)
+        simplifier = None
+        if tolerance:
+            simplifier = TopologySimplifier(tolerance)
+            for geometry in geometries():
+                simplifier.add(geometry)
+
+        def shape(geometry):
+            if simplifier is not None:
+                geometry = simplifier.simplify(geometry)
+            if self.precision is not None:
+                geometry = map_rings(geometry, lambda ring: round_ring(ring, self.precision))
+            return geometry
+
+        return shape
@@ -0,0 +1,262 @@
+"""
+A binary container for the output geometries, written alongside the metadata NDJSON instead of GeoJSON lines.
+
+Each geometry is stored as little-endian WKB. The file starts with a packed R-tree over the geometries' bounding
+boxes, like FlatGeobuf's, so a reader can find the places in an area without reading any geometry. `GeometryReader`
+memory-maps the file and hands out each ring's coordinates as a memoryview of doubles, without copying or parsing
+them.
+
+Layout, with every section 8-byte aligned:
+
+    header          MAGIC, place count, R-tree node capacity, number of R-tree levels
+    level sizes     the number of boxes in each level of the R-tree, leaves first
+    boxes           (min x, min y, max x, max y) of each geometry, in place order
+    order           the place each leaf of the R-tree refers to
+    levels          the boxes of each level of the R-tree
+    offsets         where each geometry's WKB starts within the data, plus where the last one ends
+    data            the WKB of each geometry, in place order
+
+Place i's geometry belongs to line i of the metadata written with it.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from itertools import chain
+
+from spatial import NODE_CAPACITY, rtree_search, str_pack
+
+MAGIC = b"PLACEGEO"
+HEADER = struct.Struct("<8sQQQ")
+# Follows each metadata line in the serialized output: the length of the WKB and its bounding box.
+FRAME = struct.Struct("<I4d")
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+WKB_HEADER = struct.Struct("<BII")
+WKB_COUNT = struct.Struct("<I")
+
+EMPTY_BOX = (float("inf"), float("inf"), float("-inf"), float("-inf"))
+
+
+def _ring_coordinates(ring):
+    if ring and len(ring[0]) == 2:
+        coordinates = array("d", chain.from_iterable(ring))
+    else:
+        coordinates = array("d", chain.from_iterable(point[:2] for point in ring))
+    if sys.byteorder != "little":
+        coordinates.byteswap()
+    return coordinates
+
+
+def encode_wkb(geometry):
+    """Encode a Polygon or MultiPolygon as little-endian 2D WKB, returning the WKB and its bounding box."""
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+        parts = []
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+        parts = [WKB_HEADER.pack(1, WKB_MULTIPOLYGON, len(polygons))]
+    else:
+        raise ValueError(f"Cannot encode a {geometry['type']} geometry")
+
+    min_x, min_y, max_x, max_y = EMPTY_BOX
+    for polygon in polygons:
+        parts.append(WKB_HEADER.pack(1, WKB_POLYGON, len(polygon)))
+        for i, ring in enumerate(polygon):
+            coordinates = _ring_coordinates(ring)
+            parts.append(WKB_COUNT.pack(len(coordinates) // 2))
+            parts.append(coordinates.tobytes())
+            # Holes lie inside their polygon's outer ring, so only the outer ring can extend the bounding box.
+            if i == 0 and coordinates:
+                xs, ys = coordinates[0::2], coordinates[1::2]
+                min_x, min_y = min(min_x, min(xs)), min(min_y, min(ys))
+                max_x, max_y = max(max_x, max(xs)), max(max_y, max(ys))
+    return b"".join(parts), (min_x, min_y, max_x, max_y)
+
+
+def wkb_record(geometry):
+    """Serialize a geometry as it follows its metadata line in the output stream: a frame, then the WKB."""
+    data, box = encode_wkb(geometry)
+    return FRAME.pack(len(data), *box) + data
+
+
+def wkb_polygons(data):
+    """
+    Return the polygons of a Polygon or MultiPolygon's WKB, each as a list of its rings' coordinates as memoryviews
+    of x, y doubles into `data`.
+    """
+    data = memoryview(data)
+    _, geometry_type, count = WKB_HEADER.unpack_from(data, 0)
+    position = WKB_HEADER.size
+    if geometry_type == WKB_POLYGON:
+        position = 0
+        count = 1
+    polygons = []
+    for _ in range(count):
+        _, _, ring_count = WKB_HEADER.unpack_from(data, position)
+        position += WKB_HEADER.size
+        rings = []
+        for _ in range(ring_count):
+            (points,) = WKB_COUNT.unpack_from(data, position)
+            position += WKB_COUNT.size
+            rings.append(data[position:position + 16 * points].cast("d"))
+            position += 16 * points
+        polygons.append(rings)
+    return polygons
+
+
+def wkb_geometry(data):
+    """Decode a Polygon or MultiPolygon's WKB into GeoJSON."""
+    polygons = [
+        [[[ring[i], ring[i + 1]] for i in range(0, len(ring), 2)] for ring in polygon]
+        for polygon in wkb_polygons(data)
+    ]
+    _, geometry_type, _ = WKB_HEADER.unpack_from(data, 0)
+    if geometry_type == WKB_POLYGON:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def _align(length):
+    return b"\0" * (-length % 8)
+
+
+class ContainerWriter:
+    """
+    Takes the serialized output, framed by `wkb_record`, as arbitrary chunks of bytes. Writes each metadata line on
+    to `metadata`, and the geometries to a container at `path` when closed.
+    """
+
+    def __init__(self, metadata, path, node_capacity=NODE_CAPACITY):
+        self.metadata = metadata
+        self.path = path
+        self.node_capacity = node_capacity
+        self.pending = bytearray()
+        self.boxes = []
+        self.offsets = array("Q", [0])
+        self.spool_path = f"{path}.tmp"
+        self.spool = open(self.spool_path, "wb")
+
+    @property
+    def records(self):
+        return len(self.boxes)
+
+    def write(self, chunk):
+        pending = self.pending
+        pending += chunk
+        position = 0
+        while True:
+            newline = pending.find(b"\n", position)
+            if newline < 0 or newline + 1 + FRAME.size > len(pending):
+                break
+            length, *box = FRAME.unpack_from(pending, newline + 1)
+            start = newline + 1 + FRAME.size
+            if start + length > len(pending):
+                break
+            self.metadata.write(pending[position:newline + 1])
+            self.spool.write(pending[start:start + length])
+            self.boxes.append(box)
+            self.offsets.append(self.offsets[-1] + length)
+            position = start + length
+        del pending[:position]
+
+    def close(self):
+        self.spool.close()
+        if self.pending:
+            os.unlink(self.spool_path)
+            raise ValueError("The output ended partway through a place")
+        self.metadata.close()
+
+        order, levels = str_pack(self.boxes, self.node_capacity) if self.boxes else (array("q"), [])
+        boxes = array("d", chain.from_iterable(self.boxes))
+        sections = [boxes, order, *levels, self.offsets]
+        header = HEADER.pack(MAGIC, len(self.boxes), self.node_capacity, len(levels))
+        header += array("Q", [len(level) // 4 for level in levels]).tobytes()
+        with open(self.path, "wb") as stream:
+            stream.write(header + _align(len(header)))
+            for section in sections:
+                if sys.byteorder != "little":
+                    section = array(section.typecode, section)
+                    section.byteswap()
+                stream.write(section.tobytes())
+            with open(self.spool_path, "rb") as spool:
+                shutil.copyfileobj(spool, stream)
+        os.unlink(self.spool_path)
+
+
+class GeometryReader:
+    """
+    Random and spatial access to the geometries in a container.
+
+        with GeometryReader("us-places.geo") as geometries:
+            for i in geometries.search(-74.05, 40.68, -73.9, 40.88):
+                for polygon in geometries.polygons(i):
+                    outer = polygon[0]  # x0, y0, x1, y1, ... as a memoryview of doubles
+
+    The memoryviews refer straight into the memory-mapped file, so they must be released before the reader is
+    closed.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            self.data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.node_capacity, level_count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a geometry container")
+        if sys.byteorder != "little":
+            raise ValueError("Geometry containers can only be memory-mapped on little-endian machines")
+
+        view = memoryview(self.data)
+        position = HEADER.size
+        level_sizes = view[position:position + 8 * level_count].cast("Q")
+        position += 8 * level_count
+        position += -position % 8
+
+        def section(typecode, count):
+            nonlocal position
+            start, position = position, position + 8 * count
+            return view[start:position].cast(typecode)
+
+        self.boxes = section("d", 4 * self.count)
+        self.order = section("q", self.count)
+        self.levels = [section("d", 4 * size) for size in level_sizes]
+        self.offsets = section("Q", self.count + 1)
+        self.start = position
+        level_sizes.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for section in (self.boxes, self.order, *self.levels, self.offsets):
+            section.release()
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def wkb(self, place):
+        """The WKB of a place's geometry, as a memoryview into the file."""
+        return memoryview(self.data)[self.start + self.offsets[place]:self.start + self.offsets[place + 1]]
+
+    def bbox(self, place):
+        return tuple(self.boxes[4 * place:4 * place + 4])
+
+    def polygons(self, place):
+        """Return a place's polygons, each as a list of its rings' coordinates as memoryviews of x, y doubles."""
+        return wkb_polygons(self.wkb(place))
+
+    def geometry(self, place):
+        """Decode a place's geometry into a GeoJSON Polygon or MultiPolygon."""
+        return wkb_geometry(self.wkb(place))
+
+    def search(self, min_x, min_y, max_x, max_y):
+        """Return, in order, the places whose bounding boxes intersect a box."""
+        return sorted(rtree_search(self.levels, self.order, self.node_capacity, min_x, min_y, max_x, max_y))
@@ -0,0 +1,243 @@
+"""
+The table of what Geonames says about each ZIP code: the city it belongs to, and the state it is in.
+
+`GeonamesTable.from_files` reads and decodes each Geonames postal code file whole, then splits it line by line, with
+`map()` driving the splitting. Splitting the whole file at once on tabs and taking every twelfth cell as a column
+is no faster, since it creates a string for every one of the twelve columns rather than for the five that are
+used. Only a few dozen distinct state abbreviations occur, so `resolve()` looks each one up once rather than once
+per ZIP code.
+
+Even so, parsing costs about a microsecond per ZIP code, and most of that is creating the strings. So a table can
+be saved in a compact binary form, which `MappedGeonamesTable` memory-maps instead of parsing the files again. It
+finds a ZIP code by binary search over the first of each block of BLOCK_SIZE sorted, fixed-width ZIP codes, then
+`mmap.find()` within the block, and decodes a city name only when its ZIP code is looked up. Layout, with every
+section 8-byte aligned:
+
+    header          MAGIC, ZIP code count, abbreviation count, ZIP code width, city blob size
+    abbreviations   each state abbreviation (or country code), NUL-padded to 8 bytes
+    states          the index of each ZIP code's abbreviation, as uint16
+    city ends       where each city name ends in the city blob, as uint32
+    zip codes       the ZIP codes in UTF-8, each NUL-padded to the ZIP code width, in byte order
+    city blob       the city names, in UTF-8, in the same order as the ZIP codes
+"""
+
+import mmap
+import operator
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+
+MAGIC = b"PLACEZP2"
+HEADER = struct.Struct("<8sQQQQ")
+ABBREVIATION_SIZE = 8
+STATE = struct.Struct("<H")
+CITY_END = struct.Struct("<I")
+# How many ZIP codes a mapped table searches through with `mmap.find()` once it has found their block.
+BLOCK_SIZE = 64
+
+# Splits a line into its first five columns, which are the country code, postal code, place name, state name and
+# state code, and the rest.
+_columns = operator.methodcaller("split", "\t", 5)
+
+
+def _padded(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+def _ends(strings):
+    ends = array("I")
+    total = 0
+    for string in strings:
+        total += len(string)
+        ends.append(total)
+    return ends
+
+
+class GeonamesTable:
+    """Maps each ZIP code to its city name and the abbreviation of its state."""
+
+    def __init__(self, zip_codes, cities, abbreviations):
+        self.zip_codes = zip_codes
+        self.cities = cities
+        self.abbreviations = abbreviations
+
+    @classmethod
+    def from_files(cls, paths, extra_info=None):
+        """
+        Parse Geonames postal code files into a table. A ZIP code in a later file replaces the same ZIP code in an
+        earlier one, and any ZIP code in a file replaces the same ZIP code in `extra_info`, which maps ZIP codes to
+        (city, abbreviation) pairs to fill in what the files lack.
+        """
+        entries = dict(extra_info or {})
+        for path in paths:
+            with open(path, "rb") as stream:
+                rows = map(_columns, map(str.strip, stream.read().decode("utf-8").split("\n")))
+            # Geonames treats Puerto Rico et al. as different countries; the Census Bureau treats them as states in
+            # the United States.
+            entries.update({
+                row[1]: (row[2], row[4] if row[0] == "US" else row[0]) for row in rows if len(row) > 4
+            })
+        cities, abbreviations = zip(*entries.values()) if entries else ((), ())
+        return cls(list(entries), list(cities), list(abbreviations))
+
+    def __len__(self):
+        return len(self.zip_codes)
+
+    def resolve(self, nation, states):
+        """Return a dictionary mapping each ZIP code to (city, State), or to (city, nation) outside any state."""
+        # A few ZIP codes in the Geonames data are associated with the US armed forces, or with territories that are
+        # not covered by the Census Bureau. For the sake of completeness we will associate these ZIP codes with the
+        # United States itself, but they shouldn't come up, since we are only making Places out of ZIP codes that
+        # have polygons in the Census Bureau data.
+        #
+        # 34034 (APO, Dillon, Armed Forces Americas)
+        # 96373 (FPO, Adams, Armed Forces Pacific)
+        # 96337 (APO, Harford, Armed Forces Pacific)
+        # 96507 (DPO, Brazoria, Armed Forces Pacific)
+        # 96208 (APO, Fulton, Armed Forces Pacific)
+        # 96941 (Pohnpei, Federated States of Micronesia)
+        # 96942 (Chuuk, Federated States of Micronesia)
+        # 96943 (Yap, Federated States of Micronesia)
+        # 96944 (Kosrae, Federated States of Micronesia)
+        # 96960 (Majuro, Marshall Islands)
+        # 96970 (Ebeye, Marshall Islands)
+        # 96940 (Koror, Palau)
+        parents = {
+            abbreviation: states.by_abbreviation.get(abbreviation, nation) for abbreviation in set(self.abbreviations)
+        }
+        return dict(zip(self.zip_codes, zip(self.cities, map(parents.__getitem__, self.abbreviations))))
+
+    def write(self, path):
+        abbreviations = sorted(set(self.abbreviations))
+        codes = {abbreviation: i for i, abbreviation in enumerate(abbreviations)}
+        encoded = [abbreviation.encode("utf-8") for abbreviation in abbreviations]
+        if any(len(abbreviation) > ABBREVIATION_SIZE for abbreviation in encoded):
+            raise ValueError("A state abbreviation is too long to save")
+        zip_codes = [zip_code.encode("utf-8") for zip_code in self.zip_codes]
+        width = max(map(len, zip_codes), default=1)
+        zip_codes = [zip_code.ljust(width, b"\0") for zip_code in zip_codes]
+        order = sorted(range(len(zip_codes)), key=zip_codes.__getitem__)
+        cities = [self.cities[i].encode("utf-8") for i in order]
+        city_blob = b"".join(cities)
+
+        sections = [array("H", (codes[self.abbreviations[i]] for i in order)), _ends(cities)]
+        if sys.byteorder != "little":
+            for section in sections:
+                section.byteswap()
+        with open(path, "wb") as stream:
+            stream.write(HEADER.pack(MAGIC, len(self), len(abbreviations), width, len(city_blob)))
+            stream.write(b"".join(abbreviation.ljust(ABBREVIATION_SIZE, b"\0") for abbreviation in encoded))
+            for section in sections:
+                stream.write(_padded(section.tobytes()))
+            stream.write(_padded(b"".join(map(zip_codes.__getitem__, order))))
+            stream.write(city_blob)
+
+
+class MappedGeonamesTable:
+    """
+    A table saved by `GeonamesTable.write()`, memory-mapped. A ZIP code's city and abbreviation are only read from
+    the mapping when it is looked up, so opening the table costs little however many ZIP codes it holds.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            self.data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, abbreviation_count, width, city_size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.data.close()
+            raise ValueError(f"{path} is not a Geonames table")
+        position = HEADER.size
+        self.abbreviations = [
+            self.data[position + i * ABBREVIATION_SIZE:position + (i + 1) * ABBREVIATION_SIZE].rstrip(b"\0").decode()
+            for i in range(abbreviation_count)
+        ]
+        position += abbreviation_count * ABBREVIATION_SIZE
+        self.states = position
+        position += count * STATE.size
+        position += -position % 8
+        self.city_ends = position
+        position += count * CITY_END.size
+        position += -position % 8
+        self.count = count
+        self.zip_width = width
+        self.zip_codes = position
+        # The first ZIP code of each block, to binary search for the block that could hold a ZIP code.
+        self.block_firsts = [
+            self.data[position + i * width:position + (i + 1) * width] for i in range(0, count, BLOCK_SIZE)
+        ]
+        position += count * width
+        position += -position % 8
+        self.cities = position
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def find(self, zip_code):
+        """The position of a ZIP code in the table, or None if it is not there."""
+        key = zip_code.encode("utf-8")
+        width = self.zip_width
+        if len(key) > width:
+            return None
+        key = key.ljust(width, b"\0")
+        block = bisect_right(self.block_firsts, key) - 1
+        if block < 0:
+            return None
+        start = self.zip_codes + block * BLOCK_SIZE * width
+        end = min(start + BLOCK_SIZE * width, self.zip_codes + self.count * width)
+        position = self.data.find(key, start, end)
+        # A match that straddles two ZIP codes is not a match.
+        while position != -1 and (position - self.zip_codes) % width:
+            position = self.data.find(key, position + 1, end)
+        return None if position == -1 else (position - self.zip_codes) // width
+
+    def zip_code(self, i):
+        start = self.zip_codes + i * self.zip_width
+        return self.data[start:start + self.zip_width].rstrip(b"\0").decode("utf-8")
+
+    def city(self, i):
+        start = CITY_END.unpack_from(self.data, self.city_ends + (i - 1) * CITY_END.size)[0] if i else 0
+        end = CITY_END.unpack_from(self.data, self.city_ends + i * CITY_END.size)[0]
+        return self.data[self.cities + start:self.cities + end].decode("utf-8")
+
+    def state(self, i):
+        """The index in `abbreviations` of the abbreviation of the ZIP code at position `i`."""
+        return STATE.unpack_from(self.data, self.states + i * STATE.size)[0]
+
+    def resolve(self, nation, states):
+        """
+        Return a mapping from each ZIP code to (city, State), or to (city, nation) outside any state, that reads each
+        ZIP code from the table when it is looked up.
+        """
+        return ResolvedZipCodes(self, [states.by_abbreviation.get(abbreviation, nation)
+                                       for abbreviation in self.abbreviations])
+
+
+class ResolvedZipCodes(Mapping):
+    """The mapping returned by `MappedGeonamesTable.resolve()`."""
+
+    def __init__(self, table, parents):
+        self.table = table
+        self.parents = parents
+
+    def __getitem__(self, zip_code):
+        i = self.table.find(zip_code)
+        if i is None:
+            raise KeyError(zip_code)
+        return self.table.city(i), self.parents[self.table.state(i)]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return map(self.table.zip_code, range(len(self.table)))
@@ -0,0 +1,193 @@
+"""Wall time, throughput, output size and memory figures for each stage of the consolidation pipeline."""
+
+import cProfile
+import json
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def peak_rss():
+    """The peak resident set size so far, in bytes, of this process and of the largest of its finished children."""
+    # Linux reports ru_maxrss in kilobytes.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return own, children
+
+
+class CountingStream:
+    """
+    Passes writes through to a binary stream, counting the bytes and places written and the time spent writing.
+
+    Places are counted as pairs of lines, unless the stream counts the records written to it itself, as a stream
+    that takes binary geometries apart must.
+    """
+
+    def __init__(self, stream, stage):
+        self.stream = stream
+        self.stage = stage
+        self.bytes = 0
+        self.lines = 0
+        self.records = getattr(stream, "records", None)
+
+    @property
+    def places(self):
+        if self.records is not None:
+            return self.stream.records - self.records
+        return self.lines // 2
+
+    def write(self, chunk):
+        start = time.perf_counter()
+        self.stream.write(chunk)
+        self.stage.add("write", time.perf_counter() - start)
+        self.bytes += len(chunk)
+        if self.records is None:
+            self.lines += chunk.count(b"\n")
+
+
+class Stage:
+    """
+    The figures for one stage, and for each of its input files when it has several. The input paths are only looked
+    at once the stage is over, so they may be given as an iterable that produces them as they become available.
+    """
+
+    def __init__(self, name, inputs):
+        self.name = name
+        self.inputs = inputs
+        self._bytes_in = None
+        self.timers = defaultdict(float)
+        # The stages of the pipeline add to the timers from threads of their own.
+        self.lock = threading.Lock()
+        self.files = []
+        self.cached = None
+        self.out = None
+        self.seconds = None
+        self.peak_rss = None
+        self.traced_peak = None
+
+    @property
+    def bytes_in(self):
+        if self._bytes_in is None:
+            self._bytes_in = sum(path.stat().st_size for path in map(Path, self.inputs) if path.exists())
+        return self._bytes_in
+
+    def counting(self, stream):
+        """Wrap the stream the stage writes its output to, so its output can be measured."""
+        self.out = CountingStream(stream, self)
+        return self.out
+
+    def add(self, timer, seconds):
+        with self.lock:
+            self.timers[timer] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def file(self, filename, seconds, bytes_out, places, cached):
+        path = Path(filename)
+        self.files.append({
+            "file": path.name,
+            "seconds": round(seconds, 6),
+            "places": places,
+            "places_per_second": round(places / seconds, 1) if seconds else None,
+            "bytes_in": path.stat().st_size if path.exists() else None,
+            "bytes_out": bytes_out,
+            "cached": cached,
+        })
+
+    @property
+    def summary(self):
+        places = self.out.places if self.out else 0
+        summary = {
+            "stage": self.name,
+            "seconds": round(self.seconds, 6),
+            "places": places,
+            "places_per_second": round(places / self.seconds, 1) if self.seconds else None,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.out.bytes if self.out else 0,
+            "peak_rss_bytes": self.peak_rss[0],
+            "peak_child_rss_bytes": self.peak_rss[1],
+            "timers": {name: round(seconds, 6) for name, seconds in self.timers.items()},
+        }
+        if self.cached is not None:
+            summary["cached"] = self.cached
+        if self.traced_peak is not None:
+            summary["traced_peak_bytes"] = self.traced_peak
+        if self.files:
+            summary["files"] = self.files
+        return summary
+
+
+class Instrumentation:
+    """
+    Measures each stage run inside `stage()`. Optionally profiles each stage with cProfile, writing STAGE.prof to
+    `profile_dir`, and traces the peak memory Python allocates during each stage with tracemalloc.
+    """
+
+    def __init__(self, profile_dir=None, trace_memory=False):
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, inputs=()):
+        stage = Stage(name, inputs)
+        profiler = cProfile.Profile() if self.profile_dir else None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+            stage.seconds = time.perf_counter() - start
+            stage.peak_rss = peak_rss()
+            if self.trace_memory:
+                stage.traced_peak = tracemalloc.get_traced_memory()[1]
+            if profiler:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(self.profile_dir / f"{name}.prof")
+            self.stages.append(stage)
+
+    @property
+    def report(self):
+        stages = [stage.summary for stage in self.stages]
+        seconds = time.perf_counter() - self.start
+        own, children = peak_rss()
+        places = sum(stage["places"] for stage in stages)
+        return {
+            "stages": stages,
+            "total": {
+                "seconds": round(seconds, 6),
+                "places": places,
+                "places_per_second": round(places / seconds, 1) if seconds else None,
+                "bytes_in": sum(stage["bytes_in"] for stage in stages),
+                "bytes_out": sum(stage["bytes_out"] for stage in stages),
+                "peak_rss_bytes": own,
+                "peak_child_rss_bytes": children,
+            },
+        }
+
+    def write_report(self, destination):
+        """Write the report as JSON to a file, or to stderr if the destination is "-"."""
+        report = json.dumps(self.report, indent=1)
+        if str(destination) == "-":
+            print(report, file=sys.stderr)
+        else:
+            Path(destination).write_text(report + "\n")
@@ -0,0 +1,78 @@
+"""
+Runs the stages of consolidating a section, reading and parsing, shaping and serializing, in threads of their own,
+connected by bounded queues.
+
+Each queue holds at most a few places, so a section streams through the pipeline one place at a time, and memory
+use is set by the largest place rather than the largest file. While one thread waits on a read or a write, the
+others can parse and serialize.
+"""
+
+import queue
+import threading
+
+# The number of items each stage may run ahead of the next.
+PIPELINE_DEPTH = 32
+# Items pass between threads in batches of up to this many, so that handing them over costs little per item.
+BATCH_SIZE = 8
+
+_DONE = object()
+
+
+class _Failure:
+    """Carries an exception raised in a stage's thread to the thread consuming its items."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def threaded(iterable, depth=PIPELINE_DEPTH, name=None):
+    """
+    Yield the items of `iterable`, produced in a thread of their own that runs at most about `depth` items ahead. An
+    exception raised while producing an item is raised here in its place. If the consumer stops early, the thread
+    stops before producing another item.
+    """
+    batch_size = min(depth, BATCH_SIZE)
+    batches = queue.Queue(max(1, depth // batch_size))
+    stopping = threading.Event()
+    iterator = iter(iterable)
+
+    def produce():
+        batch = []
+        try:
+            for item in iterator:
+                if stopping.is_set():
+                    return
+                batch.append(item)
+                if len(batch) == batch_size:
+                    batches.put(batch)
+                    batch = []
+        except BaseException as exception:
+            batches.put(batch)
+            batches.put(_Failure(exception))
+        else:
+            batches.put(batch)
+            batches.put(_DONE)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                return
+            if isinstance(batch, _Failure):
+                raise batch.exception
+            yield from batch
+    finally:
+        stopping.set()
+        # Make room in the queue for as long as the thread runs, in case it is waiting to put an item.
+        while thread.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
@@ -0,0 +1,168 @@
+"""
+A compact, columnar in-memory catalog of places.
+
+A `Place` is a Python object with a handful of attributes, a set of aliases and a GeoJSON geometry built out of
+nested lists of floats, which costs far more than the data it holds. `PlaceCatalog` keeps the same data in a few
+flat arrays instead: one type code and one parent index per place, the strings in UTF-8 blobs with an array of
+offsets into each, and every geometry as WKB in one buffer with an array of offsets into it. Records, names and
+geometries are only turned back into Python objects when asked for.
+
+    catalog = PlaceCatalog.from_output("us-places.ndjson")
+    place = catalog.record(catalog.index("city", "3651000"))
+    geometry = catalog.geometry(place.index)
+"""
+
+import json
+from array import array
+from collections import namedtuple
+
+from geometry import PLACE_TYPES
+from geometry_container import encode_wkb, wkb_geometry, wkb_polygons
+
+TYPE_CODES = {place_type: code for code, place_type in enumerate(PLACE_TYPES)}
+
+PlaceRecord = namedtuple("PlaceRecord", "index type id name abbreviated_name aliases parent")
+
+
+class StringColumn:
+    """A column of strings, stored as one UTF-8 blob and the offset at which each string ends. None is stored as ""."""
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.ends = array("Q")
+
+    def append(self, value):
+        self.blob += (value or "").encode("utf-8")
+        self.ends.append(len(self.blob))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        start = self.ends[i - 1] if i else 0
+        return self.blob[start:self.ends[i]].decode("utf-8") or None
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + self.ends.itemsize * len(self.ends)
+
+
+class PlaceCatalog:
+    """
+    Every place's type, ID, names, aliases, parent and geometry, in place order. A place's parent is referred to by
+    its index, and must come before it.
+    """
+
+    def __init__(self):
+        self.types = array("B")
+        self.parents = array("i")
+        self.ids = StringColumn()
+        self.names = StringColumn()
+        self.abbreviated_names = StringColumn()
+        self.aliases = StringColumn()
+        self.alias_ends = array("I")
+        self.geometries = bytearray()
+        self.geometry_ends = array("Q")
+        self._index = None
+
+    @classmethod
+    def from_places(cls, places):
+        """Build a catalog from `Place` objects, each of which must come after its parent."""
+        catalog = cls()
+        indexes = {}
+        for place in places:
+            parent = -1
+            if place.parent is not None:
+                parent = indexes.get(id(place.parent))
+                if parent is None:
+                    raise ValueError(f"{place.type} {place.id} comes before its parent")
+            indexes[id(place)] = len(catalog)
+            catalog.add(place.type, place.id, place.name, place.abbreviated_name, sorted(place.aliases), parent,
+                        place.geography)
+        return catalog
+
+    @classmethod
+    def from_output(cls, path):
+        """
+        Build a catalog from consolidated output with GeoJSON geometries. Nations and states are the only places
+        other places name as their parent, so only their IDs are remembered to resolve parents by.
+        """
+        catalog = cls()
+        parents = {}
+        with open(path, "rb") as stream:
+            for metadata in stream:
+                metadata = json.loads(metadata)
+                geometry = json.loads(next(stream))
+                parent = -1
+                if metadata["parent_id"] is not None:
+                    parent = parents.get(metadata["parent_id"])
+                    if parent is None:
+                        raise ValueError(f"{metadata['type']} {metadata['id']} comes before its parent")
+                if metadata["type"] in ("nation", "state"):
+                    parents[metadata["id"]] = len(catalog)
+                aliases = [alias["name"] for alias in metadata.get("aliases", ())]
+                catalog.add(metadata["type"], metadata["id"], metadata["name"], metadata.get("abbreviated_name"),
+                            aliases, parent, geometry)
+        return catalog
+
+    def add(self, place_type, place_id, name, abbreviated_name, aliases, parent, geometry):
+        self.types.append(TYPE_CODES[place_type])
+        self.parents.append(parent)
+        self.ids.append(place_id)
+        self.names.append(name)
+        self.abbreviated_names.append(abbreviated_name)
+        for alias in aliases:
+            self.aliases.append(alias)
+        self.alias_ends.append(len(self.aliases))
+        self.geometries += encode_wkb(geometry)[0]
+        self.geometry_ends.append(len(self.geometries))
+        self._index = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def record(self, i):
+        start = self.alias_ends[i - 1] if i else 0
+        parent = self.parents[i]
+        return PlaceRecord(
+            index=i,
+            type=PLACE_TYPES[self.types[i]],
+            id=self.ids[i],
+            name=self.names[i],
+            abbreviated_name=self.abbreviated_names[i],
+            aliases=[self.aliases[j] for j in range(start, self.alias_ends[i])],
+            parent=parent if parent >= 0 else None,
+        )
+
+    def __iter__(self):
+        return map(self.record, range(len(self)))
+
+    def wkb(self, i):
+        """
+        The WKB of a place's geometry, as a memoryview into the catalog's buffer. No place can be added to the
+        catalog until the memoryview is released.
+        """
+        start = self.geometry_ends[i - 1] if i else 0
+        return memoryview(self.geometries)[start:self.geometry_ends[i]]
+
+    def polygons(self, i):
+        """Return a place's polygons, each as a list of its rings' coordinates as memoryviews of x, y doubles."""
+        return wkb_polygons(self.wkb(i))
+
+    def geometry(self, i):
+        """Decode a place's geometry into a GeoJSON Polygon or MultiPolygon."""
+        return wkb_geometry(self.wkb(i))
+
+    def index(self, place_type, place_id):
+        """The index of a place, by its type and ID. Raises KeyError if there is no such place."""
+        if self._index is None:
+            self._index = {(self.types[i], self.ids[i]): i for i in range(len(self))}
+        return self._index[TYPE_CODES[place_type], place_id]
+
+    @property
+    def nbytes(self):
+        """The size of the catalog's arrays and buffers, not counting the index by type and ID."""
+        columns = (self.ids, self.names, self.abbreviated_names, self.aliases)
+        arrays = (self.types, self.parents, self.alias_ends, self.geometry_ends)
+        return (sum(column.nbytes for column in columns) + sum(a.itemsize * len(a) for a in arrays)
+                + len(self.geometries))
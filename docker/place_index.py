@@ -0,0 +1,143 @@
+"""
+A sidecar index over the consolidated output, giving random access to any place's two lines by its type and ID.
+
+The index is an open-addressing hash table stored as fixed-width slots, so that `PlaceReader` can memory-map both
+it and the output and find a place with a single probe sequence, without loading or parsing either file.
+"""
+
+import json
+import mmap
+import struct
+import zlib
+
+from geometry import PLACE_TYPES
+
+MAGIC = b"PLACEIDX"
+HEADER = struct.Struct("<8sQQ")
+# Slot: key (type code and ID, NUL-padded), offset of the metadata line, metadata length, geometry length.
+SLOT = struct.Struct("<16sQII")
+KEY_SIZE = 16
+
+TYPE_CODES = {"nation": b"N", "state": b"S", "county": b"C", "city": b"P", "postal_code": b"Z"}
+
+INDEX_SUFFIX = ".idx"
+
+
+def index_key(place_type, place_id):
+    key = TYPE_CODES[place_type] + place_id.encode("utf-8")
+    if len(key) > KEY_SIZE:
+        raise ValueError(f"Place ID {place_id!r} is too long to index")
+    return key.ljust(KEY_SIZE, b"\0")
+
+
+class PlaceIndexBuilder:
+    """Collects the location of each place as the output is written, then writes the index."""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, place_type, place_id, offset, metadata_length, geometry_length):
+        self.entries.append((index_key(place_type, place_id), offset, metadata_length, geometry_length))
+
+    def write(self, path):
+        # Keep the table at most half full so that probe sequences stay short.
+        slot_count = 1
+        while slot_count < 2 * len(self.entries):
+            slot_count *= 2
+
+        table = bytearray(HEADER.size + slot_count * SLOT.size)
+        HEADER.pack_into(table, 0, MAGIC, slot_count, len(self.entries))
+        for key, offset, metadata_length, geometry_length in self.entries:
+            slot = zlib.crc32(key) & (slot_count - 1)
+            while True:
+                position = HEADER.size + slot * SLOT.size
+                existing = table[position:position + KEY_SIZE]
+                if not any(existing):
+                    break
+                if existing == key:
+                    name = key.rstrip(b"\0").decode("utf-8")
+                    raise ValueError(f"Place {name!r} appears more than once")
+                slot = (slot + 1) & (slot_count - 1)
+            SLOT.pack_into(table, position, key, offset, metadata_length, geometry_length)
+
+        with open(path, "wb") as stream:
+            stream.write(table)
+
+
+class PlaceReader:
+    """
+    Random access to the places in an output file through its index.
+
+        with PlaceReader("us-places.ndjson") as places:
+            places.metadata("36061", "county")
+            places.geometry("10001", "postal_code")
+
+    County GEOIDs and ZIP codes can coincide, so pass the place type when the ID alone is ambiguous; otherwise the
+    first place type, in hierarchy order, with a place of that ID is used.
+    """
+
+    def __init__(self, output_path, index_path=None):
+        index_path = index_path or str(output_path) + INDEX_SUFFIX
+        with open(output_path, "rb") as stream:
+            self.output = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(index_path, "rb") as stream:
+            self.index = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.count = HEADER.unpack_from(self.index, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path} is not a place index")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.output.close()
+        self.index.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, place_id):
+        return self.locate(place_id) is not None
+
+    def _probe(self, key):
+        slot = zlib.crc32(key) & (self.slot_count - 1)
+        while True:
+            position = HEADER.size + slot * SLOT.size
+            slot_key, offset, metadata_length, geometry_length = SLOT.unpack_from(self.index, position)
+            if slot_key == key:
+                return offset, metadata_length, geometry_length
+            if not any(slot_key):
+                return None
+            slot = (slot + 1) & (self.slot_count - 1)
+
+    def locate(self, place_id, place_type=None):
+        """Return (offset, metadata length, geometry length) for a place, or None if it is not in the index."""
+        for candidate in [place_type] if place_type else PLACE_TYPES:
+            location = self._probe(index_key(candidate, place_id))
+            if location is not None:
+                return location
+        return None
+
+    def _location(self, place_id, place_type):
+        location = self.locate(place_id, place_type)
+        if location is None:
+            raise KeyError(place_id)
+        return location
+
+    def metadata_bytes(self, place_id, place_type=None):
+        offset, metadata_length, _ = self._location(place_id, place_type)
+        return self.output[offset:offset + metadata_length]
+
+    def geometry_bytes(self, place_id, place_type=None):
+        offset, metadata_length, geometry_length = self._location(place_id, place_type)
+        start = offset + metadata_length + 1
+        return self.output[start:start + geometry_length]
+
+    def metadata(self, place_id, place_type=None):
+        return json.loads(self.metadata_bytes(place_id, place_type))
+
+    def geometry(self, place_id, place_type=None):
+        return json.loads(self.geometry_bytes(place_id, place_type))
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Name autocompletion and ID lookups over the consolidated places, served from a sidecar index that loads in
+milliseconds.
+
+Loading the whole output to look places up by name takes minutes and gigabytes, nearly all of it geometry that
+most lookups never touch. `PlaceSearch` instead memory-maps the output and a search index built from the places'
+metadata, and reads a place's metadata or geometry line from its byte offsets only when it is asked for.
+
+Each place's name and aliases are folded to lower-case ASCII words and indexed as keys twice: once on their own, and
+once behind the ID of the state that is the place's parent, so that a search can keep to one state. The keys are
+sorted, which makes them a trie flattened in order: the keys below any prefix are one contiguous run, found by
+binary search. The short prefixes, which have thousands of keys below them, also keep their best places, so no
+search ranks more than SCAN_LIMIT keys. Places rank by type, from the nation down to ZIP codes, then by whether
+they matched on their name rather than an alias, then by the length of what they matched; places named exactly what
+was typed come first of all.
+
+The index saves to a single file, which loads by memory-mapping it:
+
+    header      MAGIC, then the length of a JSON description
+    description the size of the output, the state IDs by abbreviation, and where each array is
+    arrays      each place's offset and line lengths; the keys, sorted, with each one's place and rank; the
+                prefixes that keep their best places, sorted, with those places; and the places' types and IDs,
+                sorted, with each one's place
+
+    python3 place_search.py build us-places.ndjson
+    python3 place_search.py complete us-places.ndjson "new yo" --state NY
+    python3 place_search.py serve us-places.ndjson --port 8000
+
+The server answers GET /complete?q=new+yo&state=NY&limit=10 with a JSON array of the matching places' metadata, and
+GET /places/TYPE/ID and GET /places/TYPE/ID/geometry with a place's metadata or geometry, straight from the output.
+"""
+
+import argparse
+import json
+import mmap
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from aliases import ascii_alias
+from geometry import PLACE_TYPES
+from place_index import KEY_SIZE, index_key
+from spatial import json_loads
+from writers import RecordWriter
+
+MAGIC = b"PLACESRC"
+HEADER = struct.Struct("<8sQ")
+ARRAYS = (
+    ("offsets", "Q"), ("metadata_lengths", "I"), ("geometry_lengths", "I"),
+    ("keys", "B"), ("key_ends", "Q"), ("key_places", "I"), ("key_ranks", "I"),
+    ("prefixes", "B"), ("prefix_ends", "Q"), ("prefix_places", "I"),
+    ("ids", "B"), ("id_places", "I"),
+)
+
+SEARCH_SUFFIX = ".search"
+
+# Prefixes with more keys than this below them keep their best TOP_MATCHES places.
+SCAN_LIMIT = 256
+TOP_MATCHES = 16
+DEFAULT_LIMIT = 10
+# The most places the server returns for one query.
+MAX_LIMIT = 100
+
+# Separates the ID of the state a key is indexed under from the name; keys for every state have no ID before it.
+SCOPE_SEPARATOR = b"\0"
+# Pads a prefix's best places. UTF-8 never uses the byte 0xFF, so it also sorts after every key with a prefix.
+NO_PLACE = 0xFFFFFFFF
+AFTER_PREFIX = b"\xff"
+
+_DROPPED = str.maketrans("", "", "'’")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """
+    Fold a name, or what has been typed of one, to lower-case ASCII words separated by single spaces. Apostrophes
+    are dropped, so that "O'Fallon" and "OFallon" are the same; a trailing separator is kept as a space, so that
+    "new " does not match "Newark".
+    """
+    text = (ascii_alias(text) or text).translate(_DROPPED).casefold()
+    return _SEPARATORS.sub(" ", text).lstrip(" ")
+
+
+def _distinct(ranked, count):
+    """The first `count` distinct places of (rank, place) pairs sorted by rank, each with its best rank."""
+    seen = set()
+    distinct = []
+    for rank, place in ranked:
+        if place not in seen:
+            seen.add(place)
+            distinct.append((rank, place))
+            if len(distinct) == count:
+                break
+    return distinct
+
+
+def _prefix_places(keys, places, ranks):
+    """
+    Every prefix of the sorted `keys` with more than SCAN_LIMIT keys below it, with its best TOP_MATCHES places, as
+    sorted (prefix, places) pairs. A prefix's best places are the best of its children's, and of the keys that are
+    the prefix itself, so each key is ranked once, in the short run of keys where it stops sharing a prefix with
+    too many others.
+    """
+    found = []
+
+    def best(start, stop, depth):
+        # keys[start:stop] all share their first `depth` bytes.
+        if stop - start <= SCAN_LIMIT:
+            return _distinct(sorted(zip(ranks[start:stop], places[start:stop])), TOP_MATCHES)
+        candidates = []
+        position = start
+        while position < stop and len(keys[position]) == depth:
+            candidates.append((ranks[position], places[position]))
+            position += 1
+        while position < stop:
+            end = bisect_left(keys, keys[position][:depth + 1] + AFTER_PREFIX, position, stop)
+            candidates += best(position, end, depth + 1)
+            position = end
+        top = _distinct(sorted(candidates), TOP_MATCHES)
+        found.append((keys[start][:depth], [place for _, place in top]))
+        return top
+
+    best(0, len(keys), 0)
+    return sorted(found)
+
+
+class SearchIndexBuilder:
+    """Collects the location, names and aliases of each place as the output is written, then writes the index."""
+
+    def __init__(self):
+        self.offsets = array("Q")
+        self.metadata_lengths = array("I")
+        self.geometry_lengths = array("I")
+        # (key, (type, alias or not, length, key, place), place) for each key.
+        self.keys = []
+        self.ids = []
+        self.states = {}
+        self.state_ids = set()
+        self.size = 0
+
+    def add(self, place, offset, metadata_length, geometry_length):
+        i = len(self.offsets)
+        self.offsets.append(offset)
+        self.metadata_lengths.append(metadata_length)
+        self.geometry_lengths.append(geometry_length)
+        self.size = max(self.size, offset + metadata_length + geometry_length + 2)
+        self.ids.append((index_key(place["type"], place["id"]), i))
+        if place["type"] == "state":
+            self.state_ids.add(place["id"])
+            if place.get("abbreviated_name"):
+                self.states[place["abbreviated_name"].upper()] = place["id"]
+
+        names = {}
+        for position, text in enumerate([place["name"]] + [alias["name"] for alias in place.get("aliases", ())]):
+            key = normalize(text or "").rstrip(" ").encode("utf-8")
+            if key and key not in names:
+                names[key] = min(position, 1)
+        scopes = [b""]
+        if place.get("parent_id") in self.state_ids:
+            scopes.append(place["parent_id"].encode("utf-8"))
+        type_rank = PLACE_TYPES.index(place["type"])
+        for key, alias in names.items():
+            rank = (type_rank, alias, len(key), key, i)
+            for scope in scopes:
+                self.keys.append((scope + SCOPE_SEPARATOR + key, rank, i))
+
+    def arrays(self):
+        """The index's arrays, by name."""
+        by_rank = sorted(range(len(self.keys)), key=lambda entry: self.keys[entry][1])
+        ranks = [0] * len(self.keys)
+        for rank, entry in enumerate(by_rank):
+            ranks[entry] = rank
+        order = sorted(range(len(self.keys)), key=lambda entry: (self.keys[entry][0], ranks[entry]))
+        keys = [self.keys[entry][0] for entry in order]
+        key_places = array("I", (self.keys[entry][2] for entry in order))
+        key_ranks = array("I", (ranks[entry] for entry in order))
+
+        prefixes = _prefix_places(keys, key_places, key_ranks)
+        prefix_places = array("I")
+        for _, places in prefixes:
+            prefix_places.extend(places + [NO_PLACE] * (TOP_MATCHES - len(places)))
+        ids = sorted(self.ids)
+        return {
+            "offsets": self.offsets,
+            "metadata_lengths": self.metadata_lengths,
+            "geometry_lengths": self.geometry_lengths,
+            "keys": b"".join(keys),
+            "key_ends": array("Q", _ends(keys)),
+            "key_places": key_places,
+            "key_ranks": key_ranks,
+            "prefixes": b"".join(prefix for prefix, _ in prefixes),
+            "prefix_ends": array("Q", _ends(prefix for prefix, _ in prefixes)),
+            "prefix_places": prefix_places,
+            "ids": b"".join(key for key, _ in ids),
+            "id_places": array("I", (place for _, place in ids)),
+        }
+
+    def write(self, path):
+        """Write the index: a JSON description, then every array, 8-byte aligned."""
+        blobs = []
+        offset = 0
+        described = {}
+        for name, values in self.arrays().items():
+            if isinstance(values, array) and sys.byteorder != "little":
+                values = array(values.typecode, values)
+                values.byteswap()
+            data = bytes(values)
+            described[name] = [offset, len(data)]
+            blobs.append(data + b"\0" * (-len(data) % 8))
+            offset += len(blobs[-1])
+
+        header = json.dumps({"output_bytes": self.size, "states": self.states, "arrays": described}).encode("utf-8")
+        header += b" " * (-(HEADER.size + len(header)) % 8)
+        with open(path, "wb") as stream:
+            stream.write(HEADER.pack(MAGIC, len(header)))
+            stream.write(header)
+            for blob in blobs:
+                stream.write(blob)
+
+
+def _ends(blobs):
+    end = 0
+    for blob in blobs:
+        end += len(blob)
+        yield end
+
+
+class SearchIndexWriter(RecordWriter):
+    """Passes the output through to a binary stream, writing a search index of its places to `index_path`."""
+
+    def __init__(self, stream, index_path):
+        super().__init__()
+        self.stream = stream
+        self.index_path = index_path
+        self.builder = SearchIndexBuilder()
+        self.offset = 0
+
+    def write_record(self, metadata, geometry, place=None):
+        place = self.parsed(metadata, place)
+        self.builder.add(place, self.offset, len(metadata), len(geometry))
+        self.pass_record(self.stream, metadata, geometry, place)
+        self.offset += len(metadata) + len(geometry) + 2
+
+    def close(self):
+        super().close()
+        self.stream.close()
+        self.builder.write(self.index_path)
+
+
+def build(output_path, index_path=None):
+    """Write the search index of an uncompressed consolidated output file."""
+    builder = SearchIndexBuilder()
+    offset = 0
+    with open(output_path, "rb") as stream:
+        for metadata in stream:
+            geometry = next(stream)
+            builder.add(json_loads(metadata), offset, len(metadata) - 1, len(geometry) - 1)
+            offset += len(metadata) + len(geometry)
+    builder.write(index_path or str(output_path) + SEARCH_SUFFIX)
+
+
+class PlaceSearch:
+    """
+    Autocompletion and ID lookups over an output file, through its search index.
+
+        with PlaceSearch("us-places.ndjson") as places:
+            places.complete("spring", state="IL")
+            places.geometry(places.find("10001", "postal_code"))
+
+    Places are referred to by their position in the output.
+    """
+
+    def __init__(self, output_path, index_path=None):
+        index_path = index_path or str(output_path) + SEARCH_SUFFIX
+        with open(output_path, "rb") as stream:
+            self.output = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(index_path, "rb") as stream:
+            self.index = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER.unpack_from(self.index, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path} is not a search index")
+        if sys.byteorder != "little":
+            raise ValueError("Search indexes can only be memory-mapped on little-endian machines")
+        description = json.loads(self.index[HEADER.size:HEADER.size + header_length])
+        if description["output_bytes"] != len(self.output):
+            raise ValueError(f"{index_path} was not built from {output_path}")
+        self.states = description["states"]
+
+        base = HEADER.size + header_length
+        view = memoryview(self.index)
+        # Blobs are sliced from the mapping itself, which gives bytes that compare; arrays are cast memoryviews.
+        self.blobs = {}
+        self.arrays = {}
+        for name, typecode in ARRAYS:
+            offset, length = description["arrays"][name]
+            if typecode == "B":
+                self.blobs[name] = base + offset
+            else:
+                self.arrays[name] = view[base + offset:base + offset + length].cast(typecode)
+        view.release()
+        self.offsets = self.arrays["offsets"]
+        self.key_ends = self.arrays["key_ends"]
+        self.prefix_ends = self.arrays["prefix_ends"]
+        self.id_count = len(self.arrays["id_places"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for values in self.arrays.values():
+            values.release()
+        self.arrays = self.offsets = self.key_ends = self.prefix_ends = None
+        self.output.close()
+        self.index.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _key(self, i):
+        start = self.key_ends[i - 1] if i else 0
+        base = self.blobs["keys"]
+        return self.index[base + start:base + self.key_ends[i]]
+
+    def _prefix(self, i):
+        start = self.prefix_ends[i - 1] if i else 0
+        base = self.blobs["prefixes"]
+        return self.index[base + start:base + self.prefix_ends[i]]
+
+    def _id(self, i):
+        base = self.blobs["ids"] + i * KEY_SIZE
+        return self.index[base:base + KEY_SIZE]
+
+    def _first_at_least(self, read, count, value):
+        """The first of `count` sorted values, read by position with `read`, that is `value` or more."""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if read(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def matches(self, text, state=None, limit=DEFAULT_LIMIT):
+        """
+        The best `limit` places whose name or an alias starts with `text`, keeping to the places in one state, by
+        ID or abbreviation, if `state` is given.
+        """
+        typed = normalize(text)
+        if not typed or limit <= 0:
+            return []
+        scope = b""
+        if state:
+            scope = self.states.get(state.upper(), state).encode("utf-8")
+        prefix = scope + SCOPE_SEPARATOR + typed.encode("utf-8")
+        start = self._first_at_least(self._key, len(self.key_ends), prefix)
+        stop = self._first_at_least(self._key, len(self.key_ends), prefix + AFTER_PREFIX)
+        key_places, key_ranks = self.arrays["key_places"], self.arrays["key_ranks"]
+
+        # The keys that are exactly what was typed sort first, being the shortest.
+        exact = start
+        while exact < stop and len(self._key(exact)) == len(prefix):
+            exact += 1
+        ranked = sorted(zip(key_ranks[start:exact], key_places[start:exact]))
+        if stop - start > SCAN_LIMIT and limit <= TOP_MATCHES:
+            node = self._first_at_least(self._prefix, len(self.prefix_ends), prefix)
+            if node < len(self.prefix_ends) and self._prefix(node) == prefix:
+                top = self.arrays["prefix_places"][node * TOP_MATCHES:(node + 1) * TOP_MATCHES]
+                # The best places of the prefix are already in rank order, after any exact matches.
+                ranked += [(len(key_ranks), place) for place in top if place != NO_PLACE]
+                return [place for _, place in _distinct(ranked, limit)]
+        ranked += sorted(zip(key_ranks[exact:stop], key_places[exact:stop]))
+        return [place for _, place in _distinct(ranked, limit)]
+
+    def complete(self, text, state=None, limit=DEFAULT_LIMIT):
+        """The metadata of the best `limit` places whose name or an alias starts with `text`; see `matches()`."""
+        return [self.metadata(place) for place in self.matches(text, state, limit)]
+
+    def find(self, place_id, place_type=None):
+        """
+        The position of a place by its ID, or None if there is no such place. As with `place_index.PlaceReader`, the
+        first place type in hierarchy order with a place of that ID is used if no type is given.
+        """
+        for candidate in [place_type] if place_type else PLACE_TYPES:
+            try:
+                key = index_key(candidate, place_id)
+            except ValueError:
+                return None
+            i = self._first_at_least(self._id, self.id_count, key)
+            if i < self.id_count and self._id(i) == key:
+                return self.arrays["id_places"][i]
+        return None
+
+    def metadata_bytes(self, place):
+        offset = self.offsets[place]
+        return self.output[offset:offset + self.arrays["metadata_lengths"][place]]
+
+    def geometry_bytes(self, place):
+        start = self.offsets[place] + self.arrays["metadata_lengths"][place] + 1
+        return self.output[start:start + self.arrays["geometry_lengths"][place]]
+
+    def metadata(self, place):
+        return json_loads(self.metadata_bytes(place))
+
+    def geometry(self, place):
+        return json_loads(self.geometry_bytes(place))
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Answers autocompletion and place lookups from `places`, which `serve()` sets on a subclass."""
+
+    places = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if parts == ["complete"]:
+            query = parse_qs(url.query)
+            try:
+                limit = min(int(query.get("limit", [DEFAULT_LIMIT])[0]), MAX_LIMIT)
+            except ValueError:
+                self.send_error(HTTPStatus.BAD_REQUEST, "limit must be a whole number")
+                return
+            places = self.places.matches(query.get("q", [""])[0], query.get("state", [None])[0], limit)
+            body = b"[" + b",".join(self.places.metadata_bytes(place) for place in places) + b"]"
+        elif parts[:1] == ["places"] and len(parts) in (3, 4) and parts[1] in PLACE_TYPES and parts[3:] in (
+                [], ["geometry"]):
+            place = self.places.find(parts[2], parts[1])
+            if place is None:
+                self.send_error(HTTPStatus.NOT_FOUND, f"There is no {parts[1]} {parts[2]}")
+                return
+            body = self.places.geometry_bytes(place) if parts[3:] else self.places.metadata_bytes(place)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(places, host="127.0.0.1", port=8000):
+    handler = type("Handler", (SearchHandler,), {"places": places})
+    with ThreadingHTTPServer((host, port), handler) as server:
+        server.serve_forever()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build, query or serve the search index of the consolidated places.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    building = commands.add_parser("build", help="build the search index of an uncompressed output file")
+    building.add_argument("output", help="consolidated output file")
+    building.add_argument("--index", help=f"where to write the index (default: OUTPUT{SEARCH_SUFFIX})")
+    completing = commands.add_parser("complete", help="list the places whose names start with some text")
+    completing.add_argument("output", help="output file the index was built from")
+    completing.add_argument("text")
+    completing.add_argument("--state", help="keep to the places in this state, by ID or abbreviation")
+    completing.add_argument("--limit", type=int, default=DEFAULT_LIMIT, metavar="N")
+    completing.add_argument("--index", help=f"the search index (default: OUTPUT{SEARCH_SUFFIX})")
+    serving = commands.add_parser("serve", help="answer autocompletion and place lookups over HTTP")
+    serving.add_argument("output", help="output file the index was built from")
+    serving.add_argument("--host", default="127.0.0.1")
+    serving.add_argument("--port", type=int, default=8000)
+    serving.add_argument("--index", help=f"the search index (default: OUTPUT{SEARCH_SUFFIX})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "build":
+        build(args.output, args.index)
+        return
+    with PlaceSearch(args.output, args.index) as places:
+        if args.command == "complete":
+            for place in places.matches(args.text, args.state, args.limit):
+                print(places.metadata_bytes(place).decode("utf-8"))
+        else:
+            serve(places, args.host, args.port)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
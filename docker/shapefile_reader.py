@@ -0,0 +1,216 @@
+"""
+Reads the features of a Census Bureau shapefile from its .shp and .dbf files, or straight from the zip archive they
+are distributed in, without converting it to GeoJSON first.
+
+Each feature has the properties and geometry `ogr2ogr -f GeoJSON` would have given it. Attributes keep their .dbf
+field order; numbers without decimals become integers, and empty values become None. A polygon's parts are
+organized the way GDAL organizes them: clockwise rings are outer rings, and each counter-clockwise ring is a hole
+in the outer ring that contains it. A shape with a single outer ring becomes a Polygon, and any other shape a
+MultiPolygon. Coordinates are read at full double precision unless a number of decimal places is given to round
+them to.
+"""
+
+import struct
+import zipfile
+from array import array
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+Feature = namedtuple("Feature", ["properties", "geometry"])
+
+SHP_HEADER_SIZE = 100
+# Record header: record number and content length in 16-bit words, both big-endian.
+RECORD_HEADER = struct.Struct(">ii")
+# Polygon content: shape type, bounding box, number of parts, number of points.
+POLYGON_HEADER = struct.Struct("<i4dii")
+
+NULL_SHAPE = 0
+POLYGON = 5
+
+DBF_HEADER = struct.Struct("<B3BIHH20x")
+DBF_FIELD = struct.Struct("<11sc4xBB14x")
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("The shapefile ended partway through a record")
+    return data
+
+
+def _signed_area(coordinates):
+    """Twice the signed area of a closed ring, given as flat x, y doubles: negative if the ring runs clockwise."""
+    xs, ys = coordinates[0::2], coordinates[1::2]
+    return sum(x0 * y1 - x1 * y0 for x0, y0, x1, y1 in zip(xs, ys, xs[1:], ys[1:]))
+
+
+def _contains(coordinates, x, y):
+    """Whether a point lies inside a ring, given as flat x, y doubles, by the even-odd rule."""
+    inside = False
+    for i in range(0, len(coordinates) - 2, 2):
+        x1, y1, x2, y2 = coordinates[i:i + 4]
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _points(coordinates, precision):
+    if precision is None:
+        return [[x, y] for x, y in zip(coordinates[0::2], coordinates[1::2])]
+    return [[round(x, precision), round(y, precision)] for x, y in zip(coordinates[0::2], coordinates[1::2])]
+
+
+def polygon_geometry(content, precision=None):
+    """Convert the content of a polygon record to a GeoJSON Polygon or MultiPolygon, or None for a null shape."""
+    shape_type = struct.unpack_from("<i", content)[0]
+    if shape_type == NULL_SHAPE:
+        return None
+    if shape_type != POLYGON:
+        raise ValueError(f"Cannot read shapes of type {shape_type}; only polygons are supported")
+    _, _, _, _, _, part_count, point_count = POLYGON_HEADER.unpack_from(content)
+    starts = array("i", content[POLYGON_HEADER.size:POLYGON_HEADER.size + 4 * part_count])
+    position = POLYGON_HEADER.size + 4 * part_count
+    coordinates = array("d", content[position:position + 16 * point_count])
+    ends = list(starts[1:]) + [point_count]
+    rings = [coordinates[2 * start:2 * end] for start, end in zip(starts, ends)]
+
+    if len(rings) == 1:
+        return {"type": "Polygon", "coordinates": [_points(rings[0], precision)]}
+
+    outers, holes = [], []
+    for ring in rings:
+        (holes if _signed_area(ring) > 0 else outers).append(ring)
+    if not outers:
+        outers, holes = holes, []
+    polygons = [[outer] for outer in outers]
+    for hole in holes:
+        for polygon in polygons:
+            if _contains(polygon[0], hole[0], hole[1]):
+                polygon.append(hole)
+                break
+        else:
+            # A hole outside every outer ring is an outer ring in its own right.
+            polygons.append([hole])
+
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": [_points(ring, precision) for ring in polygons[0]]}
+    return {
+        "type": "MultiPolygon",
+        "coordinates": [[_points(ring, precision) for ring in polygon] for polygon in polygons],
+    }
+
+
+def _dbf_value(field_type, decimals, raw, encoding):
+    if field_type == b"C":
+        value = raw.rstrip(b" \0")
+        return value.decode(encoding) if value else None
+    value = raw.strip(b" \0")
+    if not value or value.strip(b"*") == b"":
+        return None
+    if field_type in (b"N", b"F"):
+        return float(value) if decimals or field_type == b"F" else int(value)
+    if field_type == b"D":
+        return f"{value[:4].decode()}/{value[4:6].decode()}/{value[6:8].decode()}"
+    return value.decode(encoding)
+
+
+def dbf_records(stream, encoding, start=0, stop=None):
+    """
+    Yield the attributes of records `start` up to `stop` of a .dbf file, each as a dict in field order; deleted
+    records yield None.
+    """
+    _, _, _, _, count, header_size, record_size = DBF_HEADER.unpack(_read_exactly(stream, DBF_HEADER.size))
+    fields = []
+    descriptors = _read_exactly(stream, header_size - DBF_HEADER.size)
+    for position in range(0, len(descriptors) - 1, DBF_FIELD.size):
+        if descriptors[position] == 0x0D:
+            break
+        name, field_type, length, decimals = DBF_FIELD.unpack_from(descriptors, position)
+        fields.append((name.split(b"\0", 1)[0].decode("ascii"), field_type, length, decimals))
+
+    if start:
+        stream.seek(header_size + start * record_size)
+    for _ in range(start, count if stop is None else min(stop, count)):
+        record = _read_exactly(stream, record_size)
+        if record[0:1] == b"*":
+            yield None
+            continue
+        properties = {}
+        position = 1
+        for name, field_type, length, decimals in fields:
+            properties[name] = _dbf_value(field_type, decimals, record[position:position + length], encoding)
+            position += length
+        yield properties
+
+
+def shp_records(stream, precision=None, offset=SHP_HEADER_SIZE):
+    """Yield the geometry of each record in a .shp file, from the record at byte `offset` on."""
+    stream.seek(offset)
+    while True:
+        header = stream.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) != RECORD_HEADER.size:
+            raise ValueError("The shapefile ended partway through a record")
+        _, length = RECORD_HEADER.unpack(header)
+        yield polygon_geometry(_read_exactly(stream, 2 * length), precision)
+
+
+def _record_offset(open_member, shp, record):
+    """Find where a record starts in a .shp file, from the .shx index if there is one."""
+    if not record:
+        return SHP_HEADER_SIZE
+    shx = open_member("shx")
+    if shx is not None:
+        with shx:
+            shx.seek(SHP_HEADER_SIZE + RECORD_HEADER.size * record)
+            return 2 * RECORD_HEADER.unpack(_read_exactly(shx, RECORD_HEADER.size))[0]
+    offset = SHP_HEADER_SIZE
+    for _ in range(record):
+        shp.seek(offset)
+        _, length = RECORD_HEADER.unpack(_read_exactly(shp, RECORD_HEADER.size))
+        offset += RECORD_HEADER.size + 2 * length
+    return offset
+
+
+@contextmanager
+def _members(path):
+    """Yield a function opening the files of a shapefile, whether they are in a zip archive or a directory."""
+    path = Path(path)
+    stem = path.stem
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+            yield lambda extension: archive.open(f"{stem}.{extension}") if f"{stem}.{extension}" in names else None
+    else:
+        def open_member(extension):
+            member = path.with_suffix(f".{extension}")
+            return open(member, "rb") if member.exists() else None
+        yield open_member
+
+
+def record_count(path):
+    """The number of records in a shapefile, deleted ones included."""
+    with _members(path) as open_member, open_member("dbf") as dbf:
+        return DBF_HEADER.unpack(_read_exactly(dbf, DBF_HEADER.size))[4]
+
+
+def read_shapefile(path, precision=None, start=0, stop=None):
+    """
+    Yield the features of a shapefile, given the path to its .shp file or to a zip archive holding a shapefile of
+    the same name, optionally rounding its coordinates to `precision` decimal places. With `start` and `stop`, only
+    the records in that range are read; the .shx index locates the first of them.
+    """
+    with _members(path) as open_member, ExitStack() as stack:
+        encoding = "latin-1"
+        cpg = open_member("cpg")
+        if cpg is not None:
+            with cpg:
+                encoding = cpg.read().decode("ascii").strip() or encoding
+        shp = stack.enter_context(open_member("shp"))
+        offset = _record_offset(open_member, shp, start)
+        dbf = stack.enter_context(open_member("dbf"))
+        for geometry, properties in zip(shp_records(shp, precision, offset), dbf_records(dbf, encoding, start, stop)):
+            if properties is not None:
+                yield Feature(properties, geometry)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Point-in-polygon lookups over the consolidated places: which nation, state, county, city and ZIP code contain a
+longitude and latitude.
+
+Each place type gets its own layer: a Sort-Tile-Recursive packed R-tree over the places' bounding boxes, and their
+rings as flat coordinate arrays. A place whose box contains a point is then tested with even-odd ray casting,
+against only the edges in the horizontal band around the point. The index saves to a single file, which loads by
+memory-mapping the arrays rather than parsing them.
+
+    python3 spatial.py build us-places.ndjson us-places.spatial
+    python3 spatial.py locate us-places.spatial -- -73.9857 40.7484
+"""
+
+import argparse
+import json
+import math
+import mmap
+import multiprocessing
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+from geometry import PLACE_TYPES, rings
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+MAGIC = b"PLACESTR"
+HEADER = struct.Struct("<8sQ")
+NODE_CAPACITY = 16
+# Roughly how many edges each band of a place's rings should hold.
+BAND_EDGES = 8
+
+Match = namedtuple("Match", ["type", "id", "name"])
+
+
+def _centre(low, high):
+    """
+    The middle of a box along one axis. A place without coordinates has infinite bounds, which would make it NaN and
+    scramble the sort, so only the finite bounds count.
+    """
+    if math.isfinite(low) and math.isfinite(high):
+        return (low + high) / 2
+    finite = [bound for bound in (low, high) if math.isfinite(bound)]
+    return finite[0] if finite else 0.0
+
+
+def str_pack(boxes, capacity):
+    """
+    Pack bounding boxes into an R-tree, returning the order of the boxes in its leaves and the boxes of each of its
+    levels, leaves first, as flat arrays of (min x, min y, max x, max y).
+    """
+    if not boxes:
+        return array("q"), [array("d")]
+    leaf_count = math.ceil(len(boxes) / capacity)
+    slice_size = capacity * math.ceil(math.sqrt(leaf_count))
+    by_x = sorted(range(len(boxes)), key=lambda i: _centre(boxes[i][0], boxes[i][2]))
+    order = []
+    for start in range(0, len(by_x), slice_size):
+        order.extend(sorted(by_x[start:start + slice_size], key=lambda i: _centre(boxes[i][1], boxes[i][3])))
+
+    levels = [array("d", (value for i in order for value in boxes[i]))]
+    while len(levels[-1]) > 4:
+        lower = levels[-1]
+        upper = array("d")
+        for start in range(0, len(lower) // 4, capacity):
+            nodes = range(start, min(start + capacity, len(lower) // 4))
+            upper.extend((
+                min(lower[4 * node] for node in nodes),
+                min(lower[4 * node + 1] for node in nodes),
+                max(lower[4 * node + 2] for node in nodes),
+                max(lower[4 * node + 3] for node in nodes),
+            ))
+        levels.append(upper)
+    return array("q", order), levels
+
+
+def rtree_search(levels, order, capacity, min_x, min_y, max_x, max_y):
+    """Yield the entries, in no particular order, of an R-tree packed by `str_pack` whose boxes meet a box."""
+    if not levels:
+        return
+    top = len(levels) - 1
+    stack = [(top, node) for node in range(len(levels[top]) // 4)]
+    while stack:
+        level, node = stack.pop()
+        boxes = levels[level]
+        i = 4 * node
+        if boxes[i] <= max_x and min_x <= boxes[i + 2] and boxes[i + 1] <= max_y and min_y <= boxes[i + 3]:
+            if level == 0:
+                yield order[node]
+            else:
+                end = min((node + 1) * capacity, len(levels[level - 1]) // 4)
+                stack.extend((level - 1, child) for child in range(node * capacity, end))
+
+
+class Layer:
+    """The places of one type, and an R-tree over their bounding boxes."""
+
+    ARRAYS = ("coordinates", "ring_offsets", "place_rings", "order")
+
+    def __init__(self, place_type, places, coordinates, ring_offsets, place_rings, order, levels,
+                 node_capacity=NODE_CAPACITY):
+        self.type = place_type
+        self.places = places
+        # Vertex i of the layer is (coordinates[2i], coordinates[2i + 1]). Ring r is vertices ring_offsets[r] up to
+        # ring_offsets[r + 1], and place p is rings place_rings[p] up to place_rings[p + 1].
+        self.coordinates = coordinates
+        self.ring_offsets = ring_offsets
+        self.place_rings = place_rings
+        self.order = order
+        self.levels = levels
+        self.node_capacity = node_capacity
+        self.bands = {}
+
+    @classmethod
+    def build(cls, place_type, entries, node_capacity=NODE_CAPACITY):
+        """Build a layer from (ID, name, geometry) entries."""
+        builder = LayerBuilder(place_type)
+        for place_id, name, geometry in entries:
+            builder.add(place_id, name, geometry)
+        return builder.build(node_capacity)
+
+    def search(self, min_x, min_y, max_x, max_y):
+        """Yield the places whose bounding boxes meet a box."""
+        return rtree_search(self.levels, self.order, self.node_capacity, min_x, min_y, max_x, max_y)
+
+    def candidates(self, x, y):
+        """Yield the places whose bounding boxes contain a point."""
+        return self.search(x, y, x, y)
+
+    def banding(self, place):
+        """
+        Split a place's non-horizontal edges into horizontal bands, each listing the first vertex of every edge that
+        crosses it. Built the first time a point falls in the place's bounding box.
+        """
+        banding = self.bands.get(place)
+        if banding is not None:
+            return banding
+
+        c = self.coordinates
+        edges = []
+        for ring in range(self.place_rings[place], self.place_rings[place + 1]):
+            for vertex in range(self.ring_offsets[ring], self.ring_offsets[ring + 1] - 1):
+                if c[2 * vertex + 1] != c[2 * vertex + 3]:
+                    edges.append(vertex)
+        if not edges:
+            banding = self.bands[place] = (0.0, 1.0, [])
+            return banding
+
+        ys = [c[2 * vertex + 1] for vertex in edges] + [c[2 * vertex + 3] for vertex in edges]
+        bottom = min(ys)
+        count = max(1, min(len(edges) // BAND_EDGES, 4096))
+        height = (max(ys) - bottom) / count or 1.0
+        bands = [array("q") for _ in range(count)]
+        for vertex in edges:
+            y1, y2 = c[2 * vertex + 1], c[2 * vertex + 3]
+            first = min(int((min(y1, y2) - bottom) / height), count - 1)
+            last = min(int((max(y1, y2) - bottom) / height), count - 1)
+            for band in range(first, last + 1):
+                bands[band].append(vertex)
+        banding = self.bands[place] = (bottom, height, bands)
+        return banding
+
+    def contains(self, place, x, y):
+        bottom, height, bands = self.banding(place)
+        band = int((y - bottom) / height)
+        if band < 0 or not bands:
+            return False
+        band = min(band, len(bands) - 1)
+        c = self.coordinates
+        inside = False
+        for vertex in bands[band]:
+            x1, y1, x2, y2 = c[2 * vertex], c[2 * vertex + 1], c[2 * vertex + 2], c[2 * vertex + 3]
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+    def locate(self, x, y):
+        """Return the places containing a point, in the order they were given to the layer."""
+        return sorted(place for place in self.candidates(x, y) if self.contains(place, x, y))
+
+
+class LayerBuilder:
+    """Gathers the places of one type one at a time, keeping only their rings' coordinates, then builds a Layer."""
+
+    def __init__(self, place_type):
+        self.type = place_type
+        self.places = []
+        self.boxes = []
+        self.coordinates = array("d")
+        self.ring_offsets = array("q", [0])
+        self.place_rings = array("q", [0])
+
+    def __len__(self):
+        return len(self.places)
+
+    def add(self, place_id, name, geometry):
+        coordinates = self.coordinates
+        self.places.append((place_id, name))
+        xs, ys = [], []
+        for ring in rings(geometry):
+            for x, y, *_ in ring:
+                coordinates.extend((x, y))
+                xs.append(x)
+                ys.append(y)
+            self.ring_offsets.append(len(coordinates) // 2)
+        self.place_rings.append(len(self.ring_offsets) - 1)
+        # A place without polygons gets a box that contains nothing.
+        self.boxes.append((min(xs), min(ys), max(xs), max(ys)) if xs else (math.inf, math.inf, -math.inf, -math.inf))
+
+    def build(self, node_capacity=NODE_CAPACITY):
+        order, levels = str_pack(self.boxes, node_capacity)
+        return Layer(self.type, self.places, self.coordinates, self.ring_offsets, self.place_rings, order, levels,
+                     node_capacity)
+
+
+class SpatialIndex:
+    """Answers which places, of each type, contain a point."""
+
+    def __init__(self, layers, path=None):
+        order = {place_type: i for i, place_type in enumerate(PLACE_TYPES)}
+        self.layers = sorted(layers, key=lambda layer: order.get(layer.type, len(order)))
+        self.path = path
+
+    @classmethod
+    def from_places(cls, places, node_capacity=NODE_CAPACITY):
+        """
+        Build an index from (metadata, geometry) pairs, as written to the consolidated output. Each geometry is
+        reduced to its rings' coordinates as it arrives, so `places` can be a stream.
+        """
+        builders = {}
+        for metadata, geometry in places:
+            place_type = metadata["type"]
+            builder = builders.get(place_type)
+            if builder is None:
+                builder = builders[place_type] = LayerBuilder(place_type)
+            builder.add(metadata["id"], metadata["name"], geometry)
+        return cls([builder.build(node_capacity) for builder in builders.values()])
+
+    @classmethod
+    def from_output(cls, path, node_capacity=NODE_CAPACITY):
+        """Build an index from an uncompressed consolidated output file."""
+        def places():
+            with open(path, "rb") as stream:
+                for metadata in stream:
+                    yield json_loads(metadata), json_loads(next(stream))
+        return cls.from_places(places(), node_capacity)
+
+    def locate(self, lon, lat):
+        """Return every place containing a point, from the nation down to its ZIP code."""
+        matches = []
+        for layer in self.layers:
+            for place in layer.locate(lon, lat):
+                place_id, name = layer.places[place]
+                matches.append(Match(layer.type, place_id, name))
+        return matches
+
+    def locate_many(self, points, jobs=1, chunk_size=10000):
+        """
+        Locate a batch of (longitude, latitude) points, returning a list of matches for each in order.
+
+        With more than one job the batch is split between worker processes, each of which memory-maps the index from
+        the file it was saved to or loaded from.
+        """
+        if jobs <= 1:
+            return [self.locate(lon, lat) for lon, lat in points]
+        if self.path is None:
+            raise ValueError("Only an index that has been saved or loaded from a file can be queried in parallel")
+        points = list(points)
+        chunks = [points[start:start + chunk_size] for start in range(0, len(points), chunk_size)]
+        with multiprocessing.Pool(jobs, initializer=_init_locate_worker, initargs=(str(self.path),)) as pool:
+            return [matches for chunk in pool.imap(_locate_chunk, chunks) for matches in chunk]
+
+    def save(self, path):
+        """
+        Write the index to a file: a JSON header describing each layer, then every array it holds, 8-byte aligned.
+        """
+        blobs = []
+        offset = 0
+        layers = []
+        for layer in self.layers:
+            arrays = {name: getattr(layer, name) for name in Layer.ARRAYS}
+            arrays.update({f"level{i}": level for i, level in enumerate(layer.levels)})
+            described = {}
+            for name, values in arrays.items():
+                data = bytes(values)
+                typecode = values.typecode if isinstance(values, array) else values.format
+                described[name] = [offset, typecode, len(data)]
+                blobs.append(data + b"\0" * (-len(data) % 8))
+                offset += len(blobs[-1])
+            layers.append({
+                "type": layer.type,
+                "places": layer.places,
+                "levels": len(layer.levels),
+                "node_capacity": layer.node_capacity,
+                "arrays": described,
+            })
+
+        header = json.dumps({"layers": layers}).encode("utf-8")
+        header += b" " * (-(HEADER.size + len(header)) % 8)
+        with open(path, "wb") as stream:
+            stream.write(HEADER.pack(MAGIC, len(header)))
+            stream.write(header)
+            for blob in blobs:
+                stream.write(blob)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as stream:
+            data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a spatial index")
+        header = json.loads(data[HEADER.size:HEADER.size + header_length])
+        base = HEADER.size + header_length
+        view = memoryview(data)
+
+        layers = []
+        for described in header["layers"]:
+            arrays = {
+                name: view[base + offset:base + offset + length].cast(typecode)
+                for name, (offset, typecode, length) in described["arrays"].items()
+            }
+            levels = [arrays.pop(f"level{i}") for i in range(described["levels"])]
+            places = [tuple(place) for place in described["places"]]
+            layers.append(Layer(
+                described["type"], places, *(arrays[name] for name in Layer.ARRAYS), levels,
+                described["node_capacity"]
+            ))
+        return cls(layers, path)
+
+
+# The index each locate worker process queries.
+_worker_index = None
+
+
+def _init_locate_worker(path):
+    global _worker_index
+    _worker_index = SpatialIndex.load(path)
+
+
+def _locate_chunk(points):
+    return [_worker_index.locate(lon, lat) for lon, lat in points]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a spatial index over the consolidated places.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build an index from an uncompressed output file")
+    build.add_argument("output", help="consolidated output file to index")
+    build.add_argument("index", help="path to write the index to")
+    locate = commands.add_parser("locate", help="list the places containing a point")
+    locate.add_argument("index", help="index built by the build command")
+    locate.add_argument("lon", type=float)
+    locate.add_argument("lat", type=float)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "build":
+        SpatialIndex.from_output(args.output).save(args.index)
+    else:
+        for match in SpatialIndex.load(args.index).locate(args.lon, args.lat):
+            print(json.dumps(match._asdict()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
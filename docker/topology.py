@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Shared-boundary output: each place's geometry written as references to the arcs it shares with other places,
+TopoJSON-style, rather than as coordinates.
+
+Counties, cities and ZIP code areas share most of their boundaries with their neighbours and with their state, so
+the GeoJSON output repeats most edges several times over. `TopologyBuilder` finds the junctions of every ring of
+every place, the same way `geometry.TopologySimplifier` does, and cuts the rings into arcs at them, and at the point
+each ring starts, so that it can be rebuilt point for point. Each boundary then becomes one arc, stored once however
+many places it bounds. Coordinates are quantized to a grid of `precision` decimal places, which by default is the
+precision the inputs are rounded to, so nothing is lost, and each arc is stored as the differences between its
+successive points, which are mostly small integers.
+
+The output keeps its two lines per place. The metadata line is unchanged; the geometry line becomes a TopoJSON
+geometry, such as {"type":"Polygon","arcs":[[0,-3,7]]}, where arc ~i is arc i backwards. The arcs go in a TopoJSON
+topology file written alongside, whose "objects" are left empty. `TopologyDecoder` turns the geometries back into
+GeoJSON:
+
+    python3 topology.py encode us-places.ndjson us-places.topojson > us-places.topo.ndjson
+    python3 topology.py decode us-places.topo.ndjson us-places.topojson > us-places.ndjson
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from itertools import accumulate
+
+from geometry import add_neighbours, cut_ring, find_junctions, rings
+from writers import RecordWriter
+
+# The decimal places the geojson package rounds the inputs to.
+DEFAULT_PRECISION = 6
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"))
+
+
+class TopologyBuilder:
+    """
+    Turns a set of geometries into references to the arcs they share. Every geometry must be passed to `add()`
+    before any is passed to `encode()`, since a junction can only be recognised once all the rings through it have
+    been seen.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.factor = 10 ** precision
+        self.neighbours = {}
+        # Every ring is cut at its first point as well as at its junctions, so that it decodes starting there.
+        self.starts = set()
+        self.junctions = None
+        self.arcs = []
+        self.arc_indexes = {}
+
+    def quantize(self, ring):
+        """A ring's points, without its closing point, as integer multiples of the grid spacing."""
+        factor = self.factor
+        return [(round(point[0] * factor), round(point[1] * factor)) for point in ring[:-1]]
+
+    def add(self, geometry):
+        for ring in rings(geometry):
+            points = self.quantize(ring)
+            if points:
+                add_neighbours(self.neighbours, points)
+                self.starts.add(points[0])
+
+    def encode(self, geometry):
+        """Return the TopoJSON geometry of a Polygon or MultiPolygon; other geometries pass as is."""
+        if self.junctions is None:
+            self.junctions = find_junctions(self.neighbours) | self.starts
+            self.neighbours = self.starts = None
+        if geometry["type"] == "Polygon":
+            return {"type": "Polygon", "arcs": [self.encode_ring(ring) for ring in geometry["coordinates"]]}
+        if geometry["type"] == "MultiPolygon":
+            return {
+                "type": "MultiPolygon",
+                "arcs": [[self.encode_ring(ring) for ring in polygon] for polygon in geometry["coordinates"]],
+            }
+        return geometry
+
+    def encode_ring(self, ring):
+        points = self.quantize(ring)
+        if not points:
+            return []
+        return [self.arc_index(tuple(arc)) for arc in cut_ring(points, self.junctions)]
+
+    def arc_index(self, arc):
+        """The index of an arc, or ~index of the same arc traversed the other way, adding it if it is new."""
+        index = self.arc_indexes.get(arc)
+        if index is not None:
+            return index
+        index = self.arc_indexes.get(arc[::-1])
+        if index is not None:
+            return ~index
+        index = self.arc_indexes[arc] = len(self.arcs)
+        self.arcs.append(arc)
+        return index
+
+    @property
+    def transform(self):
+        """The TopoJSON transform, which places the grid's origin at the arcs' lowest x and y."""
+        origin = self.origin
+        return {"scale": [1 / self.factor] * 2, "translate": [origin[0] / self.factor, origin[1] / self.factor]}
+
+    @property
+    def origin(self):
+        if not self.arcs:
+            return (0, 0)
+        return (min(x for arc in self.arcs for x, _ in arc), min(y for arc in self.arcs for _, y in arc))
+
+    def delta_arcs(self):
+        """Yield each arc as the differences between its successive points, starting from the origin."""
+        origin_x, origin_y = self.origin
+        for arc in self.arcs:
+            previous_x, previous_y = origin_x, origin_y
+            deltas = []
+            for x, y in arc:
+                deltas.append([x - previous_x, y - previous_y])
+                previous_x, previous_y = x, y
+            yield deltas
+
+    def write(self, path):
+        """Write the arcs as a TopoJSON topology, one arc per line."""
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write(f'{{"type":"Topology","transform":{_dumps(self.transform)},"objects":{{}},"arcs":[\n')
+            for i, arc in enumerate(self.delta_arcs()):
+                if i:
+                    stream.write(",\n")
+                stream.write(_dumps(arc))
+            stream.write("\n]}\n")
+
+
+class TopologyWriter(RecordWriter):
+    """
+    Writes the output with each geometry as a TopoJSON geometry, and the arcs they refer to as a topology at `path`.
+    The arcs can only be known once every place has been seen, so the output is spooled to a file beside `path`, and
+    written out to `stream` when the writer is closed.
+    """
+
+    def __init__(self, stream, path, precision=DEFAULT_PRECISION):
+        super().__init__()
+        self.stream = stream
+        self.path = path
+        self.builder = TopologyBuilder(precision)
+        self.spool_path = f"{path}.tmp"
+        self.spool = open(self.spool_path, "wb")
+
+    def write_record(self, metadata, geometry, place=None):
+        self.builder.add(json.loads(geometry))
+        self.spool.write(b"".join((metadata, b"\n", geometry, b"\n")))
+
+    def close(self):
+        super().close()
+        self.spool.close()
+        with open(self.spool_path, "rb") as spool:
+            for metadata in spool:
+                geometry = self.builder.encode(json.loads(next(spool)))
+                self.stream.write(metadata + _dumps(geometry).encode("utf-8") + b"\n")
+        os.unlink(self.spool_path)
+        self.stream.close()
+        self.builder.write(self.path)
+
+
+class TopologyDecoder:
+    """
+    Rebuilds GeoJSON geometries from TopoJSON geometries and the topology holding their arcs.
+
+        decoder = TopologyDecoder.load("us-places.topojson")
+        geometry = decoder.geometry({"type": "Polygon", "arcs": [[0, -3, 7]]})
+
+    When the topology's grid spacing is a power of ten, as it is in topologies written by `TopologyBuilder`, this
+    gives back exactly the coordinates the arcs were built from.
+    """
+
+    def __init__(self, topology):
+        transform = topology.get("transform")
+        self.scale = transform["scale"] if transform else None
+        self.translate = transform["translate"] if transform else None
+        self.factor = None
+        if transform:
+            decimals = -math.log10(self.scale[0])
+            if self.scale[0] == self.scale[1] and decimals == round(decimals):
+                # A whole number of grid steps divided by a power of ten is exactly the float that the decimal
+                # coordinate it stands for parses to, so no rounding is needed.
+                self.factor = 10 ** round(decimals)
+                self.origin = (round(self.translate[0] * self.factor), round(self.translate[1] * self.factor))
+        self.encoded = topology["arcs"]
+        # Arcs are decoded the first time a geometry refers to them.
+        self.decoded = [None] * len(self.encoded)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as stream:
+            return cls(json.load(stream))
+
+    def arc(self, index):
+        """The points of an arc, or of arc ~index backwards if `index` is negative."""
+        forward = index if index >= 0 else ~index
+        points = self.decoded[forward]
+        if points is None:
+            points = self.decoded[forward] = self._decode(self.encoded[forward])
+        return points if index >= 0 else points[::-1]
+
+    def _decode(self, arc):
+        if self.scale is None:
+            return [(point[0], point[1]) for point in arc]
+        xs = accumulate(point[0] for point in arc)
+        ys = accumulate(point[1] for point in arc)
+        if self.factor is not None:
+            factor = self.factor
+            origin_x, origin_y = self.origin
+            return [((x + origin_x) / factor, (y + origin_y) / factor) for x, y in zip(xs, ys)]
+        (scale_x, scale_y), (translate_x, translate_y) = self.scale, self.translate
+        return [(x * scale_x + translate_x, y * scale_y + translate_y) for x, y in zip(xs, ys)]
+
+    def ring(self, arcs):
+        """Join a ring's arcs, each of which starts where the one before it ends."""
+        points = []
+        for index in arcs:
+            arc = self.arc(index)
+            points.extend(arc[1:] if points else arc)
+        return [[x, y] for x, y in points]
+
+    def geometry(self, geometry):
+        """Return the GeoJSON of a TopoJSON Polygon or MultiPolygon; other geometries pass as is."""
+        if geometry["type"] == "Polygon":
+            return {"type": "Polygon", "coordinates": [self.ring(ring) for ring in geometry["arcs"]]}
+        if geometry["type"] == "MultiPolygon":
+            return {
+                "type": "MultiPolygon",
+                "coordinates": [[self.ring(ring) for ring in polygon] for polygon in geometry["arcs"]],
+            }
+        return geometry
+
+
+def encode(output, topology_path, stream, precision=DEFAULT_PRECISION):
+    """Rewrite a consolidated output file with shared-arc geometries to `stream`, writing the arcs to `topology_path`."""
+    writer = TopologyWriter(stream, topology_path, precision)
+    with open(output, "rb") as places:
+        for chunk in iter(lambda: places.read(1 << 20), b""):
+            writer.write(chunk)
+    writer.close()
+
+
+def decode(output, topology_path, stream):
+    """Rewrite an output file with shared-arc geometries to `stream`, with each geometry as GeoJSON again."""
+    decoder = TopologyDecoder.load(topology_path)
+    with open(output, "rb") as places:
+        for metadata in places:
+            geometry = decoder.geometry(json.loads(next(places)))
+            stream.write(metadata + json.dumps(geometry).encode("utf-8") + b"\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the consolidated places to or from shared-arc geometries.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    encoding = commands.add_parser("encode", help="write an output file's geometries as references to shared arcs")
+    encoding.add_argument("output", help="consolidated output file with GeoJSON geometries")
+    encoding.add_argument("topology", help="path to write the arcs to")
+    encoding.add_argument(
+        "--precision", type=int, default=DEFAULT_PRECISION, metavar="DECIMALS",
+        help=f"quantize coordinates to this many decimal places (default: {DEFAULT_PRECISION})"
+    )
+    decoding = commands.add_parser("decode", help="write an encoded output file's geometries as GeoJSON again")
+    decoding.add_argument("output", help="output file written by the encode command or with --topology")
+    decoding.add_argument("topology", help="the arcs written with it")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stream = open(sys.stdout.fileno(), "wb", buffering=1 << 20, closefd=False)
+    if args.command == "encode":
+        encode(args.output, args.topology, stream, args.precision)
+    else:
+        decode(args.output, args.topology, stream)
+        stream.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
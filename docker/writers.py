@@ -0,0 +1,208 @@
+"""Writers that take the consolidated output apart place by place, rather than passing it straight through."""
+
+import gzip
+import json
+from pathlib import Path
+
+from place_index import INDEX_SUFFIX, PlaceIndexBuilder
+from spatial import json_loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SHARD_KEYS = ("none", "type", "state")
+COMPRESSIONS = {"none": ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+BLOCK_SIZE = 1 << 20
+INDEX_FILE = "index.json"
+
+
+class RecordWriter:
+    """
+    Accepts the output as arbitrary chunks of bytes, and hands each place to `write_record` as its two lines: the
+    metadata JSON and the geometry JSON, without their newlines.
+
+    A writer that passes the output on to another RecordWriter hands it each place whole, with the metadata it has
+    already parsed, so that the metadata is parsed once however many writers are chained.
+    """
+
+    def __init__(self):
+        self.pending = b""
+        self.metadata = None
+
+    def write(self, chunk):
+        lines = (self.pending + chunk).split(b"\n")
+        self.pending = lines.pop()
+        for line in lines:
+            if self.metadata is None:
+                self.metadata = line
+            else:
+                self.write_record(self.metadata, line)
+                self.metadata = None
+
+    def write_record(self, metadata, geometry, place=None):
+        """Take one place. `place` is its parsed metadata, if a writer before this one has parsed it."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def parsed(metadata, place):
+        return json_loads(metadata) if place is None else place
+
+    @staticmethod
+    def pass_record(stream, metadata, geometry, place):
+        """Pass a place on to `stream`, with its parsed metadata if `stream` is another RecordWriter."""
+        if isinstance(stream, RecordWriter):
+            stream.write_record(metadata, geometry, place)
+        else:
+            stream.write(b"".join((metadata, b"\n", geometry, b"\n")))
+
+    def close(self):
+        if self.pending or self.metadata is not None:
+            raise ValueError("The output ended partway through a place")
+
+
+def compressor(compression):
+    """Return a function that compresses one block into a self-contained gzip member or zstd frame."""
+    if compression == "gzip":
+        return lambda data: gzip.compress(data, mtime=0)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression was requested, but the zstandard package is not installed")
+        return zstandard.ZstdCompressor().compress
+    return None
+
+
+class IndexedStreamWriter(RecordWriter):
+    """Passes the output through to a binary stream, writing an index of where each place is to `index_path`."""
+
+    def __init__(self, stream, index_path):
+        super().__init__()
+        self.stream = stream
+        self.index_path = index_path
+        self.index = PlaceIndexBuilder()
+        self.offset = 0
+
+    def write_record(self, metadata, geometry, place=None):
+        place = self.parsed(metadata, place)
+        self.index.add(place["type"], place["id"], self.offset, len(metadata), len(geometry))
+        self.pass_record(self.stream, metadata, geometry, place)
+        self.offset += len(metadata) + len(geometry) + 2
+
+    def close(self):
+        super().close()
+        self.stream.close()
+        self.index.write(self.index_path)
+
+
+class Shard:
+    """
+    One output file, written as a series of blocks of whole places. When the shard is compressed, each block is
+    compressed independently, so a reader can seek to any block's offset and decompress from there. When it is not,
+    an index of where each place is in the shard is written alongside it.
+    """
+
+    def __init__(self, directory, name, compression, block_size):
+        self.name = name + COMPRESSIONS[compression]
+        self.file = open(Path(directory) / self.name, "wb")
+        self.compress = compressor(compression)
+        self.index = PlaceIndexBuilder() if self.compress is None else None
+        self.block_size = block_size
+        self.block = []
+        self.block_bytes = 0
+        self.records = 0
+        self.uncompressed_bytes = 0
+        self.blocks = []
+
+    def add(self, place, metadata, geometry):
+        record = b"".join((metadata, b"\n", geometry, b"\n"))
+        if self.index is not None:
+            offset = self.uncompressed_bytes + self.block_bytes
+            self.index.add(place["type"], place["id"], offset, len(metadata), len(geometry))
+        self.block.append(record)
+        self.block_bytes += len(record)
+        if self.block_bytes >= self.block_size:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.block:
+            return
+        data = b"".join(self.block)
+        if self.compress is not None:
+            data = self.compress(data)
+        self.blocks.append({
+            "offset": self.file.tell(),
+            "length": len(data),
+            "first_record": self.records,
+            "records": len(self.block),
+            "uncompressed_length": self.block_bytes,
+        })
+        self.file.write(data)
+        self.records += len(self.block)
+        self.uncompressed_bytes += self.block_bytes
+        self.block = []
+        self.block_bytes = 0
+
+    def close(self):
+        self.flush_block()
+        self.file.close()
+        if self.index is not None:
+            self.index.write(self.file.name + INDEX_SUFFIX)
+
+    @property
+    def description(self):
+        return {
+            "name": self.name,
+            "records": self.records,
+            "bytes": sum(block["length"] for block in self.blocks),
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "blocks": self.blocks,
+        }
+
+
+class ShardedWriter(RecordWriter):
+    """
+    Writes the output to a directory as one or more shards, split by place type or by state, and an index listing
+    each shard's record count and the byte offset of each of its blocks.
+    """
+
+    def __init__(self, directory, shard_by="none", compression="none", block_size=BLOCK_SIZE):
+        super().__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.shard_by = shard_by
+        self.compression = compression
+        self.block_size = block_size
+        self.shards = {}
+        # Fail now, rather than at the first place, if the compression is unavailable.
+        compressor(compression)
+
+    def shard_name(self, place):
+        if self.shard_by == "type":
+            return place["type"]
+        if self.shard_by == "state":
+            # States, and places outside any state, go in the shard named for their own ID.
+            if place["type"] in ("nation", "state") or place["parent_id"] is None:
+                return f"state-{place['id']}"
+            return f"state-{place['parent_id']}"
+        return "us-places"
+
+    def write_record(self, metadata, geometry, place=None):
+        place = self.parsed(metadata, place)
+        name = self.shard_name(place)
+        shard = self.shards.get(name)
+        if shard is None:
+            shard = self.shards[name] = Shard(self.directory, name, self.compression, self.block_size)
+        shard.add(place, metadata, geometry)
+
+    def close(self):
+        super().close()
+        for shard in self.shards.values():
+            shard.close()
+        index = {
+            "shard_by": self.shard_by,
+            "compression": self.compression,
+            "shards": [shard.description for shard in self.shards.values()],
+        }
+        (self.directory / INDEX_FILE).write_text(json.dumps(index, indent=1))